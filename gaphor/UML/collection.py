@@ -4,6 +4,7 @@
 
 import inspect
 from event import AssociationChangeEvent
+from gaphor.misc.odict import odict
 from gaphor.misc.listmixins import querymixin, recursemixin, recurseproxy, getslicefix
 
 
@@ -48,16 +49,50 @@ class collectionlist(recursemixin, querymixin, getslicefix, list):
 class collection(object):
     """
     Collection (set-like) for model elements' 1:n and n:m relationships.
+
+    The members are kept in an ordered set (an odict), so membership
+    tests, adding and removing values are O(1) and the order of the values
+    is retained. ``items`` is a (read only) list of the values, that is
+    created when needed.
     """
 
     def __init__(self, property, object, type):
         self.property = property
         self.object = object
         self.type = type
-        self.items = collectionlist()
+        self._members = odict()
+        self._items = None
+
+    def _get_items(self):
+        items = self._items
+        if items is None:
+            items = self._items = collectionlist(self._members)
+        return items
+
+    items = property(_get_items)
+
+    def _append(self, value):
+        """
+        Add value to the collection, without any checks or notifications
+        (used by the association property).
+        """
+        self._members[value] = None
+        self._items = None
+
+    def _discard(self, value):
+        """
+        Remove value from the collection, without notifications (used by
+        the association property). Returns True if value was a member.
+        """
+        try:
+            del self._members[value]
+        except KeyError:
+            return False
+        self._items = None
+        return True
 
     def __len__(self):
-        return len(self.items)
+        return len(self._members)
 
     def __setitem__(self, key, value):
         raise RuntimeError, 'items should not be overwritten.'
@@ -69,7 +104,7 @@ class collection(object):
         return self.items.__getitem__(key)
 
     def __contains__(self, obj):
-        return self.items.__contains__(obj)
+        return obj in self._members
 
     def __iter__(self):
         return iter(self.items)
@@ -80,7 +115,7 @@ class collection(object):
     __repr__ = __str__
 
     def __nonzero__(self):
-        return self.items!=[]
+        return bool(self._members)
 
     def append(self, value):
         if isinstance(value, self.type):
@@ -88,8 +123,16 @@ class collection(object):
         else:
             raise TypeError, 'Object is not of type %s' % self.type.__name__
 
+    def extend(self, values):
+        """
+        Add all values to the collection at once. Only one event is sent
+        for this end of the association (see association.set_many()).
+        AttributeError is raised if a value is of the wrong type.
+        """
+        self.property.set_many(self.object, values)
+
     def remove(self, value):
-        if value in self.items:
+        if value in self._members:
             self.property.__delete__(self.object, value)
         else:
             raise ValueError, '%s not in collection' % value
@@ -106,30 +149,27 @@ class collection(object):
     # OCL members (from SMW by Ivan Porres, http://www.abo.fi/~iporres/smw)
 
     def size(self):
-        return len(self.items)
+        return len(self._members)
 
     def includes(self,o):
-        return o in self.items
+        return o in self._members
 
     def excludes(self,o):
         return not self.includes(o)
 
     def count(self,o):
-        c=0
-        for x in self.items:
-            if x==o:
-                c=c+1
-        return c
+        # Values occur only once in a collection
+        return int(o in self._members)
 
     def includesAll(self,c):
         for o in c:
-            if o not in self.items:
+            if o not in self._members:
                 return 0
         return 1
 
     def excludesAll(self,c):
         for o in c:
-            if o in self.items:
+            if o in self._members:
                 return 0
         return 1
 
@@ -154,7 +194,7 @@ class collection(object):
         return result
 
     def isEmpty(self):
-        return len(self.items)==0
+        return not self._members
 
     def nonEmpty(self):
         return not self.isEmpty()
@@ -232,19 +272,16 @@ class collection(object):
         Swap two elements. Return true if swap was successful.
         """
         try:
-            i1 = self.items.index(item1)
-            i2 = self.items.index(item2)
-            self.items[i1], self.items[i2] = self.items[i2], self.items[i1]
-
-            # send a notification that this list has changed
-            factory = self.object.factory
-            if factory:
-                factory._handle(AssociationChangeEvent(self.object, self.property))
-            return True
-        except IndexError, ex:
-            return False
-        except ValueError, ex:
+            self._members.swap(item1, item2)
+        except KeyError, ex:
             return False
+        self._items = None
+
+        # send a notification that this list has changed
+        factory = self.object.factory
+        if factory:
+            factory._handle(AssociationChangeEvent(self.object, self.property))
+        return True
 
 
 # vi:sw=4:et:ai
@@ -5,7 +5,7 @@ representation of a UML diagram. Diagrams can be visualized and edited.
 The DiagramCanvas class extends the gaphas.Canvas class."""
 
 import gaphas
-import uuid
+from gaphor.misc.uniqueid import generate_id
 from uml2 import Namespace, PackageableElement
 
 class DiagramCanvas(gaphas.Canvas):
@@ -67,7 +67,30 @@ class Diagram(Namespace, PackageableElement):
         The diagram also has a canvas."""
         
         super(Diagram, self).__init__(id, factory)
-        self.canvas = DiagramCanvas(self)
+        self._canvas = DiagramCanvas(self)
+        self._canvas_loader = None
+
+    def _get_canvas(self):
+        """Return the diagram canvas.  If the canvas contents are deferred
+        (see defer_canvas()), the canvas items are created first."""
+
+        loader = self._canvas_loader
+        if loader:
+            self._canvas_loader = None
+            loader(self._canvas)
+        return self._canvas
+
+    canvas = property(_get_canvas)
+
+    canvas_loaded = property(lambda s: s._canvas_loader is None,
+                             doc="False if the canvas items are not yet created.")
+
+    def defer_canvas(self, loader):
+        """Defer the creation of the canvas items until the canvas is first
+        accessed.  Loader is called with the (empty) canvas as argument.
+        This is used to load diagrams on demand."""
+
+        self._canvas_loader = loader
 
     def save(self, save_func):
         """Apply the supplied save function to this diagram and the canvas."""
@@ -76,9 +99,12 @@ class Diagram(Namespace, PackageableElement):
         save_func('canvas', self.canvas)
 
     def postload(self):
-        """Handle post-load functionality for the diagram canvas."""
+        """Handle post-load functionality for the diagram canvas.  Deferred
+        canvas items are not created here, the canvas loader takes care of
+        their post-load."""
         super(Diagram, self).postload()
-        self.canvas.postload()
+        if self.canvas_loaded:
+            self._canvas.postload()
 
     def create(self, type, parent=None, subject=None):
         """Create a new canvas item on the canvas. It is created with
@@ -87,16 +113,18 @@ class Diagram(Namespace, PackageableElement):
         optional parent and subject."""
         
         assert issubclass(type, gaphas.Item)
-        obj = type(str(uuid.uuid1()))
+        obj = type(generate_id())
         if subject:
             obj.subject = subject
         self.canvas.add(obj, parent)
         return obj
 
     def unlink(self):
-        """Unlink all canvas items then unlink this diagram."""
+        """Unlink all canvas items then unlink this diagram.  Deferred
+        canvas items are never created."""
         
-        for item in self.canvas.get_all_items():
+        self._canvas_loader = None
+        for item in self._canvas.get_all_items():
             try:
                 item.unlink()
             except:
@@ -5,15 +5,126 @@ Base class for UML model elements.
 
 __all__ = [ 'Element' ]
 
-import threading
-import uuid
-from properties import umlproperty
+from gaphor.misc.uniqueid import generate_id
+from properties import umlproperty, attribute, enumeration, association, \
+                       associationstub, derived, redefine
+
+
+def _overrides(prop, method):
+    """
+    Return True if the property class overrides a method of umlproperty.
+    """
+    return getattr(type(prop), method).im_func \
+            is not getattr(umlproperty, method).im_func
+
+
+def _effective(prop):
+    """
+    Redefines that have the same name as the original property delegate
+    load, save, postload and unlink to the original property. Return the
+    property that does the actual work, or None for other redefines.
+    """
+    while isinstance(prop, redefine):
+        if prop.original.name != prop.name:
+            return None
+        prop = prop.original
+    return prop
+
+
+class PropertyPlan(object):
+    """
+    The UML properties of an element class, split by kind (attributes,
+    enumerations, associations, derived, redefines and association stubs)
+    and by the operations that have to be performed on them (save,
+    postload and unlink). Properties are in the order of dir().
+    Plans are created by ElementMeta.umlplan().
+    """
+
+    def __init__(self, class_):
+        props = []
+        by_name = {}
+        for propname in dir(class_):
+            if not propname.startswith('_'):
+                prop = getattr(class_, propname)
+                if isinstance(prop, umlproperty):
+                    props.append(prop)
+                    by_name[propname] = prop
+
+        def kind(type):
+            return tuple(p for p in props if isinstance(p, type))
+
+        self.all = tuple(props)
+        self.by_name = by_name
+        self.attributes = kind(attribute)
+        self.enumerations = kind(enumeration)
+        self.associations = kind(association)
+        self.derived = kind(derived)
+        self.redefines = kind(redefine)
+        self.stubs = kind(associationstub)
+
+        effective = filter(None, map(_effective, props))
+        self.save = tuple(p for p in effective
+                          if not isinstance(p, (derived, associationstub)))
+        self.postload = tuple(p for p in effective if _overrides(p, 'postload'))
+        self.unlink = tuple(p for p in effective if _overrides(p, 'unlink'))
+        self._subsets = {}
+
+    def subsets(self, union):
+        """
+        Return the subsets of derived union ``union`` the class has a
+        property for (by name). The other subsets never have a value for
+        instances of the class.
+        """
+        try:
+            return self._subsets[union]
+        except KeyError:
+            by_name = self.by_name
+            subsets = tuple(s for s in union.subsets if s.name in by_name)
+            self._subsets[union] = subsets
+            return subsets
+
+
+class ElementMeta(type):
+    """
+    Metaclass for Element. The PropertyPlan of a class is computed once, on
+    first use. Since changes to a class affect its subclasses as well, all
+    plans are dropped when an element class is modified (e.g. when the
+    properties are set in gaphor.UML.uml2, or an association stub is added).
+    """
+
+    _plans = {}
+
+    def umlplan(cls):
+        """
+        Return the PropertyPlan for this class.
+        """
+        plans = ElementMeta._plans
+        try:
+            return plans[cls]
+        except KeyError:
+            plan = plans[cls] = PropertyPlan(cls)
+            return plan
+
+    def __setattr__(cls, name, value):
+        type.__setattr__(cls, name, value)
+        ElementMeta._plans.clear()
+
+    def __delattr__(cls, name):
+        type.__delattr__(cls, name)
+        ElementMeta._plans.clear()
 
 
 class Element(object):
     """
     Base class for UML data classes.
+
+    The classes generated in gaphor.UML.uml2 store the values of their
+    properties in __slots__. Other attributes are stored in the __dict__,
+    which is only created when it's used.
     """
+    __metaclass__ = ElementMeta
+
+    __slots__ = ('_id', '_factory', '_unlinking', '__dict__', '__weakref__')
 
     def __init__(self, id=None, factory=None):
         """
@@ -28,10 +139,10 @@ class Element(object):
         Factory can be provided to refer to the class that maintains the
         lifecycle of the element.
         """
-        self._id = id or (id is not False and str(uuid.uuid1()) or False)
+        self._id = id or (id is not False and generate_id() or False)
         # The factory this element belongs to.
         self._factory = factory
-        self._unlink_lock = threading.Lock()
+        self._unlinking = False
 
 
     id = property(lambda self: self._id, doc='Id')
@@ -45,20 +156,14 @@ class Element(object):
         """
         Iterate over all UML properties 
         """
-        umlprop = umlproperty
-        class_ = type(self)
-        for propname in dir(class_):
-            if not propname.startswith('_'):
-                prop = getattr(class_, propname)
-                if isinstance(prop, umlprop):
-                    yield prop
+        return iter(type(self).umlplan().all)
 
 
     def save(self, save_func):
         """
         Save the state by calling save_func(name, value).
         """
-        for prop in self.umlproperties():
+        for prop in type(self).umlplan().save:
             prop.save(self, save_func)
 
 
@@ -67,6 +172,14 @@ class Element(object):
         Loads value in name. Make sure that for every load postload()
         should be called.
         """
+        try:
+            prop = type(self).umlplan().by_name[name]
+        except KeyError:
+            pass
+        else:
+            prop.load(self, value)
+            return
+
         try:
             prop = getattr(type(self), name)
         except AttributeError, e:
@@ -80,30 +193,30 @@ class Element(object):
         """
         Fix up the odds and ends.
         """
-        for prop in self.umlproperties():
+        for prop in type(self).umlplan().postload:
             prop.postload(self)
 
 
     def unlink(self):
-        
-        """Unlink the element. All the elements references are destroyed.
-        
-        The unlink lock is acquired while unlinking this elements properties
-        to avoid recursion problems."""
-        
-        if self._unlink_lock.locked():
-            
+        """
+        Unlink the element. All the elements references are destroyed.
+
+        While the properties are unlinked, the element is marked as
+        unlinking, so unlink() calls caused by unlinking a property
+        return immediately.
+        """
+        if self._unlinking:
             return
-        
-        with self._unlink_lock:
-            
-            for prop in self.umlproperties():
-                
+
+        self._unlinking = True
+        try:
+            for prop in type(self).umlplan().unlink:
                 prop.unlink(self)
-                
+
             if self._factory:
-            
                 self._factory._unlink_element(self)
+        finally:
+            self._unlinking = False
 
     # OCL methods: (from SMW by Ivan Porres (http://www.abo.fi/~iporres/smw))
 
@@ -123,6 +236,11 @@ class Element(object):
 
     def __getstate__(self):
         d = dict(self.__dict__)
+        for name in _slot_names(type(self)):
+            try:
+                d[name] = getattr(self, name)
+            except AttributeError:
+                pass
         try:
             del d['_factory']
         except KeyError:
@@ -132,7 +250,21 @@ class Element(object):
 
     def __setstate__(self, state):
         self._factory = None
-        self.__dict__.update(state)
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+
+def _slot_names(class_):
+    """
+    Return the names of all attributes stored in slots by class_ and its
+    base classes.
+    """
+    names = []
+    for c in class_.__mro__:
+        for name in c.__dict__.get('__slots__', ()):
+            if name not in ('__dict__', '__weakref__'):
+                names.append(name)
+    return names
 
 
 try:
@@ -5,13 +5,16 @@ Factory for and registration of model elements.
 
 from zope import interface
 from zope import component
-import uuid
+from itertools import count
+from operator import itemgetter
 from gaphor.core import inject
 from gaphor.misc import odict
+from gaphor.misc.uniqueid import generate_id
 from gaphor.interfaces import IService, IEventFilter
 from gaphor.UML.interfaces import IElementCreateEvent, IElementDeleteEvent, \
                                   IFlushFactoryEvent, IModelFactoryEvent, \
-                                  IElementChangeEvent, IElementEvent
+                                  IElementChangeEvent, IElementEvent, \
+                                  IAssociationExtendEvent
 from gaphor.UML.event import ElementCreateEvent, ElementDeleteEvent, \
                              FlushFactoryEvent, ModelFactoryEvent
 from gaphor.UML.element import Element
@@ -30,16 +33,40 @@ class ElementFactory(object):
     model - a new model has been loaded (element is None)
     flush - model is flushed: all element are removed from the factory
             (element is None)
+
+    Elements are also indexed by class, so select_type() only has to visit
+    the elements of the requested type.
+
+    With compact_ids, elements get small integers as id. The (UUID like)
+    string ids used in saved models are kept in a table and looked up by
+    persistent_id(). Elements created with create() only get a string id
+    when they are saved. lookup() accepts both kinds of ids.
+
+    Parts of the model can be loaded on demand. A loader function is
+    registered with defer() for every element that is affected by such a
+    part (e.g. the presentation of an element that is shown on a diagram
+    that is not loaded yet). See gaphor.UML.properties.deferredassociation.
     """
-    def __init__(self):
+    def __init__(self, compact_ids=False):
         self._elements = odict.odict()
+        self._types = {}
+        self._seq = count()
         self._observers = list()
+        self.compact_ids = compact_ids
+        self._handles = count(1)
+        self._persistent_ids = {}
+        self._handle_ids = {}
+        self._deferred = {}
 
     def create(self, type):
         """
         Create a new model element of type ``type``.
         """
-        obj = self.create_as(type, str(uuid.uuid1()))
+        if self.compact_ids:
+            id = self._handles.next()
+        else:
+            id = generate_id()
+        obj = self.create_as(type, id)
         return obj
 
     def create_as(self, type, id):
@@ -49,8 +76,10 @@ class ElementFactory(object):
         not emit an ElementCreateEvent event.
         """
         assert issubclass(type, Element)
+        if self.compact_ids and isinstance(id, basestring):
+            id = self._new_handle(id)
         obj = type(id, self)
-        self._elements[id] = obj
+        self._add_element(obj)
         return obj
 
     def bind(self, element):
@@ -60,12 +89,89 @@ class ElementFactory(object):
         """
         if hasattr(element, '_factory') and element._factory:
             raise AttributeError, "element is already bound"
-        if self._elements.get(element.id):
+        if self.lookup(element.id):
             raise AttributeError, "an element already exists with the same id"
 
+        if self.compact_ids:
+            # Integer ids of another factory are meaningless here
+            if isinstance(element.id, basestring):
+                element._id = self._new_handle(element.id)
+            else:
+                element._id = self._handles.next()
         element._factory = self
+        self._add_element(element)
+
+    def _new_handle(self, persistent_id):
+        """
+        Allocate a compact id for the element saved as ``persistent_id``.
+        """
+        handle = self._handles.next()
+        self._persistent_ids[handle] = persistent_id
+        self._handle_ids[persistent_id] = handle
+        return handle
+
+    def persistent_id(self, id):
+        """
+        Return the id to save element ``id`` with. Compact ids are
+        translated to the string id the element was loaded with. Elements
+        that have not been saved before are given a new one. String ids
+        are returned as is.
+        """
+        if isinstance(id, basestring):
+            return id
+        try:
+            return self._persistent_ids[id]
+        except KeyError:
+            persistent_id = self._persistent_ids[id] = generate_id()
+            self._handle_ids[persistent_id] = id
+            return persistent_id
+
+    def _add_element(self, element):
+        """
+        Register ``element`` in the factory and in the index of its class.
+        The position of the element in the factory is recorded, so
+        select_type() can return elements in factory order.
+        """
         self._elements[element.id] = element
-        
+        self._types.setdefault(type(element), {})[element.id] = \
+                (self._seq.next(), element)
+
+    def _remove_element(self, element):
+        """
+        Remove ``element`` from the factory and from the index of its class.
+        Returns the factory position of the element, or None if the element
+        was not registered.
+        """
+        try:
+            del self._elements[element.id]
+        except KeyError:
+            return None
+        elements = self._types[type(element)]
+        seq, _ = elements.pop(element.id)
+        if not elements:
+            del self._types[type(element)]
+        return seq
+
+    def defer(self, element, loader):
+        """
+        Register function ``loader`` to complete ``element``. The loader is
+        called without arguments by load_deferred(), before a deferred
+        property of the element is used.
+        """
+        try:
+            self._deferred[element.id].append(loader)
+        except KeyError:
+            self._deferred[element.id] = [ loader ]
+
+    def load_deferred(self, element):
+        """
+        Call the loaders registered for ``element``, if any.
+        """
+        if self._deferred:
+            loaders = self._deferred.pop(element.id, None)
+            if loaders:
+                for loader in loaders:
+                    loader()
 
     def size(self):
         """
@@ -76,8 +182,11 @@ class ElementFactory(object):
 
     def lookup(self, id):
         """
-        Find element with a specific id.
+        Find element with a specific id. With compact ids, the persistent
+        id of an element can be used as well.
         """
+        if self.compact_ids and isinstance(id, basestring):
+            id = self._handle_ids.get(id, id)
         return self._elements.get(id)
 
 
@@ -108,6 +217,25 @@ class ElementFactory(object):
         return list(self.select(expression))
 
 
+    def select_type(self, type, include_subclasses=True):
+        """
+        Return a list of the elements of class ``type``, in factory order.
+        Instances of subclasses of ``type`` are included, unless
+        ``include_subclasses`` is False.
+
+        Only the elements of the matching classes are visited, unlike
+        ``select(lambda e: isinstance(e, type))``.
+        """
+        if include_subclasses:
+            entries = [ entry for cls, elements in self._types.iteritems()
+                              if issubclass(cls, type)
+                              for entry in elements.itervalues() ]
+        else:
+            entries = self._types.get(type, {}).values()
+        entries.sort(key=itemgetter(0))
+        return [ element for seq, element in entries ]
+
+
     def keys(self):
         """
         Return a list with all id's in the factory.
@@ -150,14 +278,21 @@ class ElementFactory(object):
         are blocked.  The remaining elements are then flushed.
         """
         
+        # Do not load deferred model parts that are thrown away anyway
+        self._deferred.clear()
+
         flush_element = self._flush_element
-        for element in self.lselect(lambda e: isinstance(e, Diagram)):
-            element.canvas.block_updates = True
+        for element in self.select_type(Diagram):
+            if element.canvas_loaded:
+                element.canvas.block_updates = True
             flush_element(element)
                 
         for element in self.lselect():
             flush_element(element)
 
+        self._persistent_ids.clear()
+        self._handle_ids.clear()
+
     def _flush_element(self, element):
         element.unlink()
 
@@ -165,15 +300,17 @@ class ElementFactory(object):
         """
         NOTE: Invoked from Element.unlink() to perform an element unlink.
         """
-        try:
-            del self._elements[element.id]
-        except KeyError:
-            pass
+        self._remove_element(element)
 
     def swap_element(self, element, new_class):
-	assert element in self._elements.values()
+        assert self._elements.get(element.id) is element
         if element.__class__ is not new_class:
+            old = self._types[element.__class__]
+            entry = old.pop(element.id)
+            if not old:
+                del self._types[element.__class__]
             element.__class__ = new_class
+            self._types.setdefault(new_class, {})[element.id] = entry
 
     def _handle(self, event):
         """
@@ -186,16 +323,95 @@ class ElementFactory(object):
 class ElementFactoryService(ElementFactory):
     """
     Service version of the ElementFctory.
+
+    The service keeps track of the elements that are created, changed and
+    deleted since the model was loaded or saved, so the model can be saved
+    incrementally. Changes to diagram items mark their diagram as changed.
     """
     interface.implements(IService)
 
     component_registry = inject('component_registry')
 
+    def __init__(self, compact_ids=False):
+        super(ElementFactoryService, self).__init__(compact_ids)
+        self._changed = odict.odict()
+        self._deleted = set()
+
     def init(self, app):
-        pass
+        self.component_registry.register_handler(self._element_created)
+        self.component_registry.register_handler(self._element_changed)
+        self.component_registry.register_handler(self._element_deleted)
+        self.component_registry.register_handler(self._model_loaded)
+        self.component_registry.register_handler(self._model_flushed)
 
     def shutdown(self):
         self.flush()
+        self.component_registry.unregister_handler(self._element_created)
+        self.component_registry.unregister_handler(self._element_changed)
+        self.component_registry.unregister_handler(self._element_deleted)
+        self.component_registry.unregister_handler(self._model_loaded)
+        self.component_registry.unregister_handler(self._model_flushed)
+
+    def changed_elements(self):
+        """
+        Return the elements that have been created or changed since the
+        last call to clear_changes().
+        """
+        lookup = self._elements.get
+        return filter(None, map(lookup, self._changed.keys()))
+
+    def deleted_elements(self):
+        """
+        Return the (persistent) ids of the elements that have been deleted
+        since the last call to clear_changes().
+        """
+        return set(map(self.persistent_id, self._deleted))
+
+    def clear_changes(self):
+        """
+        Forget about changed and deleted elements, e.g. after the model has
+        been saved.
+        """
+        self._changed.clear()
+        self._deleted.clear()
+
+    def _mark_changed(self, element):
+        if element.id in self._elements:
+            self._changed[element.id] = True
+        else:
+            # Diagram items are not in the factory, mark their diagram
+            canvas = getattr(element, 'canvas', None)
+            diagram = getattr(canvas, 'diagram', None)
+            if diagram:
+                self._changed[diagram.id] = True
+
+    @component.adapter(IElementCreateEvent)
+    def _element_created(self, event):
+        self._deleted.discard(event.element.id)
+        self._mark_changed(event.element)
+
+    @component.adapter(IElementChangeEvent)
+    def _element_changed(self, event):
+        self._mark_changed(event.element)
+        if IAssociationExtendEvent.providedBy(event):
+            # The opposite ends of the added values have changed as well
+            for value in event.new_values:
+                self._mark_changed(value)
+
+    @component.adapter(IElementDeleteEvent)
+    def _element_deleted(self, event):
+        id = event.element.id
+        if id in self._changed:
+            del self._changed[id]
+        self._deleted.add(id)
+
+    @component.adapter(IModelFactoryEvent)
+    def _model_loaded(self, event):
+        self.clear_changes()
+
+    @component.adapter(IFlushFactoryEvent)
+    def _model_flushed(self, event):
+        self.clear_changes()
 
     def create(self, type):
         """
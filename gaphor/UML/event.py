@@ -78,6 +78,20 @@ class AssociationDeleteEvent(AssociationChangeEvent):
         self.old_value = old_value
 
 
+class AssociationExtendEvent(AssociationChangeEvent):
+    """Several association elements have been added at once."""
+
+    interface.implements(IAssociationExtendEvent)
+
+    def __init__(self, element, association, new_values):
+        """Constructor.  The element parameter is the element the association
+        has been extended on.  The new_values parameter is the list of
+        association elements being added."""
+        
+        AssociationChangeEvent.__init__(self, element, association)
+        self.new_values = new_values
+
+
 class DerivedChangeEvent(AssociationChangeEvent):
     """A derived property has changed."""
     pass
@@ -125,6 +139,20 @@ class DerivedDeleteEvent(DerivedChangeEvent):
         self.old_value = old_value
 
 
+class DerivedExtendEvent(DerivedChangeEvent):
+    """Several values have been added to a derived property."""
+
+    interface.implements(IAssociationExtendEvent)
+
+    def __init__(self, element, association, new_values):
+        """Constructor.  The element parameter is the element to which the
+        derived property belongs.  The association parameter is the 
+        association of the derived property."""
+        
+        AssociationChangeEvent.__init__(self, element, association)
+        self.new_values = new_values
+
+
 class RedefineSetEvent(AssociationChangeEvent):
     """A redefined property has been set."""
 
@@ -168,6 +196,20 @@ class RedefineDeleteEvent(AssociationChangeEvent):
         self.old_value = old_value
 
 
+class RedefineExtendEvent(AssociationChangeEvent):
+    """Several values have been added to a redefined property."""
+
+    interface.implements(IAssociationExtendEvent)
+
+    def __init__(self, element, association, new_values):
+        """Constructor.  The element parameter is the element to which the
+        property belongs.  The association parameter is the association of
+        the property."""
+        
+        AssociationChangeEvent.__init__(self, element, association)
+        self.new_values = new_values
+
+
 class DiagramItemCreateEvent(object):
     """A diagram item has been created."""
     
@@ -179,6 +221,18 @@ class DiagramItemCreateEvent(object):
         self.element = element
 
 
+class DiagramLoadedEvent(object):
+    """The canvas items of a diagram have been loaded on demand."""
+    
+    interface.implements(IDiagramLoadedEvent)
+
+    def __init__(self, element):
+        """Constructor.  The element parameter is the diagram of which the
+        canvas items have been created."""
+        
+        self.element = element
+
+
 class ElementCreateEvent(object):
     """An element has been created."""
     
@@ -207,6 +261,26 @@ class ElementDeleteEvent(object):
         self.element = element
 
 
+class ElementChangeSummary(object):
+    """The changes made to an element during a transaction."""
+
+    interface.implements(IElementChangeSummary)
+
+    def __init__(self, element, events):
+        """Constructor.  The element parameter is the changed element.  The
+        events parameter is the list of events for the element, in the order
+        they were emitted.  Each property is mentioned once in properties."""
+
+        self.element = element
+        self.events = events
+        properties = []
+        for event in events:
+            property = getattr(event, 'property', None)
+            if property not in properties:
+                properties.append(property)
+        self.properties = properties
+
+
 class ModelFactoryEvent(object):
     """A generic element factory event."""
     
@@ -59,6 +59,31 @@ class IAssociationDeleteEvent(IAssociationChangeEvent):
     been removed. ``old_value`` contains the property that has been removed.
     """
 
+class IAssociationExtendEvent(IAssociationChangeEvent):
+    """
+    An association with [0..*] multiplicity has been changed: several
+    entries have been added at once. ``new_values`` contains the values
+    being added. The opposite ends of the values have been updated too,
+    no separate events are sent for them.
+    """
+    new_values = interface.Attribute("The values that have been added")
+
+class IDiagramLoadedEvent(IElementEvent):
+    """
+    The canvas items of a diagram that is loaded on demand have been
+    created. ``element`` is the diagram.
+    """
+
+class IElementChangeSummary(interface.Interface):
+    """
+    A summary of the changes made to an element during a transaction.
+    Presentation side handlers can ask the event bus for summaries instead
+    of separate change events.
+    """
+    element = interface.Attribute("The element that changed")
+    events = interface.Attribute("The change events, in the order they occurred")
+    properties = interface.Attribute("The properties that changed")
+
 class IElementFactoryEvent(IServiceEvent):
     """
     Events related to individual model elements.
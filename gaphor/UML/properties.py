@@ -24,18 +24,22 @@ methods:
     save(save_func):  send the value of the property to save_func(name, value)
 """
 
-__all__ = [ 'attribute', 'enumeration', 'association', 'derivedunion', 'redefine' ]
+__all__ = [ 'attribute', 'enumeration', 'association', 'deferredassociation',
+            'derivedunion', 'redefine' ]
 
 from zope import component
 from collection import collection, collectionlist
 from event import AttributeChangeEvent, AssociationSetEvent, \
-                  AssociationAddEvent, AssociationDeleteEvent
+                  AssociationAddEvent, AssociationDeleteEvent, \
+                  AssociationExtendEvent
 from event import DerivedChangeEvent, DerivedSetEvent, \
-                  DerivedAddEvent, DerivedDeleteEvent
-from event import RedefineSetEvent, RedefineAddEvent, RedefineDeleteEvent
+                  DerivedAddEvent, DerivedDeleteEvent, DerivedExtendEvent
+from event import RedefineSetEvent, RedefineAddEvent, RedefineDeleteEvent, \
+                  RedefineExtendEvent
 from interfaces import IElementChangeEvent, \
                        IAssociationChangeEvent, IAssociationSetEvent, \
-                       IAssociationAddEvent, IAssociationDeleteEvent
+                       IAssociationAddEvent, IAssociationDeleteEvent, \
+                       IAssociationExtendEvent
 
 
 class umlproperty(object):
@@ -321,7 +325,7 @@ class association(umlproperty):
             elif value in c:
                 return
 
-            c.items.append(value)
+            c._append(value)
             if do_notify:
                 event = AssociationAddEvent(obj, self, value)
 
@@ -339,6 +343,54 @@ class association(umlproperty):
         if do_notify:
             self.handle(event)
 
+    def set_many(self, obj, values, do_notify=True):
+        """
+        Add all ``values`` to the collection of ``obj`` at once. The types
+        of the values are checked before anything is changed. Values that
+        are already part of the collection are skipped, the others are
+        added in the given order.
+
+        One AssociationExtendEvent is sent for all added values, instead of
+        an AssociationAddEvent per value. The opposite ends send their own
+        events, as with a normal assignment, so watchers of paths through
+        the opposite end stay up to date. Values that are still attached to
+        another element through a [0..1] opposite end are added as with a
+        normal assignment.
+        """
+        if self.upper == 1:
+            raise AttributeError, 'Can not add many values to [0..1] association %s' % self.name
+        values = list(values)
+        for value in values:
+            if not isinstance(value, self.type):
+                raise AttributeError, 'Value should be of type %s' % self.type.__name__
+
+        c = self._get(obj)
+        added = []
+        for value in values:
+            if value in c:
+                continue
+            if self.opposite:
+                opposite = getattr(type(value), self.opposite)
+                if opposite.upper == 1 and opposite._get(value) is not None:
+                    self._set(obj, value, do_notify=do_notify)
+                    continue
+            c._append(value)
+            added.append(value)
+            if self.opposite:
+                if not opposite.opposite:
+                    opposite.stub = self
+                opposite._set(value, obj, from_opposite=True, do_notify=do_notify)
+                if not do_notify:
+                    dispatcher.invalidate(opposite, value)
+            else:
+                if not self.stub:
+                    self.stub = associationstub(self)
+                    setattr(self.type, 'UML_associationstub_%x' % id(self), self.stub)
+                self.stub._set(value, obj)
+
+        if added and do_notify:
+            self.handle(AssociationExtendEvent(obj, self, added))
+
     def _del(self, obj, value, from_opposite=False, do_notify=True):
         """
         Delete is used for element deletion and for removal of
@@ -371,17 +423,11 @@ class association(umlproperty):
         else:
             c = self._get(obj)
             if c:
-                items = c.items
-                try:
-                    items.remove(value)
-                except:
-                    pass
-                else:
-                    if do_notify:
-                        event = AssociationDeleteEvent(obj, self, value)
+                if c._discard(value) and do_notify:
+                    event = AssociationDeleteEvent(obj, self, value)
 
                 # Remove items collection if empty
-                if not items:
+                if not c:
                     delattr(obj, self._name)
 
         if do_notify and event:
@@ -401,6 +447,36 @@ class association(umlproperty):
                     value.unlink()
 
 
+class deferredassociation(association):
+    """
+    Association of which not all values have to be loaded yet.
+
+    Values can be loaded on demand, by a loader function registered with
+    the element factory (see ElementFactory.defer()). The loader is invoked
+    as soon as the value of the association is asked for or the element is
+    unlinked, so the association is complete by then. This is used for
+    Element.presentation: the presentation items on diagrams that are
+    loaded on demand are only created when needed.
+
+    Internal access (_get(), _set() and _del(), e.g. when the opposite end
+    is set while loading) does not load the deferred values.
+    """
+
+    def __get__(self, obj, class_=None):
+        if obj:
+            factory = obj._factory
+            if factory:
+                factory.load_deferred(obj)
+            return self._get(obj)
+        return self
+
+    def unlink(self, obj):
+        factory = obj._factory
+        if factory:
+            factory.load_deferred(obj)
+        super(deferredassociation, self).unlink(obj)
+
+
 class AssociationStubError(Exception):
     pass
 
@@ -458,6 +534,63 @@ class associationstub(umlproperty):
             c.discard(value)
 
 
+class subsetdispatcher(object):
+    """
+    Route change events to the derived properties (and redefines) that
+    depend on the changed property.
+
+    Only one event handler is registered. Derived properties register
+    themselves for each of their subsets, so an event is only delivered
+    to the derived properties that are actually interested in it.
+    """
+
+    def __init__(self):
+        # property: tuple of dependent derived properties
+        self._dependents = {}
+
+    def register(self, prop, dependent):
+        """
+        Deliver change events of ``prop`` to ``dependent``.
+        """
+        # Tuples are replaced, not modified, since properties can be
+        # registered while an event is being dispatched.
+        self._dependents[prop] = self._dependents.get(prop, ()) + (dependent,)
+
+    def unregister(self, prop, dependent):
+        dependents = tuple(d for d in self._dependents.get(prop, ())
+                           if d is not dependent)
+        if dependents:
+            self._dependents[prop] = dependents
+        else:
+            self._dependents.pop(prop, None)
+
+    def invalidate(self, prop, obj):
+        """
+        Invalidate the cached values of ``obj`` for all derived properties
+        that depend on ``prop``, directly or indirectly. This is needed if
+        ``prop`` is changed without sending an event.
+        """
+        for dependent in self._dependents.get(prop, ()):
+            if isinstance(dependent, derived):
+                dependent.invalidate(obj)
+            self.invalidate(dependent, obj)
+
+    def dependents(self, prop):
+        """
+        Return the properties registered for change events of ``prop``.
+        """
+        return self._dependents.get(prop, ())
+
+    @component.adapter(IElementChangeEvent)
+    def handle(self, event):
+        for dependent in self._dependents.get(event.property, ()):
+            dependent._association_changed(event)
+
+
+dispatcher = subsetdispatcher()
+component.provideHandler(dispatcher.handle)
+
+
 class unioncache(object):
     """
     Small cache helper object for derivedunions.
@@ -477,6 +610,10 @@ class derived(umlproperty):
     -Delete- and Set events, this gives just an assumption that something
     may have changed. If something actually changed depends on the filter
     applied to the derived property.
+
+    Computed values are cached per element. Since the filter of a derived
+    property may look at any element, a change of one of the subsets
+    invalidates the cached values of all elements (``version`` is raised).
     """
 
     def __init__(self, name, type, lower, upper, *subsets):
@@ -489,7 +626,8 @@ class derived(umlproperty):
         self.subsets = set(subsets)
         self.single = len(subsets) == 1
 
-        component.provideHandler(self._association_changed)
+        for s in self.subsets:
+            dispatcher.register(s, self)
 
 
     def load(self, obj, value):
@@ -497,14 +635,36 @@ class derived(umlproperty):
 
 
     def postload(self, obj):
-        self.version += 1
+        self.invalidate(obj)
 
     def save(self, obj, save_func):
         pass
 
 
     def __str__(self):
-        return '<derived %s: %s>' % (self.name, str(map(str, self.subsets))[1:-1])
+        return '<derived %s: %s>' % (self.name, str(sorted(map(str, self.subsets)))[1:-1])
+
+    def is_local(self):
+        """
+        Return True if the value for an element only depends on the
+        properties of that element. For plain derived properties this can
+        not be told, since the filter can do anything.
+        """
+        return False
+
+    def invalidate(self, obj):
+        """
+        Make sure the value is computed again, after a subset of ``obj``
+        changed. For local properties only the cache of ``obj`` is
+        dropped, otherwise the cached values of all elements are.
+        """
+        if self.is_local():
+            try:
+                delattr(obj, self._name)
+            except AttributeError:
+                pass
+        else:
+            self.version += 1
 
     def filter(self, obj):
         """
@@ -550,7 +710,6 @@ class derived(umlproperty):
     def _del(self, obj, value=None):
         raise AttributeError, 'Can not delete values on a union'
 
-    @component.adapter(IElementChangeEvent)
     def _association_changed(self, event):
         """
         Re-emit state change for the derived properties as Derived*Event's.
@@ -566,7 +725,7 @@ class derived(umlproperty):
         """
         if event.property in self.subsets:
             # Make sure unions are created again
-            self.version += 1
+            self.invalidate(event.element)
             
             if not IAssociationChangeEvent.providedBy(event):
                 return
@@ -593,6 +752,10 @@ class derived(umlproperty):
                     old_value = event.old_value
                     self.handle(DerivedDeleteEvent(event.element, self, old_value))
 
+                elif IAssociationExtendEvent.providedBy(event):
+                    new_values = event.new_values
+                    self.handle(DerivedExtendEvent(event.element, self, new_values))
+
                 elif IAssociationChangeEvent.providedBy(event):
                     self.handle(DerivedChangeEvent(event.element, self))
                 else:
@@ -606,17 +769,46 @@ class derivedunion(derived):
       Element.union = derivedunion('union', subset1, subset2..subsetn)
 
     The subsets are the properties that participate in the union (Element.name).
+
+    A union only contains values of the element itself, so if a subset
+    changes only the cached union of that element is invalidated.
     """
 
+    def __init__(self, name, type, lower, upper, *subsets):
+        super(derivedunion, self).__init__(name, type, lower, upper, *subsets)
+        self._local_subsets = True
+        for s in self.subsets:
+            if isinstance(s, derived) and not s.is_local():
+                self._local_subsets = False
+
+    def is_local(self):
+        """
+        A union is local as long as it is not given a custom filter and
+        all its derived subsets are local too.
+        """
+        return self._local_subsets and self.filter == self._union
+
+    def _subsets(self, obj):
+        """
+        Return the subsets that are properties of the class of obj. Other
+        subsets are not queried, so they do not store empty values or
+        caches on obj.
+        """
+        return type(obj).umlplan().subsets(self)
+
     def _union(self, obj, exclude=None):
         """
         Returns a union of all values as a set.
         """
         if self.single:
-            return iter(self.subsets).next().__get__(obj)
+            for s in self._subsets(obj):
+                return s.__get__(obj)
+            if self.upper == 1:
+                return None
+            return collectionlist()
         else:
             u = set()
-            for s in self.subsets:
+            for s in self._subsets(obj):
                 if s is exclude:
                     continue
                 tmp = s.__get__(obj)
@@ -628,10 +820,28 @@ class derivedunion(derived):
                         u.add(tmp)
             return collectionlist(u)
 
+    def _contains(self, obj, value, exclude=None):
+        """
+        Returns True if value is part of the union, like ``value in
+        self._union(obj, exclude)``, but without building the union.
+        """
+        for s in self._subsets(obj):
+            if s is exclude and not self.single:
+                continue
+            tmp = s.__get__(obj)
+            if not tmp:
+                continue
+            if s.upper == 1:
+                # [0..1] property
+                if tmp == value:
+                    return True
+            elif value in tmp:
+                return True
+        return False
+
     # Filter is our default filter
     filter = _union
     
-    @component.adapter(IElementChangeEvent)
     def _association_changed(self, event):
         """
         Re-emit state change for the derived union (as Derived*Event's).
@@ -647,14 +857,13 @@ class derivedunion(derived):
         """
         if event.property in self.subsets:
             # Make sure unions are created again
-            self.version += 1
+            self.invalidate(event.element)
             
             if not IAssociationChangeEvent.providedBy(event):
                 return
                 
-            values = self._union(event.element, exclude=event.property)
-
             if self.upper == 1:
+                values = self._union(event.element, exclude=event.property)
                 assert IAssociationSetEvent.providedBy(event)
                 old_value, new_value = event.old_value, event.new_value
                 # This is a [0..1] event
@@ -672,23 +881,33 @@ class derivedunion(derived):
                         new_value = iter(values).next()
                     self.handle(DerivedSetEvent(event.element, self, old_value, new_value))
             else:        
+                # Is the value still provided by one of the other subsets?
+                obj, exclude = event.element, event.property
+                contains = self._contains
+
                 if IAssociationSetEvent.providedBy(event):
                     old_value, new_value = event.old_value, event.new_value
-                    if old_value and old_value not in values:
+                    if old_value and not contains(obj, old_value, exclude):
                         self.handle(DerivedDeleteEvent(event.element, self, old_value))
-                    if new_value and new_value not in values:
+                    if new_value and not contains(obj, new_value, exclude):
                         self.handle(DerivedAddEvent(event.element, self, new_value))
 
                 elif IAssociationAddEvent.providedBy(event):
                     new_value = event.new_value
-                    if new_value not in values:
+                    if not contains(obj, new_value, exclude):
                         self.handle(DerivedAddEvent(event.element, self, new_value))
 
                 elif IAssociationDeleteEvent.providedBy(event):
                     old_value = event.old_value
-                    if old_value not in values:
+                    if not contains(obj, old_value, exclude):
                         self.handle(DerivedDeleteEvent(event.element, self, old_value))
 
+                elif IAssociationExtendEvent.providedBy(event):
+                    new_values = [ v for v in event.new_values
+                                   if not contains(obj, v, exclude) ]
+                    if new_values:
+                        self.handle(DerivedExtendEvent(event.element, self, new_values))
+
                 elif IAssociationChangeEvent.providedBy(event):
                     self.handle(DerivedChangeEvent(event.element, self))
                 else:
@@ -712,7 +931,7 @@ class redefine(umlproperty):
         self.type = type
         self.original = original
 
-        component.provideHandler(self._association_changed)
+        dispatcher.register(original, self)
 
     upper = property(lambda s: s.original.upper)
     lower = property(lambda s: s.original.lower)
@@ -765,15 +984,18 @@ class redefine(umlproperty):
         return self.original._get(obj)
 
 
-    def _set(self, obj, value, from_opposite=False):
-        return self.original._set(obj, value, from_opposite)
+    def _set(self, obj, value, from_opposite=False, do_notify=True):
+        return self.original._set(obj, value, from_opposite, do_notify)
 
 
-    def _del(self, obj, value, from_opposite=False):
-        return self.original._del(obj, value, from_opposite)
+    def _del(self, obj, value, from_opposite=False, do_notify=True):
+        return self.original._del(obj, value, from_opposite, do_notify)
+
+
+    def set_many(self, obj, values, do_notify=True):
+        return self.original.set_many(obj, values, do_notify)
 
 
-    @component.adapter(IAssociationChangeEvent)
     def _association_changed(self, event):
         if event.property is self.original and isinstance(event.element, self.decl_class):
             # mimic the events for Set/Add/Delete
@@ -783,6 +1005,8 @@ class redefine(umlproperty):
                 self.handle(RedefineAddEvent(event.element, self, event.new_value))
             elif IAssociationDeleteEvent.providedBy(event):
                 self.handle(RedefineDeleteEvent(event.element, self, event.old_value))
+            elif IAssociationExtendEvent.providedBy(event):
+                self.handle(RedefineExtendEvent(event.element, self, event.new_values))
             else:
                 log.error('Don''t know how to handle event ' + str(event) + ' for redefined association')
 
@@ -4,6 +4,8 @@ Test if the collection's list supports all trickery.
 
 import unittest
 from gaphor.UML.collection import collectionlist
+from gaphor.UML.element import Element
+from gaphor.UML.properties import association
 
 class CollectionlistTestCase(unittest.TestCase):
 
@@ -14,4 +16,73 @@ class CollectionlistTestCase(unittest.TestCase):
         c.append('c')
         assert str(c) == "['a', 'b', 'c']"
 
+
+class CollectionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class A(Element): pass
+        A.a = association('a', A)
+        self.A = A
+
+    def test_order(self):
+        A = self.A
+        a = A()
+        values = [ A() for i in range(5) ]
+        for v in values:
+            a.a = v
+        a.a = values[2]
+        self.assertEquals(values, list(a.a))
+        self.assertEquals(values, a.a.items)
+        self.assertEquals(values[1:3], a.a[1:3])
+        self.assertEquals(values[3], a.a[3])
+        self.assertEquals(3, a.a.index(values[3]))
+
+        del a.a[values[1]]
+        del values[1]
+        self.assertEquals(values, list(a.a))
+        self.assertEquals(values[1], a.a[1])
+        self.assertEquals(4, a.a.size())
+
+    def test_membership(self):
+        A = self.A
+        a = A()
+        b = A()
+        c = A()
+        a.a = b
+        assert b in a.a
+        assert c not in a.a
+        assert a.a.includes(b)
+        assert a.a.excludes(c)
+        assert a.a.includesAll([b])
+        assert not a.a.includesAll([b, c])
+        assert a.a.excludesAll([c])
+        self.assertEquals(1, a.a.count(b))
+        self.assertEquals(0, a.a.count(c))
+        self.assertRaises(ValueError, a.a.remove, c)
+        a.a.remove(b)
+        assert b not in a.a
+        assert a.a.isEmpty()
+        assert not a.a
+
+    def test_swap(self):
+        A = self.A
+        a = A()
+        values = [ A() for i in range(3) ]
+        for v in values:
+            a.a = v
+        self.assertEquals(values, a.a.items)
+        assert a.a.swap(values[0], values[2])
+        self.assertEquals([values[2], values[1], values[0]], a.a.items)
+        assert not a.a.swap(values[0], A())
+
+    def test_iterate_and_remove(self):
+        A = self.A
+        a = A()
+        values = [ A() for i in range(3) ]
+        for v in values:
+            a.a = v
+        for v in a.a:
+            a.a.remove(v)
+        assert not a.a
+
 # vim:sw=4:et:ai
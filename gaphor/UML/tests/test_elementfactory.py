@@ -72,6 +72,149 @@ class ElementFactoryTestCase(unittest.TestCase):
         assert len(ef.values()) == 0, ef.values()
 
 
+    def testSelectType(self):
+        ef = self.factory
+        c1 = ef.create(Class)
+        p = ef.create(Package)
+        s = ef.create(Stereotype)
+        c2 = ef.create(Class)
+
+        self.assertEquals([c1, s, c2], ef.select_type(Class))
+        self.assertEquals([c1, c2], ef.select_type(Class, include_subclasses=False))
+        self.assertEquals([c1, p, s, c2], ef.select_type(Element))
+        self.assertEquals([], ef.select_type(Diagram))
+
+        c1.unlink()
+        self.assertEquals([s, c2], ef.select_type(Class))
+
+        ef.flush()
+        self.assertEquals([], ef.select_type(Element))
+
+
+    def testSwapElement(self):
+        ef = self.factory
+        d = ef.create(Dependency)
+        u = ef.create(Usage)
+        d.name = 'dep'
+        u.client = ef.create(Class)
+
+        ef.swap_element(d, Implementation)
+        ef.swap_element(u, Realization)
+        assert type(d) is Implementation
+        self.assertEquals('dep', d.name)
+        self.assertEquals([d], ef.select_type(Implementation))
+        self.assertEquals([u], ef.select_type(Realization, include_subclasses=False))
+        self.assertEquals([d, u], ef.select_type(Dependency))
+        self.assertEquals([], ef.select_type(Usage))
+        assert u.client
+
+        n = ef.create(ForkNode)
+        ef.swap_element(n, JoinNode)
+        self.assertEquals([n], ef.select_type(JoinNode))
+        ef.swap_element(n, DecisionNode)
+        self.assertEquals([n], ef.select_type(DecisionNode))
+
+
+    def testCompactIds(self):
+        ef = ElementFactory(compact_ids=True)
+        c1 = ef.create(Class)
+        c2 = ef.create(Class)
+        assert isinstance(c1.id, int)
+        assert c1.id != c2.id
+        assert ef.lookup(c1.id) is c1
+
+        # Persistent ids are allocated on demand and stay the same
+        pid = ef.persistent_id(c1.id)
+        assert isinstance(pid, str)
+        self.assertEquals(pid, ef.persistent_id(c1.id))
+        assert ef.persistent_id(c2.id) != pid
+        assert ef.lookup(pid) is c1
+
+        # Loaded elements keep the id they were saved with
+        p = ef.create_as(Package, 'DCE:1234')
+        assert isinstance(p.id, int)
+        self.assertEquals('DCE:1234', ef.persistent_id(p.id))
+        assert ef.lookup('DCE:1234') is p
+
+        # Deleted elements can still be saved as deleted
+        c1.unlink()
+        assert ef.lookup(pid) is None
+        self.assertEquals(pid, ef.persistent_id(c1.id))
+
+        ef.flush()
+        assert ef.lookup('DCE:1234') is None
+        assert ef.create(Class).id > c2.id
+
+
+    def testStringIds(self):
+        ef = self.factory
+        c = ef.create(Class)
+        assert isinstance(c.id, str)
+        assert c.id != ef.create(Class).id
+        self.assertEquals(c.id, ef.persistent_id(c.id))
+        assert ef.lookup(c.id) is c
+
+
+    def testDeferredPresentation(self):
+        ef = self.factory
+        c = ef.create(Class)
+        loaded = []
+        def loader():
+            p = ef.create(Presentation)
+            p.subject = c
+            loaded.append(p)
+        ef.defer(c, loader)
+
+        # Setting the opposite end does not load the presentation
+        p1 = ef.create(Presentation)
+        p1.subject = c
+        assert not loaded
+
+        self.assertEquals(2, len(c.presentation))
+        self.assertEquals(1, len(loaded))
+        assert loaded[0] in c.presentation
+
+        # Loaded only once
+        c.presentation
+        self.assertEquals(1, len(loaded))
+
+
+    def testDeferredPresentationUnlink(self):
+        ef = self.factory
+        c = ef.create(Class)
+        loaded = []
+        def loader():
+            p = ef.create(Presentation)
+            p.subject = c
+            loaded.append(p)
+        ef.defer(c, loader)
+
+        # Presentation is composite, deferred items are unlinked as well
+        c.unlink()
+        self.assertEquals(1, len(loaded))
+        assert loaded[0] not in ef
+
+
+    def testDeferredFlush(self):
+        ef = self.factory
+        c = ef.create(Class)
+        loaded = []
+        ef.defer(c, lambda: loaded.append(c))
+        ef.flush()
+        assert not loaded
+
+
+    def testSelectTypeEqualsSelect(self):
+        ef = self.factory
+        for i in range(10):
+            ef.create(Class)
+            ef.create(Property)
+            ef.create(InstanceSpecification)
+        for cls in (Class, Property, Classifier, NamedElement):
+            self.assertEquals([e for e in ef.values() if isinstance(e, cls)],
+                              ef.select_type(cls))
+
+
 
 
 from zope import component
@@ -133,6 +276,23 @@ class ElementFactoryServiceTestCase(unittest.TestCase):
         ef.notify_model()
         self.assertTrue(IModelFactoryEvent.providedBy(last_event) )
 
+    def testChanges(self):
+        ef = self.factory
+        p = ef.create(Parameter)
+        q = ef.create(Parameter)
+        self.assertEquals([p, q], ef.changed_elements())
+        ef.clear_changes()
+        self.assertEquals([], ef.changed_elements())
+
+        q.defaultValue = 'l'
+        self.assertEquals([q], ef.changed_elements())
+        p.unlink()
+        self.assertEquals(set([p.id]), ef.deleted_elements())
+
+        ef.notify_model()
+        self.assertEquals([], ef.changed_elements())
+        self.assertEquals(set(), ef.deleted_elements())
+
     def testFlushEvent(self):
         ef = self.factory
         global handled
@@ -4,6 +4,7 @@ import unittest
 from zope import component
 from gaphor.application import Application
 from gaphor.UML.properties import *
+from gaphor.UML.properties import derived, dispatcher
 from gaphor.UML.element import Element
 from gaphor.UML.interfaces import IAssociationChangeEvent
 
@@ -426,6 +427,130 @@ class PropertiesTestCase(unittest.TestCase):
         assert c in a.u
         assert d in a.u
 
+    def test_derivedunion_cache(self):
+        class A(Element): pass
+
+        A.a = association('a', A)
+        A.b = association('b', A, 0, 1)
+        A.u = derivedunion('u', object, 0, '*', A.a, A.b)
+
+        a1 = A()
+        a2 = A()
+        a1.a = b = A()
+        assert list(a1.u) == [b]
+        assert len(a2.u) == 0
+        cache = a1._u
+
+        # A change of a2 does not invalidate the union of a1
+        a2.b = c = A()
+        assert list(a2.u) == [c]
+        assert a1._u is cache
+        assert list(a1.u) == [b]
+
+        # Deleting a value invalidates the union of the element
+        del a1.a[b]
+        assert len(a1.u) == 0
+        assert list(a2.u) == [c]
+
+    def test_derivedunion_cache_inheritance(self):
+        class A(Element): pass
+        class B(A): pass
+
+        A.a = association('a', A)
+        B.b = association('b', A)
+        A.u = derivedunion('u', A, 0, '*', A.a, B.b)
+        A.v = derivedunion('v', A, 0, '*', A.u)
+
+        b1 = B()
+        b2 = B()
+        assert len(b1.u) == 0
+        assert len(b1.v) == 0
+        b2.b = x = A()
+        assert len(b1.u) == 0
+        assert len(b1.v) == 0
+        assert list(b2.u) == [x]
+        assert list(b2.v) == [x]
+        b1.b = y = A()
+        assert list(b1.u) == [y]
+        assert list(b1.v) == [y]
+        assert list(b2.v) == [x]
+
+    def test_derivedunion_cache_redefine(self):
+        class A(Element): pass
+        class B(A): pass
+
+        A.a = association('a', A)
+        A.u = derivedunion('u', A, 0, '*', A.a)
+        B.c = redefine(B, 'c', A, A.a)
+
+        b1 = B()
+        b2 = B()
+        assert len(b1.u) == 0
+        assert len(b2.u) == 0
+        b1.c = x = A()
+        assert list(b1.u) == [x]
+        assert len(b2.u) == 0
+
+    def test_derived_cache(self):
+        """
+        Derived properties can depend on other elements, they are
+        invalidated for all elements.
+        """
+        class A(Element): pass
+
+        A.a = association('a', A)
+        A.name = attribute('name', str, 'default')
+        A.d = derived('d', str, 0, '*', A.a, A.name)
+        A.d.filter = lambda obj: [ e.name for e in obj.a ]
+        A.u = derivedunion('u', str, 0, '*', A.d)
+
+        assert not A.d.is_local()
+        assert not A.u.is_local()
+
+        a = A()
+        a.a = b = A()
+        assert list(a.d) == ['default']
+        assert list(a.u) == ['default']
+        b.name = 'b'
+        assert list(a.d) == ['b']
+        a.a = c = A()
+        assert sorted(a.d) == ['b', 'default']
+        assert sorted(a.u) == ['b', 'default']
+
+    def test_subset_dispatcher(self):
+        class A(Element): pass
+        class B(A): pass
+
+        A.a = association('a', A)
+        A.b = association('b', A)
+        A.u = derivedunion('u', A, 0, '*', A.a, A.b)
+        A.v = derivedunion('v', A, 0, '*', A.u, A.b)
+        B.c = redefine(B, 'c', A, A.a)
+
+        self.assertEquals((A.u, B.c), dispatcher.dependents(A.a))
+        self.assertEquals(set([A.u, A.v]), set(dispatcher.dependents(A.b)))
+        self.assertEquals((A.v,), dispatcher.dependents(A.u))
+        self.assertEquals((), dispatcher.dependents(A.v))
+
+        events = []
+        @component.adapter(IAssociationChangeEvent)
+        def handler(event, events=events):
+            events.append(event)
+
+        component.provideHandler(handler)
+        try:
+            b = B()
+            b.c = x = A()
+            props = [ e.property for e in events ]
+            self.assertEquals(4, len(props))
+            self.assertEquals(set([A.a, B.c, A.u, A.v]), set(props))
+        finally:
+            component.getGlobalSiteManager().unregisterHandler(handler)
+
+        dispatcher.unregister(A.a, A.u)
+        self.assertEquals((B.c,), dispatcher.dependents(A.a))
+        dispatcher.register(A.a, A.u)
+
     def skiptest_deriveduntion_notify(self):
         class A(Element): pass
         class E(Element):
@@ -689,6 +814,114 @@ class PropertiesTestCase(unittest.TestCase):
             Application.unregister_handler(handler)
 
 
+    def test_property_plan(self):
+        class A(Element): pass
+        class B(A): pass
+
+        A.name = attribute('name', str)
+        A.kind = enumeration('kind', ('in', 'out'), 'in')
+        A.a = association('a', A)
+        A.b = association('b', A)
+        A.u = derivedunion('u', A, 0, '*', A.a, A.b)
+        B.a = redefine(B, 'a', A, A.a)
+        B.c = redefine(B, 'c', A, A.b)
+
+        # Leave out the properties defined on Element by the metamodel
+        base = set(Element.umlplan().all)
+        own = lambda props: tuple(p for p in props if p not in base)
+
+        plan = A.umlplan()
+        assert plan is A.umlplan()
+        self.assertEquals((A.a, A.b, A.kind, A.name, A.u), own(plan.all))
+        self.assertEquals((A.name,), own(plan.attributes))
+        self.assertEquals((A.kind,), own(plan.enumerations))
+        self.assertEquals((A.a, A.b), own(plan.associations))
+        self.assertEquals((A.u,), own(plan.derived))
+        self.assertEquals((A.a, A.b, A.kind, A.name), own(plan.save))
+        self.assertEquals((A.a, A.b, A.u), own(plan.postload))
+        self.assertEquals((A.a, A.b), own(plan.unlink))
+
+        # Redefines with the same name delegate to the original property
+        plan = B.umlplan()
+        self.assertEquals((B.a, B.c), own(plan.redefines))
+        self.assertEquals((A.a, A.b, A.kind, A.name), own(plan.save))
+
+        # Modifying a base class updates the plans of subclasses
+        A.d = attribute('d', str)
+        assert A.d in B.umlplan().attributes
+
+
+    def test_association_set_many(self):
+        from gaphor.UML.interfaces import IAssociationExtendEvent
+        class A(Element): pass
+        class B(Element): pass
+        class C(Element): pass
+
+        A.b = association('b', B, opposite='a')
+        B.a = association('a', A, upper=1, opposite='b')
+        A.c = association('c', C)
+        A.u = derivedunion('u', Element, 0, '*', A.b, A.c)
+        B.c = association('c', C, upper=1)
+        B.u = derivedunion('u', Element, 0, 1, B.a, B.c)
+
+        events = []
+        @component.adapter(IAssociationChangeEvent)
+        def handler(event, events=events):
+            events.append(event)
+
+        component.provideHandler(handler)
+        try:
+            a = A()
+            other = A()
+            bs = [ B() for i in range(5) ]
+            bs[4].a = other
+            c = C()
+            a.c = c
+            assert list(a.u) == [c]
+            del events[:]
+
+            a.b.extend(bs)
+            self.assertEquals(bs, a.b.items)
+            for b in bs:
+                assert b.a is a
+                assert b.u is a
+            self.assertEquals(set(bs + [c]), set(a.u))
+
+            # One event for the first four values, bs[4] was moved
+            extend = [ e for e in events
+                       if IAssociationExtendEvent.providedBy(e) ]
+            extend = dict((e.property, e.new_values) for e in extend)
+            self.assertEquals(2, len(extend))
+            self.assertEquals(bs[:4], extend[A.b])
+            self.assertEquals(bs[:4], extend[A.u])
+            assert len([ e for e in events if e.property is A.b ]) == 2
+            # The opposite ends send their own events
+            self.assertEquals(bs, [ e.element for e in events
+                                    if e.property is B.a ])
+            self.assertEquals(bs, [ e.element for e in events
+                                    if e.property is B.u ])
+
+            # Values already in the collection are skipped
+            del events[:]
+            a.b.extend(bs)
+            assert not events
+
+            # The order of the values is kept
+            bs2 = [ B() for i in range(3) ]
+            bs2[0].a = other
+            a.b.extend(bs2)
+            self.assertEquals(bs + bs2, a.b.items)
+
+            # Nothing is changed if one of the values is of the wrong type
+            b = B()
+            self.assertRaises(AttributeError, a.b.extend, [b, c])
+            assert b not in a.b
+            assert b.a is None
+        finally:
+            component.getGlobalSiteManager().unregisterHandler(handler)
+
+
+
 if __name__ == '__main__':
     unittest.main()
 
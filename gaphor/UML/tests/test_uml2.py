@@ -269,6 +269,38 @@ class Uml2TestCase(unittest.TestCase):
         self.assertEquals([p], factory.lselect())
 
 
+    def test_slots(self):
+        factory = UML.ElementFactory()
+        p = factory.create(UML.Package)
+        c = factory.create(UML.Class)
+        c.name = 'Class'
+        c.package = p
+        a = factory.create(UML.Property)
+        c.ownedAttribute = a
+        for e in (p, c, a):
+            # Derived unions fill their caches
+            e.owner, e.ownedElement, e.namespace
+            self.assertEquals({}, e.__dict__)
+        self.assertEquals('Class', c._name)
+
+        c.unlink()
+        assert not c._unlinking
+        assert a.owner is None
+
+
+    def test_pickle(self):
+        import pickle
+        factory = UML.ElementFactory()
+        c = factory.create(UML.Class)
+        c.name = 'Class'
+        c.foo = 'bar'
+        c2 = pickle.loads(pickle.dumps(c, 2))
+        self.assertEquals(c.id, c2.id)
+        self.assertEquals('Class', c2.name)
+        self.assertEquals('bar', c2.foo)
+        assert c2.factory is None
+
+
 #    def test_lower_upper(self):
 #        """
 #        Test MultiplicityElement.{lower|upper}
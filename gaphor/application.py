@@ -36,7 +36,7 @@ class _Application(object):
     """
 
     # interface.implements(IApplication)
-    _ESSENTIAL_SERVICES = ['component_registry']
+    _ESSENTIAL_SERVICES = ['component_registry', 'event_bus']
     
     def __init__(self):
         self._uninitialized_services = {}
@@ -6,15 +6,16 @@ diagram).
 
 import inspect
 import gobject
-import uuid
 
+from gaphor.misc.uniqueid import generate_id
 from gaphor.diagram.style import Style
+from gaphor.UML.element import ElementMeta
 
 # Map UML elements to their (default) representation.
 _uml_to_item_map = { }
 
 def create(type):
-    return create_as(type, str(uuid.uuid1()))
+    return create_as(type, generate_id())
 
 def create_as(type, id):
     return type(id)
@@ -49,7 +50,7 @@ def uml(uml_class, stereotype=None):
 
 
 
-class DiagramItemMeta(type):
+class DiagramItemMeta(ElementMeta):
     """
     Initialize a new diagram item.
     1. Register UML.Elements by means of the __uml__ attribute (see
@@ -60,7 +61,7 @@ class DiagramItemMeta(type):
     """
 
     def __init__(self, name, bases, data):
-        type.__init__(self, name, bases, data)
+        ElementMeta.__init__(self, name, bases, data)
 
         self.map_uml_class(data)
         self.set_style(data)
@@ -146,4 +146,79 @@ class ClassTestCase(TestCase):
         width = klass.width
         self.assertEquals(170.0, width)
 
+    def test_feature_measured_on_change(self):
+        """
+        Only features with a changed text are measured again.
+        """
+        from gaphor.diagram import compartment
+        element_factory = self.element_factory
+        diagram = element_factory.create(UML.Diagram)
+        klass = diagram.create(ClassItem, subject=element_factory.create(UML.Class))
+        attrs = []
+        for name in ('a', 'b', 'c'):
+            attr = element_factory.create(UML.Property)
+            attr.name = name
+            klass.subject.ownedAttribute = attr
+            attrs.append(attr)
+        diagram.canvas.update()
+        features = list(klass.compartments[0])
+
+        measured = []
+        text_extents = compartment.text_extents
+        def counting_text_extents(cr, text, *args, **kwargs):
+            measured.append(text)
+            return text_extents(cr, text, *args, **kwargs)
+        compartment.text_extents = counting_text_extents
+        try:
+            attrs[1].name = 'x' * 25
+            diagram.canvas.update()
+        finally:
+            compartment.text_extents = text_extents
+
+        self.assertEquals(1, len(measured))
+        assert 'x' * 25 in measured[0], measured
+        self.assertEquals(features, list(klass.compartments[0]))
+        self.assertEquals(170.0, klass.width)
+
+    def test_size_on_style_change(self):
+        """
+        Sizes are computed again if the font or the padding changes.
+        """
+        from gaphor.diagram import compartment
+        from gaphor.diagram.style import Style
+        element_factory = self.element_factory
+        diagram = element_factory.create(UML.Diagram)
+        klass = diagram.create(ClassItem, subject=element_factory.create(UML.Class))
+        oper = element_factory.create(UML.Operation)
+        oper.name = 'method'
+        klass.subject.ownedOperation = oper
+        diagram.canvas.update()
+        operations = klass.compartments[1]
+        width = operations.width
+
+        # Do not change the style of all classes
+        klass.style = Style(dict(klass.style.items()))
+        padding = klass.style.compartment_padding
+        klass.style.compartment_padding = (padding[0], padding[1] + 10,
+                                           padding[2], padding[3])
+        klass.request_update()
+        diagram.canvas.update()
+        self.assertEquals(width + 10, operations.width)
+
+        measured = []
+        text_extents = compartment.text_extents
+        def counting_text_extents(cr, text, *args, **kwargs):
+            measured.append(kwargs.get('font'))
+            return text_extents(cr, text, *args, **kwargs)
+        compartment.text_extents = counting_text_extents
+        try:
+            oper.isAbstract = True
+            diagram.canvas.update()
+        finally:
+            compartment.text_extents = text_extents
+
+        self.assertEquals(klass.style.abstract_feature_font,
+                          operations[0].font)
+        assert klass.style.abstract_feature_font in measured, measured
+
 # vim:sw=4:et:ai
@@ -8,7 +8,7 @@ from gaphas.state import observed, reversible_property
 from gaphor import UML
 from gaphor.diagram.diagramitem import DiagramItem
 from gaphor.diagram.nameditem import NamedItem
-from textelement import text_extents, text_align
+from textelement import text_extents, text_align, layout_cache
 
 
 class FeatureItem(object):
@@ -28,6 +28,8 @@ class FeatureItem(object):
         self.subject = None
         self.order = order
         self.pattern = pattern
+        # The text and font the size was measured for
+        self._measured = None
 
 
     def save(self, save_func):
@@ -53,15 +55,29 @@ class FeatureItem(object):
 
 
     def update_size(self, text, context):
+        """
+        Measure ``text``, unless the size has been measured for the same
+        text and font before. Returns True if the size changed.
+        """
+        measured = text, self.font
+        if measured == self._measured:
+            return False
+        self._measured = measured
+        size = self.width, self.height
         if text:
             cr = context.cairo
-            self.width, self.height = text_extents(cr, text)
+            self.width, self.height = text_extents(cr, text, font=self.font)
         else:
             self.width, self.height = 0, 0
+        return (self.width, self.height) != size
 
 
     def pre_update(self, context):
-        self.update_size(self.render(), context)
+        """
+        Update the size of the feature. Only changed features are measured
+        again. Returns True if the size changed.
+        """
+        return self.update_size(self.render(), context)
 
 
     def point(self, pos):
@@ -78,16 +94,20 @@ class FeatureItem(object):
     def draw(self, context):
         cr = context.cairo
         if isinstance(cr, cairo.Context):
-            cr = pangocairo.CairoContext(cr)
-            layout = cr.create_layout()
-            layout.set_font_description(pango.FontDescription(self.font))
-            layout.set_text(self.render() or '')
-        
+            text = self.render() or ''
             if hasattr(self.subject, 'isStatic') and self.subject.isStatic:
+                # Underlined text, cached layouts are not changed
+                cr = pangocairo.CairoContext(cr)
+                layout = cr.create_layout()
+                layout.set_font_description(layout_cache.font_description(self.font))
+                layout.set_text(text)
                 attrlist = pango.AttrList()
                 attrlist.insert(pango.AttrUnderline(pango.UNDERLINE_SINGLE,
                                 2, -1))
                 layout.set_attributes(attrlist)
+            else:
+                layout = layout_cache.layout(cr, text, self.font, -1)
+                cr = pangocairo.CairoContext(cr)
             cr.show_layout(layout)
 
 
@@ -110,6 +130,9 @@ class Compartment(list):
         self.font = None
         self.title_height = 0
         self.use_extra_space = False
+        # Title, style and items the size has been computed for
+        self._sized = None
+        self._sized_items = None
 
     def save(self, save_func):
         #log.debug('Compartment.save: %s' % self)
@@ -139,26 +162,39 @@ class Compartment(list):
     def pre_update(self, context):
         """
         Pre update, determine width and height of the compartment.
+
+        The size is only computed again if the size of an item changed,
+        items have been added, removed or moved, or the title, its font or
+        the owner's compartment padding or spacing changed.
         """
+        changed = False
+        for item in self:
+            if item.pre_update(context):
+                changed = True
+
+        padding = self.owner.style.compartment_padding
+        vspacing = self.owner.style.compartment_vspacing
+        sized = self.title, self.font, tuple(padding), vspacing
+        if not changed and sized == self._sized \
+                and self._sized_items == self:
+            return
+        self._sized = sized
+        self._sized_items = list(self)
+
         self.width = self.height = 0
         cr = context.cairo
-        for item in self:
-            item.pre_update(context)
-        
         if self:
             # self (=list) contains items
             sizes = [ (0, 0) ] # to not throw exceptions by max and sum
             if self.title:
-                w, h = text_extents(cr, self.title)
+                w, h = text_extents(cr, self.title, font=self.font)
                 self.title_height = h
                 sizes.append((w, h))
             sizes.extend(f.get_size(True) for f in self)
             self.width = max(size[0] for size in sizes)
             self.height = sum(size[1] for size in sizes)
-            vspacing = self.owner.style.compartment_vspacing
             self.height += vspacing * (len(sizes) - 1)
 
-        padding = self.owner.style.compartment_padding
         self.width += padding[1] + padding[3]
         self.height += padding[0] + padding[2]
 
@@ -273,6 +309,9 @@ class CompartmentItem(NamedItem):
         if self._show_stereotypes_attrs:
             if isinstance(event, UML.event.AssociationAddEvent):
                 self._create_stereotype_compartment(event.new_value)
+            elif isinstance(event, UML.event.AssociationExtendEvent):
+                for obj in event.new_values:
+                    self._create_stereotype_compartment(obj)
             elif isinstance(event, UML.event.AssociationDeleteEvent):
                 self._remove_stereotype_compartment(event.old_value)
 
@@ -409,22 +448,17 @@ class CompartmentItem(NamedItem):
         @compartment: our local representation
         @creator: factory method for creating new attr. or oper.'s
         """
-        # extract the UML elements from the compartment
-        local_elements = [f.subject for f in compartment]
-
         # map local element with compartment element
-        mapping = dict(zip(local_elements, compartment))
-
-        to_add = [el for el in elements if el not in local_elements]
+        mapping = dict((f.subject, f) for f in compartment)
 
         # sync local elements with elements
         del compartment[:]
 
         for el in elements:
-            if el in to_add:
-                creator(el)
-            else:
+            try:
                 compartment.append(mapping[el])
+            except KeyError:
+                creator(el)
 
         #log.debug('elements order in model: %s' % [f.name for f in elements])
         #log.debug('elements order in diagram: %s' % [f.subject.name for f in compartment])
@@ -162,7 +162,8 @@ class DiagramItem(UML.Presentation, StereotypeSupport, EditableTextSupport):
 
         def update(event):
             self.request_update()
-        self.watcher = EventWatcher(self, default_handler=update)
+        self.watcher = EventWatcher(self, default_handler=update,
+                                    deferred=True)
 
         self.watch('subject') \
             .watch('subject.appliedStereotype.classifier.name', self.on_element_applied_stereotype)
@@ -0,0 +1,374 @@
+"""
+Headless export of diagrams to PDF, SVG and PNG files.
+
+A single canvas is rendered with render_canvas(). The items are drawn
+once: they are painted on a cairo recording surface, the extents of the
+recording are the bounding box and the recording is replayed on the output
+surface. With older versions of pycairo (without RecordingSurface) the
+bounding box is computed on a temporary surface first.
+
+Many diagrams are exported with a BatchExporter. The model is loaded once
+in the current process. The diagrams are rendered by a pool of worker
+processes, forked after the model has been loaded, so the workers share
+the model. Every diagram can be given a maximum render time: a worker
+that takes longer, or dies, is killed and replaced by the current process.
+The result of every export, including the time it took, is reported as an
+ExportResult.
+
+A RenderManifest, stored in the output directory, records the fingerprint
+of every exported diagram (see gaphor.storage.storage.diagram_fingerprint),
+so diagrams that did not change since the last export can be skipped.
+"""
+
+__all__ = [ 'FORMATS', 'render_canvas', 'ExportResult', 'BatchExporter',
+            'RenderManifest' ]
+
+import os
+import json
+import select
+import time
+import multiprocessing
+
+import cairo
+
+from gaphas.view import View
+from gaphas.painter import ItemPainter, BoundingBoxPainter
+from gaphas.freehand import FreeHandPainter
+
+FORMATS = ('pdf', 'svg', 'png')
+
+
+def create_view(canvas, sloppiness=0):
+    """
+    Create a view for ``canvas``, with the painters used for exporting.
+    """
+    view = View(canvas)
+    if sloppiness:
+        view.painter = FreeHandPainter(ItemPainter(), sloppiness)
+        view.bounding_box_painter = FreeHandPainter(BoundingBoxPainter(), sloppiness)
+    else:
+        view.painter = ItemPainter()
+    return view
+
+
+def _create_surface(filename, format, width, height):
+    if format == 'pdf':
+        return cairo.PDFSurface(filename, width, height)
+    elif format == 'svg':
+        return cairo.SVGSurface(filename, width, height)
+    elif format == 'png':
+        return cairo.ImageSurface(cairo.FORMAT_ARGB32, int(width+1), int(height+1))
+    raise ValueError, 'Unknown export format %s' % format
+
+
+def render_canvas(canvas, filename, format, sloppiness=0):
+    """
+    Render ``canvas`` to file ``filename`` in ``format`` (one of FORMATS).
+    The size of the image is the bounding box of the items. Returns the
+    width and height of the image.
+    """
+    view = create_view(canvas, sloppiness)
+
+    if hasattr(cairo, 'RecordingSurface'):
+        # Paint once, the extents of the recording are the bounding box
+        recording = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None)
+        view.paint(cairo.Context(recording))
+        x, y, w, h = recording.ink_extents()
+    else:
+        # Update bounding boxes with a temporaly CairoContext
+        # (used for stuff like calculating font metrics)
+        recording = None
+        tmpsurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 0, 0)
+        tmpcr = cairo.Context(tmpsurface)
+        view.update_bounding_box(tmpcr)
+        tmpcr.show_page()
+        tmpsurface.flush()
+        bounding_box = view.bounding_box
+        x, y = bounding_box.x, bounding_box.y
+        w, h = bounding_box.width, bounding_box.height
+
+    surface = _create_surface(filename, format, w, h)
+    cr = cairo.Context(surface)
+    if recording is not None:
+        cr.set_source_surface(recording, -x, -y)
+        cr.paint()
+    else:
+        view.matrix.translate(-x, -y)
+        view.paint(cr)
+    cr.show_page()
+
+    if format == 'png':
+        surface.write_to_png(filename)
+
+    surface.flush()
+    surface.finish()
+    return w, h
+
+
+class ExportResult(object):
+    """
+    The result of exporting one diagram.
+
+     - id:       id of the diagram
+     - filename: file the diagram is exported to
+     - time:     time it took to export the diagram, in seconds
+     - size:     width and height of the image, None if the export failed
+     - error:    error message, None if the export succeeded
+     - timeout:  True if the export took longer than allowed
+    """
+
+    def __init__(self, id, filename, time, size=None, error=None, timeout=False):
+        self.id = id
+        self.filename = filename
+        self.time = time
+        self.size = size
+        self.error = error
+        self.timeout = timeout
+
+    ok = property(lambda s: s.error is None)
+
+    def __repr__(self):
+        return '<ExportResult %s %s %.3fs %s>' % (self.id, self.filename,
+                self.time, self.error or 'ok')
+
+
+# The exporter used by the worker processes. It's set before the workers
+# are forked, so the workers inherit it, with the model loaded.
+_exporter = None
+
+
+def _work(conn):
+    """
+    Main loop of a worker process: export the diagrams received over
+    connection ``conn`` and send back the results, until None is received.
+    """
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        conn.send(_exporter.export_one(*job))
+    conn.close()
+
+
+class _Worker(object):
+    """
+    A worker process and the job it's working on.
+    """
+
+    def __init__(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work, args=(child,))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.job = None
+        self.start = None
+        self.deadline = None
+
+    def send(self, job, timeout):
+        self.job = job
+        self.start = time.time()
+        self.deadline = timeout and self.start + timeout
+        self.conn.send(job)
+
+    def receive(self):
+        """
+        Return the result of the current job. An EOFError is raised if the
+        worker died.
+        """
+        result = self.conn.recv()
+        self.job = None
+        return result
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except EnvironmentError:
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class BatchExporter(object):
+    """
+    Export the diagrams of a model loaded in ``factory``.
+
+    Diagrams are exported by ``processes`` worker processes (the number of
+    processors by default). With one process, or if there is only one
+    diagram to export, no workers are forked.
+
+    If ``timeout`` is set, the export of a diagram is aborted after that
+    many seconds. Timeouts are only enforced for worker processes: the
+    worker is killed by the current process and replaced by a new one. So
+    with a timeout at least one worker process is used. A worker that dies
+    while rendering a diagram is replaced as well.
+    """
+
+    def __init__(self, factory, processes=None, timeout=None, sloppiness=0):
+        self.factory = factory
+        self.processes = processes or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.sloppiness = sloppiness
+
+
+    def export_one(self, id, filename, format):
+        """
+        Export the diagram with id ``id`` to ``filename``. Returns an
+        ExportResult.
+        """
+        start = time.time()
+        try:
+            diagram = self.factory.lookup(id)
+            dirname = os.path.dirname(filename)
+            if dirname and not os.path.exists(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    # Created by another worker
+                    pass
+            size = render_canvas(diagram.canvas, filename, format,
+                                 self.sloppiness)
+        except Exception, e:
+            return ExportResult(id, filename, time.time() - start,
+                                error=str(e) or e.__class__.__name__)
+        return ExportResult(id, filename, time.time() - start, size=size)
+
+
+    def export(self, jobs):
+        """
+        Export diagrams. ``jobs`` is a list of (diagram, filename, format)
+        tuples. The ExportResults are returned as they become available.
+        """
+        jobs = [ (diagram.id, filename, format)
+                 for diagram, filename, format in jobs ]
+        if not self.timeout and (self.processes <= 1 or len(jobs) <= 1):
+            for job in jobs:
+                yield self.export_one(*job)
+            return
+
+        for result in self._export_parallel(jobs):
+            yield result
+
+
+    def _export_parallel(self, jobs):
+        global _exporter
+
+        timeout = self.timeout
+        pending = list(reversed(jobs))
+        workers = []
+        _exporter = self
+        try:
+            for i in xrange(min(self.processes, len(jobs))):
+                workers.append(_Worker())
+
+            while True:
+                for worker in workers:
+                    if worker.job is None and pending:
+                        worker.send(pending.pop(), timeout)
+                busy = [ w for w in workers if w.job is not None ]
+                if not busy:
+                    break
+
+                if timeout:
+                    wait = max(0, min(w.deadline for w in busy) - time.time())
+                else:
+                    wait = None
+                ready, _, _ = select.select([ w.conn for w in busy ], [], [], wait)
+
+                now = time.time()
+                for worker in busy:
+                    id, filename, format = worker.job
+                    if worker.conn in ready:
+                        try:
+                            yield worker.receive()
+                            continue
+                        except EOFError:
+                            worker.process.join(1)
+                            result = ExportResult(id, filename, now - worker.start,
+                                    error='Worker process died (exit code %s)'
+                                          % worker.process.exitcode)
+                    elif timeout and now >= worker.deadline:
+                        result = ExportResult(id, filename, now - worker.start,
+                                error='Timed out after %s seconds' % timeout,
+                                timeout=True)
+                    else:
+                        continue
+                    worker.kill()
+                    workers[workers.index(worker)] = _Worker()
+                    yield result
+        finally:
+            for worker in workers:
+                if worker.job is None:
+                    worker.stop()
+                else:
+                    worker.kill()
+            _exporter = None
+
+
+class RenderManifest(object):
+    """
+    The fingerprints of the diagrams exported to a directory, stored in
+    file ``filename``. The manifest is only valid for exports done with the
+    same ``version`` (e.g. the Gaphor version and export settings); a
+    manifest written with another version is ignored.
+    """
+
+    FILENAME = '.gaphor-render-cache'
+
+    def __init__(self, filename, version):
+        self.filename = filename
+        self.version = version
+        self.diagrams = {}
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            if data.get('version') == version:
+                self.diagrams = data['diagrams']
+        except (IOError, ValueError, KeyError, AttributeError):
+            # No manifest, or not a valid one: export everything
+            pass
+
+
+    def is_current(self, filename, fingerprint):
+        """
+        Return True if ``filename`` exists and was exported from a diagram
+        with fingerprint ``fingerprint``.
+        """
+        return self.diagrams.get(filename) == fingerprint \
+                and os.path.exists(filename)
+
+
+    def update(self, filename, fingerprint):
+        """
+        Record that ``filename`` is exported from a diagram with fingerprint
+        ``fingerprint``.
+        """
+        self.diagrams[filename] = fingerprint
+
+
+    def discard(self, filename):
+        """
+        Forget ``filename``, e.g. when its export failed.
+        """
+        self.diagrams.pop(filename, None)
+
+
+    def save(self):
+        """
+        Write the manifest. The file is replaced atomically, so an
+        interrupted export leaves the previous manifest intact.
+        """
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as f:
+            json.dump({ 'version': self.version,
+                        'diagrams': self.diagrams }, f, indent=1, sort_keys=True)
+        os.rename(tmpname, self.filename)
+
+
+# vim:sw=4:et:ai
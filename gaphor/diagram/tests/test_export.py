@@ -0,0 +1,120 @@
+"""
+Test headless diagram export.
+"""
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+from gaphor.tests.testcase import TestCase
+from gaphor import UML
+from gaphor.diagram.classes.klass import ClassItem
+from gaphor.diagram.export import render_canvas, BatchExporter, RenderManifest
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        super(ExportTestCase, self).tearDown()
+
+    def create_diagram(self, name):
+        diagram = self.element_factory.create(UML.Diagram)
+        diagram.name = name
+        klass = self.element_factory.create(UML.Class)
+        klass.name = name
+        diagram.create(ClassItem, subject=klass)
+        diagram.canvas.update_now()
+        return diagram
+
+    def test_render_canvas(self):
+        diagram = self.create_diagram('Class1')
+        for format in ('pdf', 'svg', 'png'):
+            filename = os.path.join(self.dir, 'diagram.' + format)
+            w, h = render_canvas(diagram.canvas, filename, format)
+            assert w >= 100 and h >= 50, (w, h)
+            assert os.path.getsize(filename) > 0
+
+    def test_batch_export(self):
+        jobs = []
+        for i in range(4):
+            diagram = self.create_diagram('Class%d' % i)
+            filename = os.path.join(self.dir, 'pkg', 'diagram%d.svg' % i)
+            jobs.append((diagram, filename, 'svg'))
+
+        exporter = BatchExporter(self.element_factory, processes=2)
+        results = list(exporter.export(jobs))
+        self.assertEquals(4, len(results))
+        self.assertEquals(sorted(j[1] for j in jobs),
+                          sorted(r.filename for r in results))
+        for result in results:
+            assert result.ok, result.error
+            assert result.time >= 0
+            assert os.path.exists(result.filename)
+
+    def test_export_error(self):
+        diagram = self.create_diagram('Class1')
+        filename = os.path.join(self.dir, 'diagram.xyz')
+        exporter = BatchExporter(self.element_factory, processes=1)
+        result, = exporter.export([(diagram, filename, 'xyz')])
+        assert not result.ok
+        assert not result.timeout
+        assert result.size is None
+
+    def test_timeout(self):
+        """
+        Workers that take too long or die are replaced.
+        """
+        class Exporter(BatchExporter):
+            def export_one(self, id, filename, format):
+                if filename.endswith('hang.svg'):
+                    time.sleep(60)
+                elif filename.endswith('die.svg'):
+                    os._exit(3)
+                return BatchExporter.export_one(self, id, filename, format)
+
+        diagram = self.create_diagram('Class1')
+        jobs = [ (diagram, os.path.join(self.dir, name + '.svg'), 'svg')
+                 for name in ('one', 'hang', 'two', 'die', 'three') ]
+        exporter = Exporter(self.element_factory, processes=2, timeout=2)
+        results = dict((os.path.basename(r.filename), r)
+                       for r in exporter.export(jobs))
+        self.assertEquals(5, len(results))
+        for name in ('one.svg', 'two.svg', 'three.svg'):
+            assert results[name].ok, results[name].error
+        assert results['hang.svg'].timeout
+        assert not results['die.svg'].ok
+        assert not results['die.svg'].timeout
+
+    def test_render_manifest(self):
+        filename = os.path.join(self.dir, RenderManifest.FILENAME)
+        diagram = os.path.join(self.dir, 'diagram.svg')
+        manifest = RenderManifest(filename, '1.0')
+        assert not manifest.is_current(diagram, 'abc')
+        manifest.update(diagram, 'abc')
+        manifest.save()
+
+        manifest = RenderManifest(filename, '1.0')
+        # The exported file does not exist
+        assert not manifest.is_current(diagram, 'abc')
+        open(diagram, 'w').close()
+        assert manifest.is_current(diagram, 'abc')
+        assert not manifest.is_current(diagram, 'def')
+
+        manifest = RenderManifest(filename, '2.0')
+        assert not manifest.is_current(diagram, 'abc')
+
+        with open(filename, 'w') as f:
+            f.write('garbage')
+        manifest = RenderManifest(filename, '1.0')
+        assert not manifest.is_current(diagram, 'abc')
+
+
+
+# vim:sw=4:et:ai
@@ -0,0 +1,74 @@
+"""
+Test text layout caching.
+"""
+
+import unittest
+
+import cairo
+from gaphor.diagram.textelement import TextLayoutCache, text_extents
+
+
+class TextLayoutCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 100, 100)
+        self.cr = cairo.Context(surface)
+
+    def test_hits_and_misses(self):
+        cache = TextLayoutCache()
+        layout = cache.layout(self.cr, 'text', 'sans 10', -1)
+        self.assertEquals((0, 1), (cache.hits, cache.misses))
+
+        assert layout is cache.layout(self.cr, 'text', 'sans 10', -1)
+        self.assertEquals((1, 1), (cache.hits, cache.misses))
+
+        # Other font, other layout
+        assert layout is not cache.layout(self.cr, 'text', 'sans 12', -1)
+        self.assertEquals((1, 2), (cache.hits, cache.misses))
+        self.assertEquals(2, len(cache))
+
+    def test_font_description(self):
+        cache = TextLayoutCache()
+        desc = cache.font_description('sans 10')
+        assert desc is cache.font_description('sans 10')
+
+    def test_lru(self):
+        cache = TextLayoutCache(size=2)
+        a = cache.layout(self.cr, 'a', None, -1)
+        b = cache.layout(self.cr, 'b', None, -1)
+        # 'a' is used last, 'b' is dropped
+        cache.layout(self.cr, 'a', None, -1)
+        cache.layout(self.cr, 'c', None, -1)
+        self.assertEquals(2, len(cache))
+        assert a is cache.layout(self.cr, 'a', None, -1)
+        assert b is not cache.layout(self.cr, 'b', None, -1)
+
+    def test_resize(self):
+        cache = TextLayoutCache(size=3)
+        a = cache.layout(self.cr, 'a', None, -1)
+        cache.layout(self.cr, 'b', None, -1)
+        cache.layout(self.cr, 'c', None, -1)
+        cache.layout(self.cr, 'a', None, -1)
+        # Least recently used layouts are dropped first
+        cache.size = 1
+        self.assertEquals(1, len(cache))
+        assert a is cache.layout(self.cr, 'a', None, -1)
+        cache.layout(self.cr, 'b', None, -1)
+        self.assertEquals(1, len(cache))
+
+    def test_clear(self):
+        cache = TextLayoutCache()
+        layout = cache.layout(self.cr, 'text', 'sans 10', -1)
+        cache.clear()
+        self.assertEquals(0, len(cache))
+        assert layout is not cache.layout(self.cr, 'text', 'sans 10', -1)
+
+    def test_text_extents(self):
+        w, h = text_extents(self.cr, 'some text', font='sans 10')
+        assert w > 0 and h > 0
+        self.assertEquals((w, h), text_extents(self.cr, 'some text',
+                                               font='sans 10'))
+        self.assertEquals((0, 0), text_extents(self.cr, ''))
+
+
+# vim:sw=4:et:ai
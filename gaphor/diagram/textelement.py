@@ -1,11 +1,16 @@
 """
 Support for editable text, a part of a diagram item, i.e. name of named
 item, guard of flow item, etc.
+
+Text is measured and drawn with Pango layouts. Creating a layout is
+expensive, so layouts are kept in an LRU cache (``layout_cache``), keyed on
+text, font and width.
 """
 
 import math
 
 import cairo, pango, pangocairo
+from gaphor.misc.odict import odict
 from gaphor.diagram.style import Style
 from gaphor.diagram.style import ALIGN_CENTER, ALIGN_TOP
 
@@ -14,6 +19,13 @@ from gaphas.geometry import distance_rectangle_point, Rectangle
 
 DEFAULT_TEXT_FONT = 'sans 10'
 
+# Maximum number of layouts kept in the layout cache. The diagrams of the
+# UML metamodel (gaphor/UML/uml2.gaphor, 800 canvas items) show about 500
+# distinct names and features, so this keeps all texts of big models while
+# texts that are no longer shown (e.g. while a name is typed) are dropped.
+# It can be changed with the 'diagram.layout-cache-size' property.
+LAYOUT_CACHE_SIZE = 4096
+
 
 def swap(list, el1, el2):
     """
@@ -25,15 +37,99 @@ def swap(list, el1, el2):
     list[i2] = el1
 
 
+class TextLayoutCache(object):
+    """
+    LRU cache of Pango layouts, keyed on (text, font, width). Font
+    descriptions are cached by font name as well.
+
+    A cached layout is updated to the cairo context it is used with (as
+    pangocairo.CairoContext.update_layout() does), so layouts can be shared
+    between views and export surfaces. The layout is only laid out again
+    if the transformation or font options of the context differ.
+
+    At most ``size`` layouts are kept, the least recently used layouts
+    are dropped when the size is lowered.
+
+    The number of cache hits and misses is kept in ``hits`` and
+    ``misses``. Call clear() when the font configuration changes (e.g. the
+    fonts installed or the screen resolution).
+    """
+
+    def __init__(self, size=LAYOUT_CACHE_SIZE):
+        self._size = size
+        self._layouts = odict()
+        self._fonts = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self._layouts)
+
+
+    def _set_size(self, size):
+        assert size > 0, 'Layout cache size should be positive'
+        self._size = size
+        layouts = self._layouts
+        while len(layouts) > size:
+            del layouts[iter(layouts).next()]
+
+    size = property(lambda s: s._size, _set_size,
+                    doc="Maximum number of cached layouts.")
+
+
+    def font_description(self, font):
+        """
+        Return the pango.FontDescription for font name ``font``.
+        """
+        try:
+            return self._fonts[font]
+        except KeyError:
+            desc = self._fonts[font] = pango.FontDescription(font)
+            return desc
+
+
+    def layout(self, cr, text, font, width):
+        """
+        Return a layout for ``text`` in ``font``, wrapped at ``width``,
+        for cairo context ``cr``.
+        """
+        key = (text, font, width)
+        layouts = self._layouts
+        cr = pangocairo.CairoContext(cr)
+        try:
+            # Take the layout out, it's put back as most recently used
+            layout = layouts.pop(key)
+        except KeyError:
+            self.misses += 1
+            layout = cr.create_layout()
+            if font:
+                layout.set_font_description(self.font_description(font))
+            layout.set_text(text)
+            layout.set_width(int(width * pango.SCALE))
+            #layout.set_height(height)
+            if len(layouts) >= self._size:
+                del layouts[iter(layouts).next()]
+        else:
+            self.hits += 1
+            cr.update_layout(layout)
+        layouts[key] = layout
+        return layout
+
+
+    def clear(self):
+        """
+        Drop all cached layouts and font descriptions.
+        """
+        self._layouts.clear()
+        self._fonts.clear()
+
+
+layout_cache = TextLayoutCache()
+
+
 def _text_layout(cr, text, font, width):
-    cr = pangocairo.CairoContext(cr)
-    layout = cr.create_layout()
-    if font:
-        layout.set_font_description(pango.FontDescription(font))
-    layout.set_text(text)
-    layout.set_width(int(width * pango.SCALE))
-    #layout.set_height(height)
-    return layout
+    return layout_cache.layout(cr, text, font, width)
 
 
 def text_extents(cr, text, font=None, width=-1, height=-1):
@@ -452,11 +548,9 @@ class TextElement(object):
 
         cr = context.cairo
         if isinstance(cr, cairo.Context) and self.text:
-            cr = pangocairo.CairoContext(context.cairo)
+            layout = _text_layout(cr, self.text, self._style.font, -1)
+            cr = pangocairo.CairoContext(cr)
             cr.move_to(x, y)
-            layout = cr.create_layout()
-            layout.set_font_description(pango.FontDescription(self._style.font))
-            layout.set_text(self.text)
             cr.show_layout(layout)
         if self.editable and (context.hovered or context.focused):
             cr.save()
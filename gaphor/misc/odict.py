@@ -1,66 +1,110 @@
-# from http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/107747
+# Originally from http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/107747
+
+# Indexes in a link of the key list
+PREV, NEXT, KEY = 0, 1, 2
+
+
 class odict(dict):
+    """
+    A dictionary that remembers the order in which keys are inserted.
+
+    The keys are kept in a circular, doubly linked list. A map from key to
+    list link makes insertion, deletion, membership tests and swap() O(1).
+    """
 
     def __init__(self, dict=()):
-        self._keys = []
-        super(odict, self).__init__(dict)
+        super(odict, self).__init__()
+        self._root = root = []
+        root[:] = [root, root, None]
+        self._map = {}
+        self.update(dict)
+
+    def __setitem__(self, key, item):
+        if not dict.__contains__(self, key):
+            root = self._root
+            last = root[PREV]
+            last[NEXT] = root[PREV] = self._map[key] = [last, root, key]
+        dict.__setitem__(self, key, item)
 
     def __delitem__(self, key):
         dict.__delitem__(self, key)
-        self._keys.remove(key)
+        prev, next, _ = self._map.pop(key)
+        prev[NEXT] = next
+        next[PREV] = prev
 
-    def __setitem__(self, key, item):
-        dict.__setitem__(self, key, item)
-        if key not in self._keys: self._keys.append(key)
+    def __iter__(self):
+        root = self._root
+        link = root[NEXT]
+        while link is not root:
+            next = link[NEXT]
+            yield link[KEY]
+            link = next
+
+    def __reduce__(self):
+        return self.__class__, (self.items(),)
 
     def clear(self):
         dict.clear(self)
-        self._keys = []
+        root = self._root
+        root[:] = [root, root, None]
+        self._map.clear()
 
     def copy(self):
-        dict = dict.copy(self)
-        dict._keys = self._keys[:]
-        return dict
+        return self.__class__(self.items())
 
-    def items(self):
-        return zip(self._keys, self.values())
+    iterkeys = __iter__
 
     def keys(self):
-        return self._keys
+        return list(self)
 
-    def popitem(self):
-        try:
-            key = self._keys[-1]
-        except IndexError:
-            raise KeyError('dictionary is empty')
+    def itervalues(self):
+        for key in self:
+            yield self[key]
 
-        val = self[key]
-        del self[key]
+    def values(self):
+        return [ self[key] for key in self ]
 
-        return (key, val)
+    def iteritems(self):
+        for key in self:
+            yield (key, self[key])
 
-    def setdefault(self, key, failobj=None):
-        dict.setdefault(self, key, failobj)
-        if key not in self._keys: self._keys.append(key)
+    def items(self):
+        return [ (key, self[key]) for key in self ]
 
-    def update(self, dict):
-        dict.update(self, dict)
-        for key in dict.keys():
-            if key not in self._keys: self._keys.append(key)
+    def pop(self, key, *default):
+        if dict.__contains__(self, key):
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
 
-    def values(self):
-        return map(self.get, self._keys)
-    
+    def popitem(self):
+        last = self._root[PREV]
+        if last is self._root:
+            raise KeyError('dictionary is empty')
+        key = last[KEY]
+        return (key, self.pop(key))
+
+    def setdefault(self, key, failobj=None):
+        if not dict.__contains__(self, key):
+            self[key] = failobj
+        return self[key]
+
+    def update(self, other=()):
+        if hasattr(other, 'keys'):
+            for key in other.keys():
+                self[key] = other[key]
+        else:
+            for key, value in other:
+                self[key] = value
 
     def swap(self, k1, k2):
         """
         Swap two elements using their keys.
         """
-        i1 = self._keys.index(k1)
-        i2 = self._keys.index(k2)
-        self._keys[i1], self._keys[i2] = self._keys[i2], self._keys[i1]
-
+        map = self._map
+        l1 = map[k1]
+        l2 = map[k2]
+        l1[KEY], l2[KEY] = k2, k1
+        map[k1], map[k2] = l2, l1
 
-    def __iter__(self):
-        for k in self._keys:
-            yield k
@@ -0,0 +1,78 @@
+
+import pickle
+import unittest
+from gaphor.misc.odict import odict
+
+
+class OdictTestCase(unittest.TestCase):
+
+    def test_order(self):
+        d = odict()
+        for k in 'qwerty':
+            d[k] = k.upper()
+        d['w'] = 'w'
+        self.assertEquals(list('qwerty'), d.keys())
+        self.assertEquals(list('qwerty'), list(d))
+        self.assertEquals(list('QwERTY'), d.values())
+        self.assertEquals(list('QwERTY'), list(d.itervalues()))
+        self.assertEquals(zip('qwerty', 'QwERTY'), d.items())
+        self.assertEquals(d.items(), list(d.iteritems()))
+
+    def test_delete(self):
+        d = odict()
+        for k in 'qwerty':
+            d[k] = k
+        del d['q']
+        del d['r']
+        del d['y']
+        self.assertEquals(list('wet'), d.keys())
+        self.assertRaises(KeyError, d.__delitem__, 'q')
+        d['q'] = 'q'
+        self.assertEquals(list('wetq'), d.keys())
+        self.assertEquals('e', d.pop('e'))
+        self.assertEquals(None, d.pop('e', None))
+        self.assertEquals(('q', 'q'), d.popitem())
+        self.assertEquals(list('wt'), d.keys())
+        d.clear()
+        self.assertEquals([], d.keys())
+        self.assertRaises(KeyError, d.popitem)
+
+    def test_delete_while_iterating(self):
+        d = odict()
+        for k in 'qwerty':
+            d[k] = k
+        for k in d:
+            del d[k]
+        self.assertEquals(0, len(d))
+        self.assertEquals([], d.keys())
+
+    def test_swap(self):
+        d = odict()
+        for k in 'qwerty':
+            d[k] = k.upper()
+        d.swap('w', 't')
+        self.assertEquals(list('qterwy'), d.keys())
+        self.assertEquals(list('QTERWY'), d.values())
+        del d['t']
+        d.swap('q', 'y')
+        self.assertEquals(list('yerwq'), d.keys())
+
+    def test_construct(self):
+        d = odict([('b', 1), ('a', 2)])
+        self.assertEquals(['b', 'a'], d.keys())
+        c = d.copy()
+        c['c'] = 3
+        self.assertEquals(['b', 'a', 'c'], c.keys())
+        self.assertEquals(['b', 'a'], d.keys())
+        self.assertEquals(['b', 'a'], pickle.loads(pickle.dumps(d, 2)).keys())
+        d.update(odict([('d', 4), ('b', 5)]))
+        self.assertEquals(['b', 'a', 'd'], d.keys())
+        self.assertEquals(5, d['b'])
+        self.assertEquals(0, d.setdefault('e', 0))
+        self.assertEquals(['b', 'a', 'd', 'e'], d.keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:sw=4:et:ai
@@ -0,0 +1,31 @@
+"""
+Generation of unique ids for model elements and diagram items.
+
+Ids look like UUID strings. Instead of calling uuid.uuid1() for every id,
+a random UUID is created once per batch of 65536 ids and the last four
+hex digits are used as a counter.
+"""
+
+import uuid
+
+BATCH_SIZE = 0x10000
+
+
+def _generate_ids():
+    while True:
+        prefix = str(uuid.uuid4())[:-4]
+        for i in xrange(BATCH_SIZE):
+            yield '%s%04x' % (prefix, i)
+
+
+_ids = _generate_ids()
+
+
+def generate_id():
+    """
+    Return a new unique id string.
+    """
+    return _ids.next()
+
+
+# vim:sw=4:et:ai
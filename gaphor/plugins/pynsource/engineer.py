@@ -41,7 +41,7 @@ class Engineer(object):
         print p
         
         try:
-            self._root_package = self.element_factory.lselect(lambda e: isinstance(e, UML.Package) and not e.namespace)[0]
+            self._root_package = [p for p in self.element_factory.select_type(UML.Package) if not p.namespace][0]
         except IndexError:
             pass # running as test?
 
@@ -91,7 +91,7 @@ class Engineer(object):
                     superclass_item = self.parser.classlist[superclassname].gaphor_class_item
                 except KeyError, e:
                     print 'No class found named', superclassname
-                    others = self.element_factory.lselect(lambda e: isinstance(e, UML.Class) and e.name == superclassname)
+                    others = [c for c in self.element_factory.select_type(UML.Class) if c.name == superclassname]
                     if others:
                         superclass = others[0]
                         print 'Found class in factory: %s' % superclass.name
@@ -154,7 +154,7 @@ class Engineer(object):
             superclass_item = self.parser.classlist[classname].gaphor_class_item
         except KeyError, e:
             print 'No class found named', classname
-            others = self.element_factory.lselect(lambda e: isinstance(e, UML.Class) and e.name == classname)
+            others = [c for c in self.element_factory.select_type(UML.Class) if c.name == classname]
             if others:
                 superclass = others[0]
                 print 'Found class in factory: %s' % superclass.name
@@ -1,4 +1,5 @@
 
+from gaphor import UML
 from gaphor.misc.xmlwriter import XMLWriter
 
 class XMIExport(object):
@@ -13,6 +14,12 @@ class XMIExport(object):
         self.element_factory = element_factory
         self.handled_ids = list()
         
+    def xmi_id(self, element):
+        """
+        Return the id element is saved with.
+        """
+        return self.element_factory.persistent_id(element.id)
+
     def handle(self, xmi, element):
         log.debug('Handling %s'%element.__class__.__name__)
         try:
@@ -30,7 +37,7 @@ class XMIExport(object):
     def handlePackage(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         attributes['name'] = element.name
         attributes['visibility'] = element.visibility
 
@@ -48,9 +55,9 @@ class XMIExport(object):
         attributes = dict()
         
         if idref:
-            attributes['%s:idref'%self.XMI_PREFIX] = element.id
+            attributes['%s:idref'%self.XMI_PREFIX] = self.xmi_id(element)
         else:
-            attributes['%s:id'%self.XMI_PREFIX] = element.id
+            attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
             attributes['name'] = element.name
             attributes['isAbstract'] = str(element.isAbstract)
         
@@ -73,7 +80,7 @@ class XMIExport(object):
     def handleProperty(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         attributes['isStatic'] = str(element.isStatic)
         attributes['isOrdered'] = str(element.isOrdered)
         attributes['isUnique'] = str(element.isUnique)
@@ -97,7 +104,7 @@ class XMIExport(object):
     def handleOperation(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         attributes['isStatic'] = str(element.isStatic)
         attributes['isQuery'] = str(element.isQuery)
         attributes['name'] = element.name
@@ -114,7 +121,7 @@ class XMIExport(object):
     def handleParameter(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         attributes['isOrdered'] = str(element.isOrdered)
         attributes['isUnique'] = str(element.isUnique)
 
@@ -128,7 +135,7 @@ class XMIExport(object):
     def handleLiteralSpecification(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         attributes['value'] = element.value
         
         xmi.startElement('%s:LiteralSpecification'%self.UML_PREFIX, attrs=attributes)
@@ -138,7 +145,7 @@ class XMIExport(object):
     def handleAssociation(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         attributes['isDerived'] = str(element.isDerived)
         
         xmi.startElement('%s:Association'%self.UML_PREFIX, attrs=attributes)
@@ -158,7 +165,7 @@ class XMIExport(object):
     def handleDependency(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         
         xmi.startElement('%s:Dependency'%self.UML_PREFIX, attrs=attributes)
         
@@ -177,7 +184,7 @@ class XMIExport(object):
     def handleGeneralization(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         attributes['isSubstitutable'] = str(element.isSubstitutable)
         
         xmi.startElement('%s:Generalization'%self.UML_PREFIX, attrs=attributes)
@@ -197,7 +204,7 @@ class XMIExport(object):
     def handleRealization(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         
         xmi.startElement('%s:Realization'%self.UML_PREFIX, attrs=attributes)
         
@@ -216,7 +223,7 @@ class XMIExport(object):
     def handleInterface(self, xmi, element, idref=False):
         
         attributes = dict()
-        attributes['%s:id'%self.XMI_PREFIX] = element.id
+        attributes['%s:id'%self.XMI_PREFIX] = self.xmi_id(element)
         
         xmi.startElement('%s:Interface'%self.UML_PREFIX, attrs=attributes)
         
@@ -244,24 +251,17 @@ class XMIExport(object):
         
         xmi.startElement('XMI', attrs=attributes)
         
-        for package in self.element_factory.select(self.select_package):
+        select_type = self.element_factory.select_type
+
+        for package in select_type(UML.Package, include_subclasses=False):
             self.handle(xmi, package)
             
-        for generalization in self.element_factory.select(self.select_generalization):
+        for generalization in select_type(UML.Generalization, include_subclasses=False):
             self.handle(xmi, generalization)
             
-        for realization in self.element_factory.select(self.select_realization):
+        for realization in select_type(UML.Implementation, include_subclasses=False):
             self.handle(xmi, realization)
         
         xmi.endElement('XMI')
         
         log.debug(self.handled_ids)
-        
-    def select_package(self, element):
-        return element.__class__.__name__ == 'Package'
-        
-    def select_generalization(self, element):
-        return element.__class__.__name__ == 'Generalization'
-        
-    def select_realization(self, element):
-        return element.__class__.name__ == 'Implementation'
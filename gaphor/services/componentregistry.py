@@ -7,6 +7,7 @@ unregister_handler, handle), a AdapterRegistry and a Subscription registry.
 """
 
 from zope import interface, component
+from zope.interface import providedBy
 from zope.component import registry
 from gaphor.core import inject
 from gaphor.interfaces import IService, IEventFilter
@@ -25,12 +26,17 @@ class ZopeComponentRegistry(object):
     interface.implements(IService)
 
     def __init__(self):
-        pass
+        # Event filters and handlers, per interface specification provided
+        # by an event. Valid as long as the registry generation is the same.
+        self._dispatch_cache = {}
+        self._dispatch_generation = None
 
     def init(self, app):
         self._components = registry.Components(
                                name='component_registry',
                                bases=(component.getGlobalSiteManager(),))
+        self._dispatch_cache.clear()
+        self._dispatch_generation = None
 
         # Make sure component.handle() and query methods works.
         # TODO: eventually all queries should be done through the Application
@@ -146,11 +152,37 @@ class ZopeComponentRegistry(object):
         """
         self._components.unregisterHandler(factory, required)
  
+    def _lookup(self, event):
+        """
+        Return the event filters and handlers for ``event``, as a tuple
+        ``(filters, handlers)``.
+
+        Lookups are cached per interface specification provided by the event
+        (for our events that is the event class). The adapter registry
+        increments its generation whenever registrations change, in this
+        registry or in the global site manager it's based on, which
+        invalidates the cache.
+        """
+        adapters = self._components.adapters
+        if adapters._generation != self._dispatch_generation:
+            self._dispatch_cache.clear()
+            self._dispatch_generation = adapters._generation
+        spec = providedBy(event)
+        try:
+            return self._dispatch_cache[spec]
+        except KeyError:
+            lookup = (tuple(adapters.subscriptions((spec,), IEventFilter)),
+                      tuple(adapters.subscriptions((spec,), None)))
+            self._dispatch_cache[spec] = lookup
+            return lookup
+
     def _filter(self, objects):
         filtered = list(objects)
         for o in objects:
-            for adapter in self._components.subscribers(objects, IEventFilter):
-                if adapter.filter():
+            filters = self._lookup(o)[0]
+            for factory in filters:
+                adapter = factory(o)
+                if adapter is not None and adapter.filter():
                     # event is blocked
                     filtered.remove(o)
                     break
@@ -159,10 +191,17 @@ class ZopeComponentRegistry(object):
     def handle(self, *events):
         """
         Send event notifications to registered handlers.
+
+        Event filters (``IEventFilter`` subscription adapters) are only
+        created if any are registered for the event, which is only the case
+        while the model is flushed or loaded.
         """
-        objects = self._filter(events)
-        if objects:
-            map(self._components.handle, events)
+        for event in events:
+            filters, handlers = self._lookup(event)
+            if filters and not self._filter((event,)):
+                continue
+            for handler in handlers:
+                handler(event)
 
 
 # vim:sw=4:et:ai
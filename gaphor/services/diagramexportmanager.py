@@ -3,7 +3,6 @@ Service dedicated to exporting diagrams to a varyity of file formats.
 """
 
 import os
-import cairo
 
 from zope import interface, component
 
@@ -13,10 +12,7 @@ from gaphor.interfaces import IService, IActionProvider
 from gaphor.ui.filedialog import FileDialog
 from gaphor.ui.questiondialog import QuestionDialog
 
-from gaphas.view import View
-from gaphas.painter import ItemPainter, BoundingBoxPainter
-from gaphas.freehand import FreeHandPainter
-from gaphas.geometry import Rectangle
+from gaphor.diagram.export import render_canvas, BatchExporter
 
 class DiagramExportManager(object):
     """
@@ -27,6 +23,7 @@ class DiagramExportManager(object):
 
     main_window = inject('main_window')
     properties = inject('properties')
+    element_factory = inject('element_factory')
     logger = getLogger('ExportManager')
 
     menu_xml = """
@@ -87,98 +84,41 @@ class DiagramExportManager(object):
         if save and filename:
             return filename                
         
-    def update_painters(self, view):
-        
-        self.logger.info('Updating painters')
-        self.logger.debug('View is %s' % view)
-        
-        sloppiness = self.properties('diagram.sloppiness', 0)
-        
-        self.logger.debug('Sloppiness is %s' % sloppiness)
-        
-        if sloppiness:
-            view.painter = FreeHandPainter(ItemPainter(), sloppiness)
-            view.bounding_box_painter = FreeHandPainter(BoundingBoxPainter(), sloppiness)
-        else:
-            view.painter = ItemPainter()
-
-    def save_svg(self, filename, canvas):
-        
-        self.logger.info('Exporting to SVG')
-        self.logger.debug('SVG path is %s' % filename)
-        
-        view = View(canvas)
-
-        self.update_painters(view)
+    def get_sloppiness(self):
+        return self.properties('diagram.sloppiness', 0)
 
-        # Update bounding boxes with a temporaly CairoContext
-        # (used for stuff like calculating font metrics)
-        tmpsurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 0, 0)
-        tmpcr = cairo.Context(tmpsurface)
-        view.update_bounding_box(tmpcr)
-        tmpcr.show_page()
-        tmpsurface.flush()
+    def save(self, filename, canvas, format):
+        """
+        Export ``canvas`` to ``filename``, as ``format`` (svg, png or pdf).
+        """
+        self.logger.info('Exporting to %s' % format.upper())
+        self.logger.debug('%s path is %s' % (format.upper(), filename))
 
-        w, h = view.bounding_box.width, view.bounding_box.height
-        surface = cairo.SVGSurface(filename, w, h)
-        cr = cairo.Context(surface)
-        view.matrix.translate(-view.bounding_box.x, -view.bounding_box.y)
-        view.paint(cr)
-        cr.show_page()
-        surface.flush()
-        surface.finish()
+        render_canvas(canvas, filename, format, self.get_sloppiness())
 
+    def save_svg(self, filename, canvas):
+        self.save(filename, canvas, 'svg')
 
     def save_png(self, filename, canvas):
-        
-        self.logger.info('Exporting to PNG')
-        self.logger.debug('PNG path is %s' % filename)
-        
-        view = View(canvas)
-
-        self.update_painters(view)
-
-        # Update bounding boxes with a temporaly CairoContext
-        # (used for stuff like calculating font metrics)
-        tmpsurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 0, 0)
-        tmpcr = cairo.Context(tmpsurface)
-        view.update_bounding_box(tmpcr)
-        tmpcr.show_page()
-        tmpsurface.flush()
-
-        w, h = view.bounding_box.width, view.bounding_box.height
-        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, int(w+1), int(h+1))
-        cr = cairo.Context(surface)
-        view.matrix.translate(-view.bounding_box.x, -view.bounding_box.y)
-        view.paint(cr)
-        cr.show_page()
-        surface.write_to_png(filename)
+        self.save(filename, canvas, 'png')
 
     def save_pdf(self, filename, canvas):
-        
-        self.logger.info('Exporting to PDF')
-        self.logger.debug('PDF path is %s' % filename)
-        
-        view = View(canvas)
-
-        self.update_painters(view)
-
-        # Update bounding boxes with a temporaly CairoContext
-        # (used for stuff like calculating font metrics)
-        tmpsurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 0, 0)
-        tmpcr = cairo.Context(tmpsurface)
-        view.update_bounding_box(tmpcr)
-        tmpcr.show_page()
-        tmpsurface.flush()
-
-        w, h = view.bounding_box.width, view.bounding_box.height
-        surface = cairo.PDFSurface(filename, w, h)
-        cr = cairo.Context(surface)
-        view.matrix.translate(-view.bounding_box.x, -view.bounding_box.y)
-        view.paint(cr)
-        cr.show_page()
-        surface.flush()
-        surface.finish()
+        self.save(filename, canvas, 'pdf')
+
+    def save_diagrams(self, jobs, processes=1, timeout=None):
+        """
+        Export a list of diagrams. ``jobs`` is a list of (diagram, filename,
+        format) tuples. See gaphor.diagram.export.BatchExporter for
+        ``processes`` and ``timeout``. Returns a list of ExportResults.
+        """
+        exporter = BatchExporter(self.element_factory, processes, timeout,
+                                 self.get_sloppiness())
+        results = list(exporter.export(jobs))
+        for result in results:
+            if not result.ok:
+                self.logger.warning('Could not export %s: %s' % \
+                                    (result.filename, result.error))
+        return results
 
     @action(name='file-export-svg', label='Export to SVG',
             tooltip='Export the diagram to SVG')
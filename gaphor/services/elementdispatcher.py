@@ -3,14 +3,23 @@
 
 from zope import interface, component
 
+try:
+    import gobject
+except ImportError:
+    gobject = None
+
 from logging import getLogger
 from gaphor.core import inject
 from gaphor.interfaces import IService
-from gaphor.UML.interfaces import IElementChangeEvent, IModelFactoryEvent
+from gaphor.event import TransactionCommit, TransactionRollback
+from gaphor.transaction import Transaction
+from gaphor.UML.interfaces import IElementChangeEvent, IModelFactoryEvent, \
+                                  IDiagramLoadedEvent
 from gaphor import UML
 from gaphor.UML.interfaces import IAssociationSetEvent,\
                                   IAssociationAddEvent,\
-                                  IAssociationDeleteEvent
+                                  IAssociationDeleteEvent,\
+                                  IAssociationExtendEvent
 
 class EventWatcher(object):
     """
@@ -20,10 +29,15 @@ class EventWatcher(object):
     element_dispatcher = inject('element_dispatcher')
     logger = getLogger('EventWatcher')
 
-    def __init__(self, element, default_handler=None):
+    def __init__(self, element, default_handler=None, deferred=False):
+        """
+        If ``deferred`` is set, the paths watched with the default handler
+        are registered as deferred handlers (see ElementDispatcher).
+        """
         super(EventWatcher, self).__init__()
         self.element = element
         self.default_handler = default_handler
+        self.deferred = deferred
         self._watched_paths = dict()
 
     def watch(self, path, handler=None):
@@ -56,14 +70,17 @@ class EventWatcher(object):
         #self.logger.info('Registering handlers')
         
         dispatcher = self.element_dispatcher
-        element = self.element
-        
-        for path, handler in self._watched_paths.iteritems():
-            
-            #self.logger.debug('Path is %s' % path)
-            #self.logger.debug('Handler is %s' % handler)
-            
-            dispatcher.register_handler(handler, element, path)
+        if self.deferred:
+            default_handler = self.default_handler
+            paths = self._watched_paths.items()
+            dispatcher.register_handlers(self.element,
+                    [ p for p in paths if p[1] != default_handler ])
+            dispatcher.register_handlers(self.element,
+                    [ p for p in paths if p[1] == default_handler ],
+                    deferred=True)
+        else:
+            dispatcher.register_handlers(self.element,
+                    self._watched_paths.iteritems())
 
 
     def unregister_handlers(self, *args):
@@ -108,6 +125,18 @@ class ElementDispatcher(object):
     This dispatcher keeps track of the kind of events that are dispatched. The
     dispatcher table is updated accordingly (so the right handlers are fired
     every time).
+
+    Paths are compiled to properties once per element type. Paths that start
+    with the same properties share the traversal of the elements they lead
+    to, which makes registering all paths of an item in one call
+    (register_handlers()) cheaper.
+
+    Handlers can be registered as deferred, for handlers that only schedule
+    work, such as a redraw. During a transaction their invocations are
+    queued, once per (handler, element) with the last event, and delivered
+    when the transaction ends. Outside a transaction, invocations from
+    within the GLib main loop are delivered from an idle callback. Otherwise
+    deferred handlers are called right away.
     """
 
     interface.implements(IService)
@@ -121,18 +150,44 @@ class ElementDispatcher(object):
         self._handlers = dict()
 
         # Fast resolution when handlers are disconnected
-        # handler: [(element, property), ..]
+        # handler: set([(element, property), ..])
         self._reverse = dict()
 
+        # The registrations, used to rebuild the tables after load
+        # handler: set([(element, (property, ..)), ..])
+        self._roots = dict()
+
+        # Compiled paths
+        # (element type, path): (property, ..)
+        self._paths = dict()
+
+        # Deferred handlers and their queued invocations
+        # (handler, element): event
+        self._deferred = set()
+        self._queue = []
+        self._queued = dict()
+        self._idle_id = 0
+
 
     def init(self, app):
         self.component_registry.register_handler(self.on_model_loaded)
+        self.component_registry.register_handler(self.on_diagram_loaded)
         self.component_registry.register_handler(self.on_element_change_event)
+        self.component_registry.register_handler(self.flush)
+        self.component_registry.register_handler(self.flush_on_rollback)
 
 
     def shutdown(self):
+        self.component_registry.unregister_handler(self.flush_on_rollback)
+        self.component_registry.unregister_handler(self.flush)
         self.component_registry.unregister_handler(self.on_element_change_event)
+        self.component_registry.unregister_handler(self.on_diagram_loaded)
         self.component_registry.unregister_handler(self.on_model_loaded)
+        if self._idle_id:
+            gobject.source_remove(self._idle_id)
+            self._idle_id = 0
+        del self._queue[:]
+        self._queued.clear()
 
 
     def _path_to_properties(self, element, path):
@@ -146,8 +201,8 @@ class ElementDispatcher(object):
         ...         'ownedOperation.parameter.name')) # doctest: +NORMALIZE_WHITESPACE
         ['<association ownedOperation: Operation[0..*] <>-> class_>',
         "<derived parameter:
-            '<association returnResult: Parameter[0..*] <>-> ownerReturnParam>',
-            '<association formalParameter: Parameter[0..*] <>-> ownerFormalParam>'>",
+            '<association formalParameter: Parameter[0..*] <>-> ownerFormalParam>',
+            '<association returnResult: Parameter[0..*] <>-> ownerReturnParam>'>",
         "<attribute name: <type 'str'>[0..1] = None>"]
 
         Should also work for elements that use subtypes of a certain class:
@@ -158,6 +213,11 @@ class ElementDispatcher(object):
          "<attribute specification: <type 'str'>[0..1] = None>"]
         """
         c = type(element)
+        key = (c, path)
+        try:
+            return self._paths[key]
+        except KeyError:
+            pass
         tpath = []
         for attr in path.split('.'):
             cname = ''
@@ -171,50 +231,60 @@ class ElementDispatcher(object):
                 assert issubclass(c, prop.type), '%s should be a subclass of %s' % (c, prop.type)
             else:
                 c = prop.type
-        return tuple(tpath)
+        tpath = self._paths[key] = tuple(tpath)
+        return tpath
 
 
-    def _add_handlers(self, element, props, handler):
+    def _add_paths(self, element, paths):
         """
-        Provided an element and a path of properties (props), register the
-        handler for each property.
+        Register handlers for paths of properties starting at ``element``.
+        ``paths`` is a list of (props, handler) tuples. Paths that start with
+        the same property share the traversal to the next elements.
         """
-        property, remainder = props[0], props[1:]
-        key = (element, property)
-        
-        # Register key
-        try:
-            handlers = self._handlers[key]
-        except KeyError:
-            handlers = dict()
-            self._handlers[key] = handlers
-
-        # Register handler and it's remaining paths
-        try:
-            remainders = handlers[handler]
-        except KeyError:
-            remainders = handlers[handler] = set()
-        if remainder:
-            remainders.add(remainder)
-
-        # Also add them to the reverse table, easing disconnecting
-        try:
-            reverse = self._reverse[handler]       
-        except KeyError:
-            reverse = []
-            self._reverse[handler] = reverse
-
-        reverse.append(key)
-
-        # Apply remaining path
-        if remainder:
-            if property.upper > 1:
-                for e in property._get(element):
-                    self._add_handlers(e, remainder, handler)
+        by_property = {}
+        for props, handler in paths:
+            remainders = by_property.get(props[0])
+            if remainders is None:
+                by_property[props[0]] = [(props[1:], handler)]
             else:
-                e = property._get(element)
-                if e and remainder:
-                    self._add_handlers(e, remainder, handler)
+                remainders.append((props[1:], handler))
+
+        all_handlers = self._handlers
+        reverse = self._reverse
+        for property, remainders in by_property.iteritems():
+            key = (element, property)
+
+            # Register key
+            handlers = all_handlers.get(key)
+            if handlers is None:
+                handlers = all_handlers[key] = dict()
+
+            next_paths = []
+            for remainder, handler in remainders:
+                # Register handler and it's remaining paths
+                handler_remainders = handlers.get(handler)
+                if handler_remainders is None:
+                    handler_remainders = handlers[handler] = set()
+                if remainder:
+                    handler_remainders.add(remainder)
+                    next_paths.append((remainder, handler))
+
+                # Also add them to the reverse table, easing disconnecting
+                keys = reverse.get(handler)
+                if keys is None:
+                    reverse[handler] = set([key])
+                else:
+                    keys.add(key)
+
+            # Apply remaining paths
+            if next_paths:
+                if property.upper > 1:
+                    for e in property._get(element):
+                        self._add_paths(e, next_paths)
+                else:
+                    e = property._get(element)
+                    if e:
+                        self._add_paths(e, next_paths)
 
 
     def _remove_handlers(self, element, property, handler):
@@ -246,15 +316,33 @@ class ElementDispatcher(object):
             del self._handlers[key]
 
 
-    def register_handler(self, handler, element, path):
+    def register_handler(self, handler, element, path, deferred=False):
         
         #self.logger.info('Registering handler')
         #self.logger.debug('Handler is %s' % handler)
         #self.logger.debug('Element is %s' % element)
         #self.logger.debug('Path is %s' % path)
         
-        props = self._path_to_properties(element, path)
-        self._add_handlers(element, props, handler)
+        self.register_handlers(element, ((path, handler),), deferred)
+
+
+    def register_handlers(self, element, paths, deferred=False):
+        """
+        Register handlers for a number of paths starting at ``element`` at
+        once. ``paths`` is an iterable of (path, handler) tuples.
+        """
+        compiled = []
+        for path, handler in paths:
+            if deferred:
+                self._deferred.add(handler)
+            props = self._path_to_properties(element, path)
+            roots = self._roots.get(handler)
+            if roots is None:
+                roots = self._roots[handler] = set()
+            roots.add((element, props))
+            compiled.append((props, handler))
+        if compiled:
+            self._add_paths(element, compiled)
 
 
     def unregister_handler(self, handler):
@@ -265,8 +353,10 @@ class ElementDispatcher(object):
         #self.logger.info('Unregistering handler')
         #self.logger.debug('Handler is %s' % handler)
         
+        self._roots.pop(handler, None)
+        self._deferred.discard(handler)
         try:
-            reverse = reversed(self._reverse[handler])
+            reverse = self._reverse[handler]
         except KeyError:
             return
 
@@ -300,7 +390,11 @@ class ElementDispatcher(object):
             #    log.debug('    old value: %s' % (event.old_value))
             #if hasattr(event, 'new_value'):
             #    log.debug('    new value: %s' % (event.new_value))
+            deferred = self._deferred
             for handler in handlers.iterkeys():
+                if handler in deferred:
+                    self._defer(handler, event)
+                    continue
                 try:
                     handler(event)
                 except Exception, e:
@@ -309,34 +403,131 @@ class ElementDispatcher(object):
             # Handle add/removal of handlers based on the kind of event
             # Filter out handlers that have no remaining properties
             if IAssociationSetEvent.providedBy(event):
-                for handler, remainders in handlers.iteritems():
-                    if remainders and event.old_value:
-                        for remainder in remainders:
-                            self._remove_handlers(event.old_value, remainder[0], handler)
-                    if remainders and event.new_value:
-                        for remainder in remainders:
-                            self._add_handlers(event.new_value, remainder, handler)
+                paths = self._remainders(handlers)
+                if paths and event.old_value:
+                    for remainder, handler in paths:
+                        self._remove_handlers(event.old_value, remainder[0], handler)
+                if paths and event.new_value:
+                    self._add_paths(event.new_value, paths)
             elif IAssociationAddEvent.providedBy(event):
-                for handler, remainders in handlers.iteritems():
-                    for remainder in remainders:
-                        self._add_handlers(event.new_value, remainder, handler)
+                paths = self._remainders(handlers)
+                if paths:
+                    self._add_paths(event.new_value, paths)
             elif IAssociationDeleteEvent.providedBy(event):
-                for handler, remainders in handlers.iteritems():
-                    for remainder in remainders:
-                        self._remove_handlers(event.old_value, remainder[0], handler)
+                for remainder, handler in self._remainders(handlers):
+                    self._remove_handlers(event.old_value, remainder[0], handler)
+            elif IAssociationExtendEvent.providedBy(event):
+                paths = self._remainders(handlers)
+                if paths:
+                    for value in event.new_values:
+                        self._add_paths(value, paths)
+
+
+    def _defer(self, handler, event):
+        """
+        Queue an invocation of a deferred handler. Only the last event per
+        (handler, element) is kept.
+        """
+        if not Transaction._stack:
+            if not gobject or not gobject.main_depth():
+                try:
+                    handler(event)
+                except Exception, e:
+                    self.logger.error('Problem executing handler %s' % handler, e)
+                return
+            if not self._idle_id:
+                self._idle_id = gobject.idle_add(self._flush_idle,
+                                                 priority=gobject.PRIORITY_HIGH_IDLE)
+        key = (handler, event.element)
+        if key not in self._queued:
+            self._queue.append(key)
+        self._queued[key] = event
+
+
+    def _flush_idle(self):
+        self._idle_id = 0
+        self.flush()
+        return False
+
+
+    @component.adapter(TransactionCommit)
+    def flush(self, event=None):
+        """
+        Deliver the queued invocations of deferred handlers.
+        """
+        if self._idle_id:
+            gobject.source_remove(self._idle_id)
+            self._idle_id = 0
+        while self._queue:
+            queue, self._queue = self._queue, []
+            queued, self._queued = self._queued, dict()
+            for key in queue:
+                handler = key[0]
+                # The handler may have been unregistered in the mean time
+                if handler not in self._deferred:
+                    continue
+                try:
+                    handler(queued[key])
+                except Exception, e:
+                    self.logger.error('Problem executing handler %s' % handler, e)
+
+
+    @component.adapter(TransactionRollback)
+    def flush_on_rollback(self, event):
+        self.flush()
+
+
+    def _remainders(self, handlers):
+        """
+        Return the remaining paths of ``handlers`` (a value from the handler
+        table) as a list of (props, handler) tuples.
+        """
+        return [ (remainder, handler)
+                 for handler, remainders in handlers.iteritems()
+                 for remainder in remainders ]
+
+
+    def _update_paths(self, include=None):
+        """
+        Walk the registered paths again, to register the handlers on the
+        elements that have been added without change events. If
+        ``include`` is given, only the paths that start at one of those
+        elements are walked. Paths registered on the same element are
+        walked together.
+        """
+        by_element = {}
+        for handler, roots in self._roots.iteritems():
+            for element, props in roots:
+                if include is not None and element not in include:
+                    continue
+                try:
+                    by_element[element].append((props, handler))
+                except KeyError:
+                    by_element[element] = [(props, handler)]
+        for element, paths in by_element.iteritems():
+            self._add_paths(element, paths)
 
 
     @component.adapter(IModelFactoryEvent)
     def on_model_loaded(self, event):
+        """
+        Update the handler tables for the registered paths in one pass, now
+        the model is complete.
+        """
         
         #self.logger.info('Handling IModelFactoryEvent')
         #self.logger.debug('Event is %s' % event)
         
-        for key, value in self._handlers.items():
-            for h, remainders in value.items():
-                for remainder in remainders:
-                    self._add_handlers(key[0], (key[1],) + remainder, h)
-#        for h in self._reverse.iterkeys():
-#            h(None)
+        self._update_paths()
+
+
+    @component.adapter(IDiagramLoadedEvent)
+    def on_diagram_loaded(self, event):
+        """
+        The canvas items of a diagram have been created on demand, while
+        change events were blocked. Update the handler tables for the paths
+        registered on those items.
+        """
+        self._update_paths(set(event.element.canvas.get_all_items()))
 
 # vim:sw=4:et:ai
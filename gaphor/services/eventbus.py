@@ -0,0 +1,232 @@
+"""
+The event bus delivers model events to the handlers interested in them.
+"""
+
+from zope import interface, component
+from zope.interface.interfaces import IInterface
+
+from logging import getLogger
+from gaphor.core import inject
+from gaphor.interfaces import IService
+from gaphor.event import TransactionCommit, TransactionRollback
+from gaphor.transaction import Transaction
+from gaphor.UML.interfaces import IElementEvent
+from gaphor.UML.event import ElementChangeSummary
+
+
+class EventBus(object):
+    """
+    The event bus dispatches model events (``IElementEvent``, that includes
+    all ``IElementChangeEvent`` subtypes) to handlers that subscribed to a
+    specific kind of event, optionally for a specific property and/or
+    element only::
+
+      event_bus.subscribe(self._on_name_change, UML.event.AttributeChangeEvent,
+                          property=UML.NamedElement.name, element=self.diagram)
+
+    The event kind can be an event class or an interface. Handlers are called
+    with the event as single argument.
+
+    Events still go through the component registry, so zope.component
+    handlers (e.g. from plugins) keep working. The bus is one of those
+    handlers. Instead of every interested object checking every event, the
+    bus finds the handlers with a few dictionary lookups: the event kinds an
+    event class matches are computed once per event class and the handlers
+    of an event kind are stored by (property, element).
+
+    Presentation side handlers can subscribe with ``coalesce=True``. While a
+    transaction is active, the events for such handlers are collected. When
+    the transaction ends, the handler is called once for every changed
+    element, with an ``ElementChangeSummary`` of the events for that
+    element. Outside a transaction a summary is delivered for every event.
+    Other handlers (e.g. the model itself and the undo manager) always
+    receive the events as they happen.
+    """
+
+    interface.implements(IService)
+    logger = getLogger('EventBus')
+
+    component_registry = inject('component_registry')
+
+    def __init__(self):
+        # Subscriptions:
+        # event kind: { (property, element): [handler, ..], ..}
+        self._subscriptions = dict()
+
+        # Dispatch table:
+        # event class: [ { (property, element): [handler, ..] }, ..]
+        self._dispatch = dict()
+
+        # Number of coalescing subscriptions per handler
+        self._coalescing = dict()
+
+        # Events collected for coalescing handlers during a transaction:
+        # handler: ([element, ..], { element: [event, ..] })
+        self._pending = dict()
+        self._pending_handlers = []
+
+
+    def init(self, app):
+        self.component_registry.register_handler(self.handle)
+        self.component_registry.register_handler(self.flush)
+        self.component_registry.register_handler(self.flush_on_rollback)
+
+
+    def shutdown(self):
+        self.component_registry.unregister_handler(self.flush_on_rollback)
+        self.component_registry.unregister_handler(self.flush)
+        self.component_registry.unregister_handler(self.handle)
+        self._subscriptions.clear()
+        self._dispatch.clear()
+        self._coalescing.clear()
+        self._pending.clear()
+        del self._pending_handlers[:]
+
+
+    def subscribe(self, handler, kind, property=None, element=None,
+                  coalesce=False):
+        """
+        Subscribe ``handler`` to events of ``kind`` (an event class or
+        interface). If ``property`` and/or ``element`` are provided, only
+        events for that property and/or element are delivered. If
+        ``coalesce`` is set, the handler receives an ``ElementChangeSummary``
+        per element when the current transaction ends.
+        """
+        try:
+            handlers = self._subscriptions[kind]
+        except KeyError:
+            handlers = self._subscriptions[kind] = dict()
+            # New kind of events, dispatch tables have to be recomputed
+            self._dispatch.clear()
+        handlers.setdefault((property, element), []).append((handler, coalesce))
+        if coalesce:
+            self._coalescing[handler] = self._coalescing.get(handler, 0) + 1
+
+
+    def unsubscribe(self, handler, kind, property=None, element=None,
+                    coalesce=False):
+        """
+        Remove a subscription made by subscribe(). The same arguments should
+        be provided.
+        """
+        handlers = self._subscriptions.get(kind)
+        if handlers is None:
+            return
+        key = (property, element)
+        try:
+            handlers[key].remove((handler, coalesce))
+        except (KeyError, ValueError):
+            self.logger.warning('Handler %s is not subscribed to %s for %s' % \
+                                (handler, kind, key))
+            return
+        if not handlers[key]:
+            del handlers[key]
+        if coalesce:
+            self._coalescing[handler] -= 1
+            if not self._coalescing[handler]:
+                # Pending events are not delivered any more
+                del self._coalescing[handler]
+                if self._pending.pop(handler, None):
+                    self._pending_handlers.remove(handler)
+
+
+    def _tables(self, event_class):
+        """
+        Return the subscriptions of all event kinds that match
+        ``event_class``.
+        """
+        try:
+            return self._dispatch[event_class]
+        except KeyError:
+            tables = []
+            for kind, handlers in self._subscriptions.iteritems():
+                if IInterface.providedBy(kind):
+                    matches = kind.implementedBy(event_class)
+                else:
+                    matches = issubclass(event_class, kind)
+                if matches:
+                    tables.append(handlers)
+            self._dispatch[event_class] = tables
+            return tables
+
+
+    @component.adapter(IElementEvent)
+    def handle(self, event):
+        """
+        Deliver an event to the subscribed handlers.
+        """
+        element = event.element
+        property = getattr(event, 'property', None)
+        if property is None:
+            keys = ((None, element), (None, None))
+        else:
+            keys = ((property, element), (property, None),
+                    (None, element), (None, None))
+
+        # Collect handlers first: handlers may (un)subscribe
+        handlers = []
+        for table in self._tables(type(event)):
+            if table:
+                for key in keys:
+                    h = table.get(key)
+                    if h:
+                        handlers.extend(h)
+
+        for handler, coalesce in handlers:
+            if not coalesce:
+                handler(event)
+            elif Transaction._stack:
+                self._collect(handler, event)
+            else:
+                handler(ElementChangeSummary(element, [event]))
+
+
+    def _collect(self, handler, event):
+        """
+        Hold on to ``event`` for a coalescing handler until the transaction
+        ends.
+        """
+        try:
+            elements, events = self._pending[handler]
+        except KeyError:
+            elements, events = self._pending[handler] = ([], {})
+            self._pending_handlers.append(handler)
+        element = event.element
+        try:
+            element_events = events[element]
+        except KeyError:
+            elements.append(element)
+            events[element] = [event]
+        else:
+            # An event can match more than one subscription of a handler
+            if element_events[-1] is not event:
+                element_events.append(event)
+
+
+    @component.adapter(TransactionCommit)
+    def flush(self, event=None):
+        """
+        Deliver the events collected during the transaction to the
+        coalescing handlers, one summary per handler and element.
+        """
+        while self._pending_handlers:
+            # Handlers may cause new changes, that are collected anew
+            pending, self._pending = self._pending, dict()
+            handlers, self._pending_handlers = self._pending_handlers, []
+            for handler in handlers:
+                elements, events = pending[handler]
+                for element in elements:
+                    if handler not in self._coalescing:
+                        break
+                    handler(ElementChangeSummary(element, events[element]))
+
+
+    @component.adapter(TransactionRollback)
+    def flush_on_rollback(self, event):
+        """
+        The model has been changed, also if the transaction is rolled back.
+        """
+        self.flush()
+
+
+# vim:sw=4:et:ai
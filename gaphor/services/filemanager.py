@@ -4,13 +4,16 @@ The file service is responsible for loading and saving the user data.
 
 from logging import getLogger
 
+import os.path
 import gtk
 from zope import interface, component
+from gaphas import state
 
 from gaphor.interfaces import IService, IActionProvider, IServiceEvent
 from gaphor.core import _, inject, action, build_action_group
-from gaphor.storage import storage, verify
+from gaphor.storage import storage, verify, snapshot
 from gaphor import UML
+from gaphor.UML.interfaces import IDiagramLoadedEvent
 from gaphor.misc.gidlethread import GIdleThread, Queue, QueueEmpty
 from gaphor.misc.errorhandler import error_handler
 from gaphor.misc.xmlwriter import XMLWriter
@@ -19,8 +22,14 @@ from gaphor.ui.questiondialog import QuestionDialog
 from gaphor.ui.filedialog import FileDialog
 
 DEFAULT_EXT = '.gaphor'
+SNAPSHOT_EXT = snapshot.EXTENSION
 MAX_RECENT = 10
 
+# Snapshots are compacted (saved completely) when the journal gets bigger
+# than this part of the model, or has more than MAX_JOURNAL_ENTRIES entries
+JOURNAL_RATIO = 0.5
+MAX_JOURNAL_ENTRIES = 50
+
 class FileManagerStateChanged(object):
     """
     Event class used to send state changes on the ndo Manager.
@@ -43,6 +52,7 @@ class FileManager(object):
     element_factory = inject('element_factory')
     main_window = inject('main_window')
     properties = inject('properties')
+    undo_manager = inject('undo_manager')
     logger = getLogger('FileManager')
 
     menu_xml = """
@@ -87,6 +97,8 @@ class FileManager(object):
         """File manager constructor.  There is no current filename yet."""
 
         self._filename = None
+        self._canvas_digests = {}
+        self._changed_canvases = set()
 
     def init(self, app):
         """File manager service initialization.  The app parameter
@@ -109,10 +121,16 @@ class FileManager(object):
             
         self.update_recent_files()
 
+        self.component_registry.register_handler(self._diagram_loaded)
+        state.observers.add(self._canvas_state_changed)
+
     def shutdown(self):
         """Called when shutting down the file manager service."""
 
         self.logger.info('Shutting down')
+
+        self.component_registry.unregister_handler(self._diagram_loaded)
+        state.observers.discard(self._canvas_state_changed)
         
     def get_filename(self):
         """Return the current file name.  This method is used by the filename
@@ -156,6 +174,18 @@ class FileManager(object):
         
     recent_files = property(get_recent_files, set_recent_files)
 
+    def get_persistent_undo(self):
+        """Returns True if the undo history should be saved with the model,
+        so it is available when the model is opened again.  This is the
+        persistent-undo property of the properties service."""
+
+        try:
+            return self.properties.get('persistent-undo', False)
+        except component.interfaces.ComponentLookupError:
+            return False
+
+    persistent_undo = property(get_persistent_undo)
+
     def update_recent_files(self, new_filename=None):
         """Updates the list of recent files.  If the new_filename
         parameter is supplied, it is added to the list of recent files.
@@ -220,7 +250,7 @@ class FileManager(object):
             status_window = None
 
         try:
-            loader = storage.load_generator(filename.encode('utf-8'), self.element_factory)
+            loader = storage.load_generator(filename.encode('utf-8'), self.element_factory, lazy=True)
             worker = GIdleThread(loader, queue)
 
             worker.start()
@@ -230,6 +260,7 @@ class FileManager(object):
                 worker.reraise()
 
             self.filename = filename
+            self._reset_canvas_digests()
         except:
             error_handler(message=_('Error while loading model from file %s') % filename)
             raise
@@ -237,6 +268,9 @@ class FileManager(object):
             if status_window is not None:
                 status_window.destroy()
 
+        # The model is loaded, problems with the journal are no load errors
+        self.undo_manager.open_journal(filename, self.persistent_undo)
+
         
     def verify_orphans(self):
         """Verify that no orphaned elements are saved.  This method checks
@@ -265,22 +299,100 @@ class FileManager(object):
     def verify_filename(self, filename):
         """Verify that the supplied filename is using the proper default
         extension.  If not, the extension is added to the filename
-        and returned."""
+        and returned.  Files with the snapshot extension are left as is."""
         
         self.logger.debug('Verifying file name')
         self.logger.debug('File name is %s' % filename)
         
-        if not filename.endswith(DEFAULT_EXT):
+        if not filename.endswith((DEFAULT_EXT, SNAPSHOT_EXT)):
             filename = filename + DEFAULT_EXT
             
         return filename
 
+    def journal_changes(self, filename):
+        """Return the changed elements and the ids of deleted elements, if
+        the changes can be appended as journal to the model file.  None is
+        returned if the model should be saved completely: the file is not
+        the snapshot the model was loaded from or last saved to, its last
+        journal entry is incomplete (e.g. after a crash while saving), or
+        the journal became too big.
+
+        Changes to diagram items are not always visible as model changes
+        (e.g. moving an item).  Diagrams whose canvas changed are therefore
+        compared to the digest of their last saved version."""
+
+        if filename != self.filename or not filename.endswith(SNAPSHOT_EXT) \
+                or not os.path.exists(filename):
+            return None
+
+        sizes = snapshot.segment_sizes(filename)
+        if not sizes or len(sizes) > MAX_JOURNAL_ENTRIES \
+                or sum(sizes[1:]) > sizes[0] * JOURNAL_RATIO:
+            return None
+
+        element_factory = self.element_factory
+        elements = element_factory.changed_elements()
+        changed = set(elements)
+        digests = self._canvas_digests
+        for id in list(self._changed_canvases):
+            diagram = element_factory.lookup(id)
+            if diagram is not None and diagram.canvas_loaded:
+                digest = storage.canvas_digest(diagram)
+                if digest != digests.get(id) and diagram not in changed:
+                    elements.append(diagram)
+                digests[id] = digest
+            self._changed_canvases.discard(id)
+        return elements, element_factory.deleted_elements()
+
+    def _reset_canvas_digests(self):
+        """Forget the canvas digests and changes, after the model is loaded
+        or created.  Canvases that are filled later on get their digest
+        when they are loaded (see _diagram_loaded())."""
+
+        self._canvas_digests = {}
+        self._changed_canvases.clear()
+
+    def _update_canvas_digests(self):
+        """Record the digests of all diagrams, after the model is saved
+        completely."""
+
+        for diagram in self.element_factory.select_type(UML.Diagram):
+            if diagram.canvas_loaded:
+                self._canvas_digests[diagram.id] = storage.canvas_digest(diagram)
+
+    @component.adapter(IDiagramLoadedEvent)
+    def _diagram_loaded(self, event):
+        """The canvas of a lazily loaded diagram is filled: its content is
+        what has been saved."""
+
+        diagram = event.element
+        self._canvas_digests[diagram.id] = storage.canvas_digest(diagram)
+        self._changed_canvases.discard(diagram.id)
+
+    def _canvas_state_changed(self, event):
+        """Gaphas state observer, remembers the diagrams whose canvas or
+        canvas items have changed.  Only those diagrams are compared to
+        their digest when the model is saved (see journal_changes())."""
+
+        func, args, kwargs = event
+        if not args:
+            return
+        canvas = getattr(args[0], 'canvas', args[0])
+        diagram = getattr(canvas, 'diagram', None)
+        if diagram is not None:
+            self._changed_canvases.add(diagram.id)
+
     def save(self, filename):
         """Save the current UML model to the specified file name.  Before
         writing the model file, this will verify that there are no orphan
         references.  It will also verify that the filename has the correct
         extension.  A status window is displayed while the GIdleThread
-        is executed.  This thread actually saves the model."""
+        is executed.  This thread actually saves the model.
+
+        If the filename has the snapshot extension, the model is saved as
+        binary snapshot instead of XML.  Loading detects the format by
+        itself.  When a snapshot is saved again, only the changes are
+        appended to the file (see journal_changes())."""
         
         self.logger.info('Saving file')
         self.logger.debug('File name is %s' % filename)
@@ -298,8 +410,26 @@ class FileManager(object):
                                      parent=main_window.window,\
                                      queue=queue)
         try:
-            with open(filename.encode('utf-8'), 'w') as out:
-                saver = storage.save_generator(XMLWriter(out), self.element_factory)
+            changes = self.journal_changes(filename)
+            if changes and not changes[0] and not changes[1]:
+                self.logger.info('No changes to save')
+                return
+            elif changes:
+                mode = 'ab'
+            elif filename.endswith(SNAPSHOT_EXT):
+                mode = 'wb'
+            else:
+                mode = 'w'
+            with open(filename.encode('utf-8'), mode) as out:
+                if changes:
+                    self.logger.info('Appending %d changes to file' % len(changes[0]))
+                    writer = snapshot.SnapshotWriter(out, journal=True)
+                    saver = storage.save_generator(writer, self.element_factory, *changes)
+                elif filename.endswith(SNAPSHOT_EXT):
+                    writer = snapshot.SnapshotWriter(out)
+                    saver = storage.save_generator(writer, self.element_factory)
+                else:
+                    saver = storage.save_generator(XMLWriter(out), self.element_factory)
                 worker = GIdleThread(saver, queue)
                 worker.start()
                 worker.wait()
@@ -307,14 +437,26 @@ class FileManager(object):
             if worker.error:
                 worker.reraise()
                 
-            
+            if not changes:
+                self._reset_canvas_digests()
+                if filename.endswith(SNAPSHOT_EXT):
+                    self._update_canvas_digests()
+            self.element_factory.clear_changes()
             self.filename = filename
         except:
+            # Make sure all diagrams are checked on the next save
+            self._canvas_digests = {}
+            self._changed_canvases.update(d.id for d in
+                    self.element_factory.select_type(UML.Diagram)
+                    if d.canvas_loaded)
             error_handler(message=_('Error while saving model to file %s') % filename)
             raise
         finally:
             status_window.destroy()
 
+        # The model is saved, problems with the journal are no save errors
+        self.undo_manager.save_journal(filename, self.persistent_undo)
+
     def _open_dialog(self, title):
         """Open a file chooser dialog to select a model
         file to open."""
@@ -375,6 +517,7 @@ class FileManager(object):
         diagram.package = model
         diagram.name= _('main')
         self.filename = None
+        self._reset_canvas_digests()
         element_factory.notify_model()
 
         #main_window.select_element(diagram)
@@ -401,6 +544,7 @@ class FileManager(object):
         if filename:
             self.load(filename)
             self.filename = None
+            self.undo_manager.close_journal()
             self.component_registry.handle(FileManagerStateChanged(self))
 
 
@@ -409,6 +553,7 @@ class FileManager(object):
         """This menu action opens the standard model open dialog."""
 
         filters = [{'name':_('Gaphor Models'), 'pattern':'*.gaphor'},\
+                   {'name':_('Gaphor Snapshots'), 'pattern':'*' + SNAPSHOT_EXT},\
                    {'name':_('All Files'), 'pattern':'*'}]
 
         file_dialog = FileDialog(_('Open Gaphor Model'),\
@@ -4,7 +4,6 @@ the model clean and in sync with diagrams.
 """
 
 from zope import interface
-from zope import component
 
 from logging import getLogger
 from gaphor import UML
@@ -22,7 +21,7 @@ class SanitizerService(object):
 
     logger = getLogger('Sanitizer')
 
-    component_registry = inject('component_registry')
+    event_bus = inject('event_bus')
     element_factory = inject('element_factory')
     property_dispatcher = inject('property_dispatcher')
 
@@ -30,19 +29,24 @@ class SanitizerService(object):
         pass
 
     def init(self, app=None):
-        self.component_registry.register_handler(self._unlink_on_presentation_delete)
-        self.component_registry.register_handler(self._unlink_on_stereotype_delete)
-        self.component_registry.register_handler(self._unlink_on_extension_delete)
-        self.component_registry.register_handler(self._disconnect_extension_end)
+        for subscription in self._subscriptions():
+            self.event_bus.subscribe(*subscription)
 
     def shutdown(self):
-        self.component_registry.unregister_handler(self._unlink_on_presentation_delete)
-        self.component_registry.unregister_handler(self._unlink_on_stereotype_delete)
-        self.component_registry.unregister_handler(self._unlink_on_extension_delete)
-        self.component_registry.unregister_handler(self._disconnect_extension_end)
-        
+        for subscription in self._subscriptions():
+            self.event_bus.unsubscribe(*subscription)
+
+    def _subscriptions(self):
+        """
+        The (handler, event kind, property) subscriptions on the event bus.
+        """
+        return (
+            (self._unlink_on_presentation_delete, IAssociationDeleteEvent, UML.Element.presentation),
+            (self._unlink_on_stereotype_delete, IAssociationDeleteEvent, UML.InstanceSpecification.classifier),
+            (self._unlink_on_extension_delete, IAssociationDeleteEvent, UML.Association.memberEnd),
+            (self._disconnect_extension_end, IAssociationSetEvent, UML.ExtensionEnd.type))
+
 
-    @component.adapter(IAssociationDeleteEvent)
     def _unlink_on_presentation_delete(self, event):
         """
         Unlink the model element if no more presentations link to the `item`'s
@@ -73,7 +77,6 @@ class SanitizerService(object):
                     i.unlink()
 
 
-    @component.adapter(IAssociationDeleteEvent)
     def _unlink_on_extension_delete(self, event):
         """
         Remove applied stereotypes when extension is deleted.
@@ -96,7 +99,6 @@ class SanitizerService(object):
             self.perform_unlink_for_instances(st, meta)
 
 
-    @component.adapter(IAssociationSetEvent)
     def _disconnect_extension_end(self, event):
         
         self.logger.debug('Handling IAssociationSetEvent')
@@ -114,7 +116,6 @@ class SanitizerService(object):
             self.perform_unlink_for_instances(st, meta)
 
 
-    @component.adapter(IAssociationDeleteEvent)
     def _unlink_on_stereotype_delete(self, event):
         """
         Remove applied stereotypes when stereotype is deleted.
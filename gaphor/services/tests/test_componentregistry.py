@@ -0,0 +1,98 @@
+"""
+Test event dispatching of the ZopeComponentRegistry.
+"""
+
+import unittest
+from zope import interface, component
+from gaphor.interfaces import IEventFilter
+from gaphor.services.componentregistry import ZopeComponentRegistry
+
+
+class IFooEvent(interface.Interface):
+    pass
+
+
+class FooEvent(object):
+    interface.implements(IFooEvent)
+
+
+class BarEvent(object):
+    pass
+
+
+class FooEventBlocker(object):
+    component.adapts(IFooEvent)
+    interface.implements(IEventFilter)
+
+    def __init__(self, event):
+        self.event = event
+
+    def filter(self):
+        return 'blocked'
+
+
+class ComponentRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ZopeComponentRegistry()
+        self.registry.init(None)
+        self.events = []
+
+    def tearDown(self):
+        self.registry.shutdown()
+
+    def handler(self, event):
+        self.events.append(event)
+
+    def test_handle(self):
+        self.registry.register_handler(self.handler, adapts=(IFooEvent,))
+        foo, bar = FooEvent(), BarEvent()
+        self.registry.handle(foo)
+        self.registry.handle(bar)
+        self.registry.handle(foo, foo)
+        self.assertEquals([foo, foo, foo], self.events)
+
+    def test_handler_cache_invalidation(self):
+        foo = FooEvent()
+        self.registry.handle(foo)
+        self.registry.register_handler(self.handler, adapts=(IFooEvent,))
+        self.registry.handle(foo)
+        self.assertEquals([foo], self.events)
+
+        self.registry.unregister_handler(self.handler, required=(IFooEvent,))
+        self.registry.handle(foo)
+        self.assertEquals([foo], self.events)
+
+    def test_global_registrations(self):
+        """
+        Handlers registered in the global site manager are found, also
+        after events have been dispatched.
+        """
+        foo = FooEvent()
+        self.registry.handle(foo)
+        component.provideHandler(self.handler, adapts=(IFooEvent,))
+        try:
+            self.registry.handle(foo)
+        finally:
+            component.getGlobalSiteManager().unregisterHandler(self.handler,
+                    required=(IFooEvent,))
+        self.registry.handle(foo)
+        self.assertEquals([foo], self.events)
+
+    def test_filter(self):
+        self.registry.register_handler(self.handler, adapts=(IFooEvent,))
+        self.registry.register_handler(self.handler, adapts=(BarEvent,))
+        foo, bar = FooEvent(), BarEvent()
+        self.registry.register_subscription_adapter(FooEventBlocker)
+        try:
+            self.registry.handle(foo)
+            self.registry.handle(bar)
+        finally:
+            self.registry.unregister_subscription_adapter(FooEventBlocker)
+        self.assertEquals([bar], self.events)
+
+        self.registry.handle(foo)
+        self.assertEquals([bar, foo], self.events)
+
+
+# vim:sw=4:et:ai
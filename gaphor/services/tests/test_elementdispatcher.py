@@ -3,6 +3,7 @@ from gaphor.tests import TestCase
 from gaphor import UML
 from gaphor.application import Application
 from gaphor.services.elementdispatcher import ElementDispatcher
+from gaphor.transaction import Transaction
 
 
 class ElementDispatcherTestCase(TestCase):
@@ -190,6 +191,105 @@ class ElementDispatcherTestCase(TestCase):
         assert len(self.events) == 2, self.events
 
 
+    def test_register_handlers(self):
+        """
+        Register several paths at once, sharing the first property.
+        """
+        dispatcher = self.dispatcher
+        element = UML.Class()
+        o = element.ownedOperation = UML.Operation()
+        dispatcher.register_handlers(element, (
+                ('ownedOperation.name', self._handler),
+                ('ownedOperation.isAbstract', self._handler)))
+        self.assertEquals(3, len(dispatcher._handlers))
+        self.assertEquals(set([('name',), ('isAbstract',)]),
+                set(tuple(p.name for p in r) for r in
+                    dispatcher._handlers[element, UML.Class.ownedOperation][self._handler]))
+
+        o.name = 'func'
+        o.isAbstract = True
+        self.assertEquals(2, len(self.events))
+
+        dispatcher.unregister_handler(self._handler)
+        self.assertEquals(0, len(dispatcher._handlers))
+
+
+    def test_extend(self):
+        """
+        Paths through the opposite end of values added with extend() are
+        followed.
+        """
+        dispatcher = self.dispatcher
+        klass = UML.Class()
+        attrs = [ UML.Property(), UML.Property() ]
+        dispatcher.register_handler(self._handler, attrs[0], 'namespace.name')
+        klass.ownedAttribute.extend(attrs)
+        self.assertEquals(1, len(self.events))
+
+        klass.name = 'Foo'
+        self.assertEquals(2, len(self.events))
+
+
+    def test_model_loaded(self):
+        """
+        Paths are resolved again once the model is loaded (no events are
+        sent while loading).
+        """
+        dispatcher = self.dispatcher
+        element = UML.Class()
+        dispatcher.register_handler(self._handler, element, 'ownedOperation.name')
+        self.assertEquals(1, len(dispatcher._handlers))
+
+        dispatcher.shutdown()
+        o = element.ownedOperation = UML.Operation()
+        dispatcher.init(Application)
+        self.assertEquals(1, len(dispatcher._handlers))
+
+        dispatcher.on_model_loaded(None)
+        self.assertEquals(2, len(dispatcher._handlers))
+        o.name = 'func'
+        self.assertEquals(1, len(self.events))
+
+
+    def test_deferred_handler(self):
+        """
+        Deferred handlers are called once per element when the transaction
+        is committed.
+        """
+        dispatcher = self.dispatcher
+        element = UML.Class()
+        o1 = element.ownedOperation = UML.Operation()
+        o2 = element.ownedOperation = UML.Operation()
+        dispatcher.register_handler(self._handler, element,
+                                    'ownedOperation.name', deferred=True)
+
+        tx = Transaction()
+        o1.name = 'a'
+        o1.name = 'b'
+        o2.name = 'c'
+        self.assertEquals(0, len(self.events))
+        tx.commit()
+        self.assertEquals(2, len(self.events))
+        self.assertEquals('b', self.events[0].new_value)
+        self.assertEquals('c', self.events[1].new_value)
+
+        # Outside a transaction (and main loop) the handler is called directly
+        o1.name = 'd'
+        self.assertEquals(3, len(self.events))
+
+
+    def test_deferred_handler_unregistered(self):
+        dispatcher = self.dispatcher
+        element = UML.Class()
+        dispatcher.register_handler(self._handler, element, 'name',
+                                    deferred=True)
+        tx = Transaction()
+        element.name = 'a'
+        dispatcher.unregister_handler(self._handler)
+        tx.commit()
+        self.assertEquals(0, len(self.events))
+
+
 
 from gaphor.UML import Element
 from gaphor.UML.properties import association
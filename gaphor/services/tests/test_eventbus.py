@@ -0,0 +1,149 @@
+"""
+Test the EventBus.
+"""
+
+import unittest
+from gaphor import UML
+from gaphor.UML.event import AttributeChangeEvent, AssociationSetEvent, \
+                             DerivedSetEvent, ElementDeleteEvent
+from gaphor.UML.interfaces import IAttributeChangeEvent, \
+                                  IAssociationChangeEvent, IElementDeleteEvent
+from gaphor.services.eventbus import EventBus
+from gaphor.transaction import Transaction
+
+
+class EventBusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = EventBus()
+        self.events = []
+        self.summaries = []
+
+    def _handler(self, event):
+        self.events.append(event)
+
+    def _summary(self, summary):
+        self.summaries.append(summary)
+
+    def test_subscribe_by_class(self):
+        bus = self.bus
+        c = UML.Class()
+        bus.subscribe(self._handler, AssociationSetEvent)
+        e1 = AssociationSetEvent(c, UML.Class.package, None, None)
+        e2 = DerivedSetEvent(c, UML.NamedElement.namespace, None, None)
+        e3 = AttributeChangeEvent(c, UML.Class.name, None, 'a')
+        map(bus.handle, (e1, e2, e3))
+        self.assertEquals([e1], self.events)
+
+    def test_subscribe_by_interface(self):
+        bus = self.bus
+        c = UML.Class()
+        bus.subscribe(self._handler, IAssociationChangeEvent)
+        e1 = AssociationSetEvent(c, UML.Class.package, None, None)
+        e2 = DerivedSetEvent(c, UML.NamedElement.namespace, None, None)
+        e3 = AttributeChangeEvent(c, UML.Class.name, None, 'a')
+        map(bus.handle, (e1, e2, e3))
+        self.assertEquals([e1, e2], self.events)
+
+    def test_subscribe_by_property_and_element(self):
+        bus = self.bus
+        c1, c2 = UML.Class(), UML.Class()
+        bus.subscribe(self._handler, IAttributeChangeEvent,
+                      property=UML.NamedElement.name, element=c1)
+        e1 = AttributeChangeEvent(c1, UML.NamedElement.name, None, 'a')
+        e2 = AttributeChangeEvent(c2, UML.NamedElement.name, None, 'a')
+        e3 = AttributeChangeEvent(c1, UML.Classifier.isAbstract, False, True)
+        map(bus.handle, (e1, e2, e3))
+        self.assertEquals([e1], self.events)
+
+    def test_subscribe_by_element(self):
+        bus = self.bus
+        c1, c2 = UML.Class(), UML.Class()
+        bus.subscribe(self._handler, IElementDeleteEvent, element=c1)
+        e1 = ElementDeleteEvent(None, c1)
+        e2 = ElementDeleteEvent(None, c2)
+        map(bus.handle, (e1, e2))
+        self.assertEquals([e1], self.events)
+
+    def test_unsubscribe(self):
+        bus = self.bus
+        c = UML.Class()
+        bus.subscribe(self._handler, IAttributeChangeEvent,
+                      property=UML.NamedElement.name)
+        e1 = AttributeChangeEvent(c, UML.NamedElement.name, None, 'a')
+        bus.handle(e1)
+        bus.unsubscribe(self._handler, IAttributeChangeEvent,
+                        property=UML.NamedElement.name)
+        bus.handle(e1)
+        self.assertEquals([e1], self.events)
+
+    def test_new_kind_after_dispatch(self):
+        """
+        Dispatch tables are updated when a new kind of event is subscribed
+        to.
+        """
+        bus = self.bus
+        c = UML.Class()
+        e1 = AttributeChangeEvent(c, UML.NamedElement.name, None, 'a')
+        bus.handle(e1)
+        bus.subscribe(self._handler, IAttributeChangeEvent)
+        bus.handle(e1)
+        self.assertEquals([e1], self.events)
+
+    def test_coalesce(self):
+        """
+        Coalescing handlers get one summary per element when the
+        transaction ends, other handlers get all events right away.
+        """
+        bus = self.bus
+        summaries = self.summaries
+        c1, c2 = UML.Class(), UML.Class()
+        bus.subscribe(self._handler, IAttributeChangeEvent)
+        bus.subscribe(self._summary, IAttributeChangeEvent, coalesce=True)
+        e1 = AttributeChangeEvent(c1, UML.NamedElement.name, None, 'a')
+        e2 = AttributeChangeEvent(c2, UML.NamedElement.name, None, 'b')
+        e3 = AttributeChangeEvent(c1, UML.Classifier.isAbstract, False, True)
+        e4 = AttributeChangeEvent(c1, UML.NamedElement.name, 'a', 'c')
+
+        tx = Transaction()
+        try:
+            map(bus.handle, (e1, e2, e3, e4))
+            self.assertEquals([e1, e2, e3, e4], self.events)
+            self.assertEquals([], summaries)
+        finally:
+            tx.commit()
+        bus.flush()
+
+        self.assertEquals(2, len(summaries))
+        self.assertTrue(c1 is summaries[0].element)
+        self.assertEquals([e1, e3, e4], summaries[0].events)
+        self.assertEquals([UML.NamedElement.name, UML.Classifier.isAbstract],
+                          summaries[0].properties)
+        self.assertTrue(c2 is summaries[1].element)
+        self.assertEquals([e2], summaries[1].events)
+
+        # Outside a transaction summaries are delivered right away
+        bus.handle(e1)
+        self.assertEquals(3, len(summaries))
+        self.assertEquals([e1], summaries[2].events)
+
+    def test_coalesce_unsubscribe(self):
+        """
+        Collected events are dropped when a handler unsubscribes.
+        """
+        bus = self.bus
+        summaries = self.summaries
+        c = UML.Class()
+        bus.subscribe(self._summary, IAttributeChangeEvent, coalesce=True)
+        tx = Transaction()
+        try:
+            bus.handle(AttributeChangeEvent(c, UML.NamedElement.name, None, 'a'))
+            bus.unsubscribe(self._summary, IAttributeChangeEvent,
+                            coalesce=True)
+        finally:
+            tx.commit()
+        bus.flush()
+        self.assertEquals([], summaries)
+
+
+# vim:sw=4:et:ai
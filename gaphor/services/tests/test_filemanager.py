@@ -2,6 +2,9 @@
 import unittest
 from gaphor.application import Application
 from gaphor.services.filemanager import FileManager
+from gaphor import UML
+from gaphor.UML.event import DiagramLoadedEvent
+from gaphor.diagram.classes.klass import ClassItem
 
 
 class FileManagerTestCase(unittest.TestCase):
@@ -36,3 +39,22 @@ class FileManagerTestCase(unittest.TestCase):
             assert a
             assert a.get_property('visible') == False
 
+
+    def test_canvas_changes(self):
+        fileman = Application.get_service('file_manager')
+        element_factory = Application.get_service('element_factory')
+        component_registry = Application.get_service('component_registry')
+
+        diagram = element_factory.create(UML.Diagram)
+        item = diagram.create(ClassItem, subject=element_factory.create(UML.Class))
+        assert diagram.id in fileman._changed_canvases
+
+        # A loaded canvas is what has been saved
+        component_registry.handle(DiagramLoadedEvent(diagram))
+        assert diagram.id not in fileman._changed_canvases
+        assert diagram.id in fileman._canvas_digests
+
+        item.matrix.translate(10, 10)
+        item.request_update()
+        assert diagram.id in fileman._changed_canvases
+
@@ -127,6 +127,274 @@ class TestUndoManager(TestCase):
 
         undo_manager.shutdown()
 
+    def test_undo_attribute_coalesce(self):
+        """
+        Only the first change of an attribute in a transaction is recorded.
+        """
+        import types
+        from gaphor.UML.properties import attribute
+        from gaphor.UML.element import Element
+        undo_manager = UndoManager()
+        undo_manager.init(Application)
+
+        class A(Element):
+            attr = attribute('attr', types.StringType, default='default')
+
+        a = A()
+        undo_manager.begin_transaction()
+        a.attr = 'one'
+        a.attr = 'two'
+        a.attr = 'three'
+        undo_manager.commit_transaction()
+        self.assertEquals(1, len(undo_manager._undo_stack[0]._actions))
+
+        undo_manager.undo_transaction()
+        self.assertEquals('default', a.attr)
+
+        undo_manager.redo_transaction()
+        self.assertEquals('three', a.attr)
+
+        undo_manager.shutdown()
+
+    def test_budget(self):
+        """
+        Old transactions are dropped when the undo stack exceeds its budget.
+        """
+        import types
+        from gaphor.UML.properties import attribute
+        from gaphor.UML.element import Element
+        undo_manager = UndoManager(budget=1000)
+        undo_manager.init(Application)
+
+        class A(Element):
+            attr = attribute('attr', types.StringType, default='default')
+
+        a = A()
+        for i in range(100):
+            with Transaction():
+                a.attr = 'value %d' % i
+        size = sum(tx.size for tx in undo_manager._undo_stack)
+        assert 1 < len(undo_manager._undo_stack) < 100, len(undo_manager._undo_stack)
+        assert size <= 1000, size
+
+        undo_manager.undo_transaction()
+        self.assertEquals('value 98', a.attr)
+
+        # The last transaction is kept, even if it exceeds the budget
+        undo_manager.budget = 1
+        with Transaction():
+            a.attr = 'last'
+        self.assertEquals(1, len(undo_manager._undo_stack))
+
+        undo_manager.shutdown()
+
+    def test_journal(self):
+        """
+        Transactions that exceed the budget are moved to the journal and
+        read back when they are undone.
+        """
+        import os.path, shutil, tempfile
+        from gaphor import UML
+        ef = self.element_factory
+        ef.flush()
+        tmpdir = tempfile.mkdtemp()
+        undo_manager = UndoManager(budget=1000)
+        undo_manager.init(Application)
+        try:
+            undo_manager.open_journal(os.path.join(tmpdir, 'model.gaphor'))
+            with Transaction():
+                p = ef.create(UML.Package)
+                p.name = 'package'
+            with Transaction():
+                c = ef.create(UML.Class)
+            with Transaction():
+                p.unlink()
+            for i in range(100):
+                with Transaction():
+                    c.name = 'value %d' % i
+
+            assert len(undo_manager.journal) > 50, len(undo_manager.journal)
+            assert len(undo_manager._undo_stack) < 50
+
+            for i in range(100):
+                undo_manager.undo_transaction()
+            self.assertEquals(None, c.name)
+            self.assertEquals(1, ef.size())
+
+            # The package is recreated from the journal
+            undo_manager.undo_transaction()
+            p = ef.lselect(lambda e: isinstance(e, UML.Package))[0]
+            self.assertEquals('package', p.name)
+
+            undo_manager.undo_transaction()
+            undo_manager.undo_transaction()
+            assert not undo_manager.can_undo()
+            self.assertEquals(0, ef.size())
+
+            undo_manager.redo_transaction()
+            undo_manager.redo_transaction()
+            undo_manager.redo_transaction()
+            self.assertEquals(1, ef.size())
+            assert ef.lookup(c.id) is c
+        finally:
+            undo_manager.shutdown()
+            shutil.rmtree(tmpdir)
+
+    def test_journal_on_demand(self):
+        """
+        The journal file is only created when transactions are moved to it.
+        If the model directory can not be written, the journal is created
+        in the temporary directory.
+        """
+        import os.path, shutil, tempfile
+        from gaphor import UML
+        ef = self.element_factory
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'model.gaphor')
+        undo_manager = UndoManager(budget=1000)
+        undo_manager.init(Application)
+        try:
+            undo_manager.open_journal(filename, keep=True)
+            undo_manager.save_journal(filename)
+            assert not os.path.exists(filename + '.undo')
+            assert undo_manager.journal is None
+
+            # A directory that can not be written to
+            filename = os.path.join(tmpdir, 'readonly', 'model.gaphor')
+            undo_manager.open_journal(filename)
+            c = ef.create(UML.Class)
+            for i in range(100):
+                with Transaction():
+                    c.name = 'value %d' % i
+            assert undo_manager.journal
+            self.assertEquals(tempfile.gettempdir(),
+                              os.path.dirname(undo_manager.journal.filename))
+            path = undo_manager.journal.filename
+            undo_manager.close_journal()
+            assert not os.path.exists(path)
+        finally:
+            undo_manager.shutdown()
+            shutil.rmtree(tmpdir)
+
+    def test_journal_other_actions(self):
+        """
+        Transactions that can not be stored in the journal (e.g. canvas
+        changes) stay in memory, the journal is kept.
+        """
+        import os.path, shutil, tempfile
+        from gaphor import UML
+        ef = self.element_factory
+        ef.flush()
+        tmpdir = tempfile.mkdtemp()
+        undo_manager = UndoManager(budget=1000)
+        undo_manager.init(Application)
+        try:
+            undo_manager.open_journal(os.path.join(tmpdir, 'model.gaphor'))
+            with Transaction():
+                c = ef.create(UML.Class)
+            for i in range(50):
+                with Transaction():
+                    c.name = 'value %d' % i
+            journaled = len(undo_manager.journal)
+            assert journaled > 10, journaled
+
+            undone = []
+            with Transaction():
+                undo_manager.add_undo_action(lambda: undone.append(True))
+            for i in range(50, 60):
+                with Transaction():
+                    c.name = 'value %d' % i
+            # Transactions are moved to the journal up to the other action
+            assert len(undo_manager.journal) > journaled
+            assert type(undo_manager._undo_stack[0]._actions[0]) is not tuple
+
+            while undo_manager.can_undo():
+                undo_manager.undo_transaction()
+            assert undone
+            self.assertEquals(0, ef.size())
+
+            # Beyond twice the budget, old transactions are dropped after all
+            for i in range(5):
+                with Transaction():
+                    undo_manager.add_undo_action(lambda: None)
+            for i in range(200):
+                with Transaction():
+                    ef.create(UML.Class)
+            assert len(undo_manager.journal) < 200
+            assert sum(tx.size for tx in undo_manager._undo_stack) <= 1000
+            for tx in undo_manager._undo_stack:
+                assert type(tx._actions[0]) is tuple
+        finally:
+            undo_manager.shutdown()
+            shutil.rmtree(tmpdir)
+
+    def test_journal_existing_file(self):
+        """
+        A journal file next to the model (e.g. one saved with the model) is
+        not overwritten if the journal is not kept.
+        """
+        import os.path, shutil, tempfile
+        from gaphor import UML
+        ef = self.element_factory
+        ef.flush()
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'model.gaphor')
+        with open(filename + '.undo', 'w') as f:
+            f.write('saved journal')
+        undo_manager = UndoManager(budget=1000)
+        undo_manager.init(Application)
+        try:
+            undo_manager.open_journal(filename)
+            c = ef.create(UML.Class)
+            for i in range(100):
+                with Transaction():
+                    c.name = 'value %d' % i
+            assert undo_manager.journal
+            self.assertEquals(tempfile.gettempdir(),
+                              os.path.dirname(undo_manager.journal.filename))
+            undo_manager.close_journal()
+            with open(filename + '.undo') as f:
+                self.assertEquals('saved journal', f.read())
+        finally:
+            undo_manager.shutdown()
+            shutil.rmtree(tmpdir)
+
+    def test_journal_keep(self):
+        """
+        The journal is kept with the saved model and used when the model is
+        opened again.
+        """
+        import os.path, shutil, tempfile
+        from gaphor import UML
+        ef = self.element_factory
+        ef.flush()
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'model.gaphor')
+        undo_manager = UndoManager()
+        undo_manager.init(Application)
+        try:
+            with Transaction():
+                c = ef.create(UML.Class)
+            with Transaction():
+                c.name = 'name'
+
+            with open(filename, 'w') as f:
+                f.write('<saved model/>')
+            undo_manager.save_journal(filename, keep=True)
+            assert not undo_manager._undo_stack
+            self.assertEquals(2, len(undo_manager.journal))
+
+            undo_manager.reset()
+            undo_manager.open_journal(filename, keep=True)
+            self.assertEquals(2, len(undo_manager.journal))
+            undo_manager.undo_transaction()
+            self.assertEquals(None, c.name)
+            undo_manager.undo_transaction()
+            self.assertEquals(0, ef.size())
+        finally:
+            undo_manager.shutdown()
+            shutil.rmtree(tmpdir)
+
     def test_undo_association_1_x(self):
         from gaphor.UML.properties import association
         from gaphor.UML.element import Element
@@ -219,6 +487,41 @@ class TestUndoManager(TestCase):
         undo_manager.shutdown()
 
 
+    def test_undo_association_extend(self):
+        from gaphor.UML.properties import association
+        from gaphor.UML.element import Element
+        undo_manager = UndoManager()
+        undo_manager.init(Application)
+
+        class A(Element): pass
+        class B(Element): pass
+
+        A.one = association('one', B, lower=0, upper=1, opposite='two')
+        B.two = association('two', A, lower=0, upper='*', opposite='one')
+
+        b1 = B()
+        a = [ A() for i in range(3) ]
+
+        undo_manager.begin_transaction()
+        b1.two.extend(a)
+        undo_manager.commit_transaction()
+        assert a == b1.two.items
+        # One record for b1.two, one per opposite end
+        assert len(undo_manager._undo_stack[0]._actions) == 4, undo_manager._undo_stack[0]._actions
+
+        undo_manager.undo_transaction()
+        assert len(b1.two) == 0
+        for e in a:
+            assert e.one is None
+
+        undo_manager.redo_transaction()
+        assert a == b1.two.items
+        for e in a:
+            assert e.one is b1
+
+        undo_manager.shutdown()
+
+
     def test_element_factory_undo(self):
         from gaphor.UML.element import Element
         ef = self.element_factory
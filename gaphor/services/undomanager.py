@@ -9,9 +9,25 @@ An undo action should be a callable object (called with no arguments).
 An undo action should return a callable object that acts as redo function.
 If None is returned the undo action is considered to be the redo action as well.
 
+Changes to the data model are not recorded as callables, but as compact
+undo records: tuples (operation, element, property, value). They are played
+back through a table of undo functions, one per operation.
+
+Transactions that do not fit in the memory budget can be moved to an undo
+journal (gaphor.storage.undojournal) next to the model file, or in the
+temporary directory if the model directory is not writable. The journal is
+created when the first transaction is moved to it. For this the records are
+encoded: elements are referred to by id and properties by name. Errors
+while reading or writing the journal never fail an edit, load or save: the
+journal is dropped, together with the transactions in it.
+
 NOTE: it would be nice to use actions in conjunction with functools.partial.
 """
 
+import os
+import os.path
+import sys
+import tempfile
 from zope import interface, component
 
 from gaphas import state
@@ -21,10 +37,14 @@ from logging import getLogger
 from gaphor.interfaces import IService, IServiceEvent, IActionProvider
 from gaphor.event import TransactionBegin, TransactionCommit, TransactionRollback
 from gaphor.transaction import Transaction, transactional
+from gaphor.storage.undojournal import UndoJournal, fingerprint, EXTENSION
+from gaphor import UML
+from gaphor.UML.properties import attribute, enumeration
 
 from gaphor.UML.event import ElementCreateEvent, ElementDeleteEvent, \
                              ModelFactoryEvent, AssociationSetEvent, \
-                             AssociationAddEvent, AssociationDeleteEvent
+                             AssociationAddEvent, AssociationDeleteEvent, \
+                             AssociationExtendEvent
 from gaphor.UML.interfaces import IElementDeleteEvent, \
                                   IAttributeChangeEvent, IModelFactoryEvent
                                   
@@ -33,6 +53,153 @@ from gaphor.action import action, build_action_group
 from gaphor.event import ActionExecuted
 
 
+# Undo record operations
+CREATE, DELETE, ATTRIBUTE, ASSOCIATION_SET, ASSOCIATION_ADD, \
+        ASSOCIATION_DELETE, ASSOCIATION_EXTEND = range(7)
+
+
+def _undo_create(element, factory, value):
+    # Element was probably already removed in an unlink call
+    factory._remove_element(element)
+    component.handle(ElementDeleteEvent(factory, element))
+
+def _undo_delete(element, factory, value):
+    factory._add_element(element)
+    component.handle(ElementCreateEvent(factory, element))
+
+def _undo_attribute(element, attribute, value):
+    attribute._set(element, value)
+
+def _undo_association_set(element, association, value):
+    # Tell the assoctaion it should not need to let the opposite
+    # side connect (it has it's own signal)
+    association._set(element, value, from_opposite=True)
+
+def _undo_association_add(element, association, value):
+    association._del(element, value, from_opposite=True)
+
+def _undo_association_delete(element, association, value):
+    association._set(element, value, from_opposite=True)
+
+def _undo_association_extend(element, association, values):
+    # The opposite ends have sent their own events, as for an add
+    for value in reversed(values):
+        association._del(element, value, from_opposite=True)
+
+_undo_functions = {
+    CREATE: _undo_create,
+    DELETE: _undo_delete,
+    ATTRIBUTE: _undo_attribute,
+    ASSOCIATION_SET: _undo_association_set,
+    ASSOCIATION_ADD: _undo_association_add,
+    ASSOCIATION_DELETE: _undo_association_delete,
+    ASSOCIATION_EXTEND: _undo_association_extend,
+}
+
+
+# Attribute values that can be stored in the undo journal
+_JOURNAL_VALUE_TYPES = (basestring, int, long, float, type(None))
+
+
+def _encode_records(transaction, factory):
+    """
+    Return the undo records of ``transaction`` in a form that can be stored
+    in the undo journal: elements are replaced by their persistent id and
+    properties by their name. For deleted elements, the type and attribute
+    values are stored, so the element can be recreated. Returns None if the
+    transaction holds other undo actions (e.g. canvas changes) or refers to
+    elements that are not managed by ``factory``.
+    """
+    def ref(element):
+        if element is None:
+            return None
+        if getattr(element, 'factory', None) is not factory:
+            raise ValueError, 'Element %s is not in the element factory' % element
+        return factory.persistent_id(element.id)
+
+    records = []
+    try:
+        for action in transaction._actions:
+            if type(action) is not tuple:
+                return None
+            op, element, property, value = action
+            if op == CREATE:
+                records.append((op, ref(element), None, None))
+            elif op == DELETE:
+                values = dict((prop.name, prop._get(element))
+                             for prop in type(element).umlplan().save
+                             if isinstance(prop, (attribute, enumeration))
+                                and hasattr(element, prop._name))
+                records.append((op, ref(element), None,
+                                (type(element).__name__, values)))
+            elif op == ATTRIBUTE:
+                if not isinstance(value, _JOURNAL_VALUE_TYPES):
+                    return None
+                records.append((op, ref(element), property.name, value))
+            elif op == ASSOCIATION_EXTEND:
+                records.append((op, ref(element), property.name,
+                                tuple(map(ref, value))))
+            else:
+                records.append((op, ref(element), property.name, ref(value)))
+    except ValueError:
+        return None
+    return records
+
+
+def _replay_records(records, factory):
+    """
+    Undo the changes recorded by encoded undo records. Elements are looked
+    up when a record is played back, since elements may be recreated by a
+    record played back earlier.
+    """
+    lookup = factory.lookup
+    for op, id, name, value in reversed(records):
+        if op == DELETE:
+            type_name, values = value
+            element = factory.create_as(getattr(UML, type_name), id)
+            for name, value in values.iteritems():
+                element.load(name, value)
+            component.handle(ElementCreateEvent(factory, element))
+            continue
+
+        element = lookup(id)
+        if element is None:
+            log.warning('Element %s not found while undoing' % id)
+        elif op == CREATE:
+            _undo_create(element, factory, None)
+        else:
+            property = type(element).umlplan().by_name[name]
+            if op == ASSOCIATION_EXTEND:
+                value = tuple(map(lookup, value))
+            elif op != ATTRIBUTE and value is not None:
+                value = lookup(value)
+            _undo_functions[op](element, property, value)
+
+
+def _record_size(record):
+    """
+    Estimate the memory used by an undo record. Elements and properties
+    are part of the model, only the record itself and its (string) values
+    are counted.
+    """
+    size = sys.getsizeof(record)
+    value = record[3]
+    if isinstance(value, (basestring, tuple)):
+        size += sys.getsizeof(value)
+    return size
+
+
+def _action_size(action):
+    """
+    Estimate the memory used by an undo action (e.g. a closure).
+    """
+    size = sys.getsizeof(action)
+    closure = getattr(action, 'func_closure', None)
+    if closure:
+        size += sys.getsizeof(closure) + sum(map(sys.getsizeof, closure))
+    return size
+
+
 class ActionStack(object):
     """
     A transaction. Every action that is added between a begin_transaction()
@@ -40,13 +207,42 @@ class ActionStack(object):
     be played back when a transaction is executed. This executing a
     transaction has the effect of performing the actions recorded, which will
     typically undo actions performed by the user.
+
+    Actions are either callables or undo records. The estimated size of the
+    actions in bytes is kept in ``size``.
     """
 
     def __init__(self):
         self._actions = []
+        # Attributes (element, property) that have been recorded
+        self._attributes = set()
+        self.size = 0
 
     def add(self, action):
         self._actions.append(action)
+        self.size += _action_size(action)
+
+    def add_record(self, op, element, property, value):
+        """
+        Add an undo record. Only the first change of an attribute is
+        recorded: that holds the value to restore. Returns True if the
+        record has been added.
+        """
+        if op == ATTRIBUTE:
+            key = (element, property)
+            if key in self._attributes:
+                return False
+            self._attributes.add(key)
+        record = (op, element, property, value)
+        self._actions.append(record)
+        self.size += _record_size(record)
+        return True
+
+    def close(self):
+        """
+        No more actions will be added.
+        """
+        self._attributes = None
 
     def can_execute(self):
         return self._actions and True or False
@@ -56,9 +252,12 @@ class ActionStack(object):
         self._actions.reverse()
         for action in self._actions:
             try:
-                action()
+                if type(action) is tuple:
+                    _undo_functions[action[0]](*action[1:])
+                else:
+                    action()
             except Exception, e:
-                log.error('Error while undoing action %s' % action, exc_info=True)
+                log.error('Error while undoing action %s' % (action,), exc_info=True)
 
 
 class UndoManagerStateChanged(object):
@@ -106,13 +305,31 @@ class UndoManager(object):
     """
     
     component_registry = inject('component_registry')
+    element_factory = inject('element_factory')
 
     logger = getLogger('UndoManager')
 
-    def __init__(self):
+    # Default memory budget for the undo and redo stack
+    budget = 16 * 1024 * 1024
+
+    # Journal for transactions that do not fit in the budget, if any
+    journal = None
+
+    # Model file the journal is kept next to (see open_journal())
+    journal_model = None
+
+    def __init__(self, budget=None):
+        """
+        ``budget`` is the (estimated) number of bytes the undo stack, and
+        the redo stack, may use. The oldest transactions are dropped to
+        stay within it, but the last transaction is always kept. If a
+        journal is opened (see open_journal()), the oldest transactions are
+        moved to the journal instead (see _spill()).
+        """
         self._undo_stack = []
         self._redo_stack = []
-        self._stack_depth = 20
+        if budget is not None:
+            self.budget = budget
         self._current_transaction = None
         self.action_group = build_action_group(self)
 
@@ -140,11 +357,18 @@ class UndoManager(object):
         self.component_registry.unregister_handler(self.rollback_transaction)
         self.component_registry.unregister_handler(self._action_executed)
         self._unregister_undo_handlers()
+        self.close_journal()
 
 
     def clear_undo_stack(self):
         self._undo_stack = []
         self._current_transaction = None
+        if self.journal is not None:
+            try:
+                self.journal.clear()
+            except EnvironmentError, e:
+                self.logger.warning('Can not clear undo journal %s: %s' % (self.journal.filename, e))
+                self._drop_journal()
 
 
     def clear_redo_stack(self):
@@ -153,11 +377,133 @@ class UndoManager(object):
 
     @component.adapter(IModelFactoryEvent)
     def reset(self, event=None):
+        self.close_journal()
         self.clear_redo_stack()
         self.clear_undo_stack()
         self._action_executed()
 
 
+    def open_journal(self, filename, keep=False):
+        """
+        Use an undo journal for model file ``filename``. Transactions that
+        do not fit in the budget are moved to the journal, instead of being
+        dropped. The journal file is only created when it's needed. If
+        ``keep`` is set, the journal that was saved with the model (see
+        save_journal()) is used, if it belongs to the model file as it is
+        now: the undo history survives reopening the model.
+        """
+        self.close_journal()
+        self.journal_model = filename
+        path = filename + EXTENSION
+        if keep and os.path.exists(path) and os.path.exists(filename):
+            try:
+                journal = UndoJournal(path, fingerprint(filename))
+            except EnvironmentError, e:
+                self.logger.warning('Can not open undo journal %s: %s' % (path, e))
+            else:
+                if journal:
+                    self.journal = journal
+                else:
+                    # Not the journal of this model (anymore)
+                    self._close(journal)
+        self.component_registry.handle(UndoManagerStateChanged(self))
+        self._action_executed()
+
+
+    def save_journal(self, filename, keep=False):
+        """
+        The model has been saved to ``filename``. If ``keep`` is set, the
+        transactions on the undo stack are moved to the journal as well,
+        the journal is moved next to the model file and it is marked as
+        belonging to the saved model, so it can be used when the model is
+        opened again. This is only possible if all transactions can be
+        stored in the journal.
+        """
+        self.journal_model = filename
+        journal = self.journal
+        if keep:
+            encoded = [ _encode_records(tx, self.element_factory)
+                        for tx in self._undo_stack ]
+            if None not in encoded:
+                path = filename + EXTENSION
+                try:
+                    if journal is None:
+                        journal = self.journal = UndoJournal(path)
+                    elif journal.filename != path:
+                        journal.move(path)
+                    for records in encoded:
+                        journal.push(records)
+                    del self._undo_stack[:]
+                    journal.fingerprint = fingerprint(filename)
+                except EnvironmentError, e:
+                    self.logger.warning('Can not save undo journal %s: %s' % (path, e))
+                    self._drop_journal()
+                return
+        if journal is not None and journal.fingerprint:
+            try:
+                journal.fingerprint = None
+            except EnvironmentError, e:
+                self.logger.warning('Can not update undo journal %s: %s' % (journal.filename, e))
+                self._drop_journal()
+
+
+    def close_journal(self):
+        """
+        Close the undo journal. The transactions in it are no longer
+        available.
+        """
+        if self.journal is not None:
+            self._close(self.journal)
+            del self.journal
+        self.journal_model = None
+
+
+    def _close(self, journal):
+        try:
+            journal.close()
+        except EnvironmentError, e:
+            self.logger.warning('Can not close undo journal %s: %s' % (journal.filename, e))
+
+
+    def _drop_journal(self):
+        """
+        Stop using the journal after an I/O error. The transactions in it
+        are lost, the model file is kept as journal model, so a new journal
+        is created when needed.
+        """
+        if self.journal is not None:
+            self._close(self.journal)
+            del self.journal
+
+
+    def _create_journal(self):
+        """
+        Create the journal for the transactions moved out of the undo stack.
+        It is created next to the model file, or in the temporary directory
+        if that's not possible or a journal file already exists there (e.g.
+        one that was saved with the model, see save_journal()). Returns None
+        if no journal can be created.
+        """
+        model = self.journal_model
+        if model is None:
+            return None
+        path = model + EXTENSION
+        if not os.path.exists(path) and \
+                os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+            try:
+                return UndoJournal(path)
+            except EnvironmentError, e:
+                self.logger.warning('Can not create undo journal %s: %s' % (path, e))
+        try:
+            fd, path = tempfile.mkstemp(prefix=os.path.basename(model) + '-',
+                                        suffix=EXTENSION)
+            os.close(fd)
+            return UndoJournal(path)
+        except EnvironmentError, e:
+            self.logger.warning('Can not create undo journal: %s' % e)
+            return None
+
+
     @component.adapter(TransactionBegin)
     def begin_transaction(self, event=None):
         """
@@ -178,6 +524,83 @@ class UndoManager(object):
             self._action_executed()
 
 
+    def _add_undo_record(self, op, element, property, value):
+        """
+        Add an undo record for a change in the data model.
+        """
+        transaction = self._current_transaction
+        if transaction:
+            first = not transaction.can_execute()
+            if transaction.add_record(op, element, property, value) and first:
+                self.component_registry.handle(UndoManagerStateChanged(self))
+                self._action_executed()
+
+
+    def _limit(self, stack):
+        """
+        Drop the oldest transactions from stack until it fits in the budget.
+        """
+        size = sum(tx.size for tx in stack)
+        while len(stack) > 1 and size > self.budget:
+            size -= stack.pop(0).size
+
+
+    def _spill(self):
+        """
+        Move the oldest transactions from the undo stack to the journal,
+        until the undo stack fits in the budget. Moving stops at a
+        transaction that can not be stored in the journal (e.g. one with
+        canvas changes): it is kept in memory, and so are the transactions
+        after it. Only if the undo stack grows beyond twice the budget the
+        oldest transactions are dropped, and so are the transactions in the
+        journal: they can not be reached anymore.
+        """
+        stack = self._undo_stack
+        size = sum(tx.size for tx in stack)
+        if len(stack) <= 1 or size <= self.budget:
+            return
+
+        journal = self.journal
+        if journal is None:
+            journal = self.journal = self._create_journal()
+            if journal is None:
+                self._limit(stack)
+                return
+
+        try:
+            while len(stack) > 1 and size > self.budget:
+                records = _encode_records(stack[0], self.element_factory)
+                if records is None:
+                    break
+                journal.push(records)
+                size -= stack.pop(0).size
+            if size > 2 * self.budget:
+                self._limit(stack)
+                journal.clear()
+        except EnvironmentError, e:
+            self.logger.warning('Can not write undo journal %s: %s' % (journal.filename, e))
+            self._drop_journal()
+            self._limit(stack)
+
+
+    def _load_transaction(self):
+        """
+        Read the most recent transaction from the journal. Returns None if
+        the journal can not be read.
+        """
+        try:
+            records = self.journal.pop()
+        except Exception, e:
+            self.logger.warning('Can not read undo journal %s: %s' % (self.journal.filename, e))
+            self._drop_journal()
+            return None
+        factory = self.element_factory
+        transaction = ActionStack()
+        transaction.add(lambda: _replay_records(records, factory))
+        transaction.close()
+        return transaction
+
+
     @component.adapter(TransactionCommit)
     def commit_transaction(self, event=None):
         assert self._current_transaction
@@ -185,9 +608,9 @@ class UndoManager(object):
         if self._current_transaction.can_execute():
             # Here:
             self.clear_redo_stack()
+            self._current_transaction.close()
             self._undo_stack.append(self._current_transaction)
-            while len(self._undo_stack) > self._stack_depth:
-                del self._undo_stack[0]
+            self._spill()
 
         self._current_transaction = None
 
@@ -232,12 +655,19 @@ class UndoManager(object):
 
     @action(name='edit-undo', stock_id='gtk-undo', accel='<Control>z')
     def undo_transaction(self):
-        if not self._undo_stack:
+        if not self._undo_stack and not self.journal:
             return
 
         if self._current_transaction:
             log.warning('Trying to undo a transaction, while in a transaction')
             self.commit_transaction()
+        if not self._undo_stack:
+            transaction = self._load_transaction()
+            if transaction is None:
+                self.component_registry.handle(UndoManagerStateChanged(self))
+                self._action_executed()
+                return
+            self._undo_stack.append(transaction)
         transaction = self._undo_stack.pop()
 
         # Store stacks
@@ -255,8 +685,7 @@ class UndoManager(object):
                 self._redo_stack.extend(self._undo_stack)
             self._undo_stack = undo_stack
 
-        while len(self._redo_stack) > self._stack_depth:
-            del self._redo_stack[0]
+        self._limit(self._redo_stack)
 
         self.component_registry.handle(UndoManagerStateChanged(self))
         self._action_executed()
@@ -285,7 +714,8 @@ class UndoManager(object):
 
 
     def can_undo(self):
-        return bool(self._current_transaction or self._undo_stack)
+        return bool(self._current_transaction or self._undo_stack
+                    or self.journal)
 
 
     def can_redo(self):
@@ -315,6 +745,7 @@ class UndoManager(object):
         self.component_registry.register_handler(self.undo_association_set_event)
         self.component_registry.register_handler(self.undo_association_add_event)
         self.component_registry.register_handler(self.undo_association_delete_event)
+        self.component_registry.register_handler(self.undo_association_extend_event)
 
         #
         # Direct revert-statements from gaphas to the undomanager
@@ -333,6 +764,7 @@ class UndoManager(object):
         self.component_registry.unregister_handler(self.undo_association_set_event)
         self.component_registry.unregister_handler(self.undo_association_add_event)
         self.component_registry.unregister_handler(self.undo_association_delete_event)
+        self.component_registry.unregister_handler(self.undo_association_extend_event)
 
         state.observers.discard(state.revert_handler)
 
@@ -345,14 +777,7 @@ class UndoManager(object):
         # A factory is not always present, e.g. for DiagramItems
         if not factory:
             return
-        element = event.element
-        def _undo_create_event():
-            try:
-                del factory._elements[element.id]
-            except KeyError:
-                pass # Key was probably already removed in an unlink call
-            self.component_registry.handle(ElementDeleteEvent(factory, element))
-        self.add_undo_action(_undo_create_event)
+        self._add_undo_record(CREATE, event.element, factory, None)
 
 
     @component.adapter(IElementDeleteEvent)
@@ -361,64 +786,37 @@ class UndoManager(object):
         # A factory is not always present, e.g. for DiagramItems
         if not factory:
             return
-        element = event.element
-        assert factory, 'No factory defined for %s (%s)' % (element, factory)
-        def _undo_delete_event():
-            factory._elements[element.id] = element
-            self.component_registry.handle(ElementCreateEvent(factory, element))
-        self.add_undo_action(_undo_delete_event)
+        self._add_undo_record(DELETE, event.element, factory, None)
 
 
     @component.adapter(IAttributeChangeEvent)
     def undo_attribute_change_event(self, event):
-        attribute = event.property
-        element = event.element
-        value = event.old_value
-        
-        def _undo_attribute_change_event():
-            attribute._set(element, value)
-            
-        self.add_undo_action(_undo_attribute_change_event)
+        self._add_undo_record(ATTRIBUTE, event.element, event.property,
+                              event.old_value)
 
 
     @component.adapter(AssociationSetEvent)
     def undo_association_set_event(self, event):
-        association = event.property
-        element = event.element
-        value = event.old_value
-        #print 'got new set event', association, element, value
-        def _undo_association_set_event():
-            #print 'undoing action', element, value
-            # Tell the assoctaion it should not need to let the opposite
-            # side connect (it has it's own signal)
-            association._set(element, value, from_opposite=True)
-        self.add_undo_action(_undo_association_set_event)
+        self._add_undo_record(ASSOCIATION_SET, event.element, event.property,
+                              event.old_value)
 
 
     @component.adapter(AssociationAddEvent)
     def undo_association_add_event(self, event):
-        association = event.property
-        element = event.element
-        value = event.new_value
-        def _undo_association_add_event():
-            #print 'undoing action', element, value
-            # Tell the assoctaion it should not need to let the opposite
-            # side connect (it has it's own signal)
-            association._del(element, value, from_opposite=True)
-        self.add_undo_action(_undo_association_add_event)
+        self._add_undo_record(ASSOCIATION_ADD, event.element, event.property,
+                              event.new_value)
 
 
     @component.adapter(AssociationDeleteEvent)
     def undo_association_delete_event(self, event):
-        association = event.property
-        element = event.element
-        value = event.old_value
-        def _undo_association_delete_event():
-            #print 'undoing action', element, value
-            # Tell the assoctaion it should not need to let the opposite
-            # side connect (it has it's own signal)
-            association._set(element, value, from_opposite=True)
-        self.add_undo_action(_undo_association_delete_event)
+        self._add_undo_record(ASSOCIATION_DELETE, event.element,
+                              event.property, event.old_value)
+
+
+    @component.adapter(AssociationExtendEvent)
+    def undo_association_extend_event(self, event):
+        self._add_undo_record(ASSOCIATION_EXTEND, event.element,
+                              event.property, tuple(event.new_values))
 
 
 # vim:sw=4:et:ai
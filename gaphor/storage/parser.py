@@ -28,6 +28,9 @@ class name in the gaphor.diagram module.
 
 The generator parse_generator(filename, loader) may be used if the loading
 takes a long time. The yielded values are the percentage of the file read.
+
+If available, the loader is fed directly from pyexpat callbacks (see
+ExpatReader). The xml.sax based reader is used as a fallback.
 """
 
 __all__ = [ 'parse', 'ParserException' ]
@@ -37,6 +40,11 @@ import types
 from xml.sax import handler
 from cStringIO import InputType
 
+try:
+    from xml.parsers import expat
+except ImportError:
+    expat = None
+
 from gaphor.misc.odict import odict
 
 class base(object):
@@ -87,6 +95,9 @@ class canvasitem(base):
 
 XMLNS='http://gaphor.sourceforge.net/model'
 
+# Amount of data read from the model file at once by the expat reader:
+BLOCK_SIZE = 64 * 1024
+
 class ParserException(Exception):
     pass
 
@@ -148,22 +159,38 @@ class GaphorLoader(handler.ContentHandler):
         self.gaphor_version = None
         self.elements = odict() # map id: element/canvasitem
         self.__stack = []
-        self.text = ''
+        self.__names = {}
+        self._text = []
 
     def endDocument(self):
         if len(self.__stack) != 0:
             raise ParserException, 'Invalid XML document.'
 
+    def _intern(self, name):
+        """Return an interned (byte) string for a tag name.
+
+        Tag names (element types and attribute names) are used over and over
+        again as dictionary keys. Interning them saves memory and makes the
+        lookups done while constructing the model cheaper.
+        """
+        try:
+            return self.__names[name]
+        except KeyError:
+            n = self.__names[name] = intern(str(name))
+            return n
+
     def startElement(self, name, attrs):
-        self.text = ''
+        self._text = []
         
-        state = self.state()
+        # Avoid the state() method call, this is the hot path while loading:
+        stack = self.__stack
+        state = stack[-1][1] if stack else ROOT
 
         # Read a element class. The name of the tag is the class name:
         if state == GAPHOR:
             id = attrs['id']
-            e = element(id, name)
-            assert id not in self.elements.keys(), '%s already defined' % (id)#, self.elements[id])
+            e = element(id, self._intern(name))
+            assert id not in self.elements, '%s already defined' % (id)#, self.elements[id])
             self.elements[id] = e
             self.push(e, name == 'Diagram' and DIAGRAM or ELEMENT)
 
@@ -176,8 +203,8 @@ class GaphorLoader(handler.ContentHandler):
         # Items in a canvas are referenced by the <item> tag:
         elif state in (CANVAS, ITEM) and name == 'item':
             id = attrs['id']
-            c = canvasitem(id, attrs['type'])
-            assert id not in self.elements.keys(), '%s already defined' % id
+            c = canvasitem(id, self._intern(attrs['type']))
+            assert id not in self.elements, '%s already defined' % id
             self.elements[id] = c
             self.peek().canvasitems.append(c)
             self.push(c, ITEM)
@@ -186,7 +213,7 @@ class GaphorLoader(handler.ContentHandler):
         # to store the <ref>, <reflist> or <val> content:
         elif state in (ELEMENT, DIAGRAM, CANVAS, ITEM):
             # handle 'normal' attributes
-            self.push(name, ATTR)
+            self.push(self._intern(name), ATTR)
 
         # Reference list:
         elif state == ATTR and name == 'reflist':
@@ -228,13 +255,14 @@ class GaphorLoader(handler.ContentHandler):
             raise ParserException, 'Invalid XML: tag <%s> not known (state = %s)' % (name, state)
 
     def endElement(self, name):
+        stack = self.__stack
         # Put the text on the value
-        if self.state() == VAL:
+        if stack[-1][1] == VAL:
             # Two levels up: the attribute name
-            n = self.peek(2)
+            n = stack[-2][0]
             # Three levels up: the element instance (element or canvasitem)
-            self.peek(3).values[n] = self.text
-        self.pop()
+            stack[-3][0].values[n] = ''.join(self._text)
+        stack.pop()
 
     def startElementNS(self, name, qname, attrs):
         if not name[0] or name[0] == XMLNS:
@@ -248,8 +276,8 @@ class GaphorLoader(handler.ContentHandler):
             self.endElement(name[1])
 
     def characters(self, content):
-        """Read characters."""
-        self.text = self.text + content
+        """Read characters. The text is joined when the tag is closed."""
+        self._text.append(content)
 
 
 def parse(filename):
@@ -267,14 +295,94 @@ def parse_generator(filename, loader):
     parses the file filename and load it with ContentHandler loader.
     """
     assert isinstance(loader, GaphorLoader), 'loader should be a GaphorLoader'
+    if expat:
+        parser = ExpatReader(loader)
+        block_size = BLOCK_SIZE
+    else:
+        parser = sax_parser(loader)
+        block_size = 512
+
+    for percentage in parse_file(filename, parser, block_size):
+        yield percentage
+
+
+def sax_parser(loader):
+    """Create a namespace aware xml.sax parser that feeds loader.
+    """
     from xml.sax import make_parser
     parser = make_parser()
 
     parser.setFeature(handler.feature_namespaces, 1)
     parser.setContentHandler(loader)
+    return parser
 
-    for percentage in parse_file(filename, parser):
-        yield percentage
+
+class ExpatReader(object):
+    """Feed a GaphorLoader directly from pyexpat callbacks.
+
+    The xml.sax layer creates a new attributes object for every tag and
+    GaphorLoader.startElementNS() copies it once more. This reader hands the
+    attribute dictionary created by expat straight to
+    GaphorLoader.startElement(). Tag names are translated to (interned)
+    local names once, elements from other namespaces are ignored, like
+    startElementNS() does.
+
+    Like the SAX parser, this object has a feed() and close() method.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._names = {}
+        parser = self._parser = expat.ParserCreate(namespace_separator=' ')
+        parser.buffer_text = True
+        parser.buffer_size = BLOCK_SIZE
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        loader.startDocument()
+
+    def _local_name(self, name):
+        """Return the local name for a tag, or None if the tag does not
+        belong to the Gaphor namespace.
+        """
+        try:
+            ns, local = name.split(' ')
+        except ValueError:
+            ns, local = None, name
+        if not ns or ns == XMLNS:
+            local = self._loader._intern(local)
+        else:
+            local = None
+        self._names[name] = local
+        return local
+
+    def _start_element(self, name, attrs):
+        try:
+            name = self._names[name]
+        except KeyError:
+            name = self._local_name(name)
+        if name:
+            self._loader.startElement(name, attrs)
+            # Only the content of <val> tags is used, skip all
+            # whitespace in between the other tags:
+            if name == 'val':
+                self._parser.CharacterDataHandler = self._loader.characters
+
+    def _end_element(self, name):
+        try:
+            name = self._names[name]
+        except KeyError:
+            name = self._local_name(name)
+        if name:
+            if name == 'val':
+                self._parser.CharacterDataHandler = None
+            self._loader.endElement(name)
+
+    def feed(self, data):
+        self._parser.Parse(data, False)
+
+    def close(self):
+        self._parser.Parse('', True)
+        self._loader.endDocument()
 
 
 class ProgressGenerator(object):
@@ -314,9 +422,10 @@ class ProgressGenerator(object):
             yield (read_size * 100) / self.file_size
 
 
-def parse_file(filename, parser):
+def parse_file(filename, parser, block_size=512):
     """Parse the supplied file using the supplied parser.  The parser parameter
-    should be a GaphorLoader instance.  The filename parameter can be an
+    should be an object with a feed() and close() method, such as a SAX
+    parser or an ExpatReader.  The filename parameter can be an
     open file descriptor instance or the name of a file.  The progress
     percentage of the parser is yielded."""
     
@@ -328,7 +437,7 @@ def parse_file(filename, parser):
         is_fd = False
         file_obj = open(filename, 'rb')
         
-    for progress in ProgressGenerator(file_obj, parser):
+    for progress in ProgressGenerator(file_obj, parser, block_size):
         yield progress
     
     parser.close()
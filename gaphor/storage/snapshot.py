@@ -0,0 +1,687 @@
+"""Compact binary snapshot format for Gaphor models.
+
+A snapshot holds exactly the same information as a .gaphor (XML) file, but
+in a form that is a lot smaller and faster to read:
+
+ - All names (element types and property names) and all values are stored
+   once, in a string table. Records refer to them by index.
+ - All element and canvas item ids are stored once, in an id table. Elements
+   and references refer to them by index.
+ - Values are stored as typed records: text is a string table index,
+   integer values are stored inline.
+
+A snapshot starts with MAGIC and the format version (a 32 bit little endian
+integer). The rest of the file consists of segments: a 32 bit little endian
+length followed by that many bytes of zlib compressed data. Each segment
+consists of:
+
+    table sizes: number of names, strings, ids and record words
+    string lengths: Gaphor file version, Gaphor version, names, strings, ids
+    string data: all strings, UTF-8 encoded, concatenated
+    records: 32 bit little endian words
+
+The first segment holds the model. Following segments form a journal: they
+are appended by incremental saves (a SnapshotWriter in journal mode) and
+hold the elements that changed, which replace the elements with the same
+id, and the ids of deleted elements (DELETE records). Loading replays the
+journal.
+
+The records mirror the structure of the XML file:
+
+    ELEMENT type id ... END
+    CANVAS ... END
+    ITEM type id ... END
+    VAL name string
+    INT name integer
+    REF name id
+    REFLIST name count id*
+    DELETE id
+
+All numeric data is stored as arrays of 32 bit words, so it can be decoded in
+one go by the array module.
+
+A snapshot is written by the SnapshotWriter. It receives the same calls as
+the XMLWriter, so it can be passed to storage.save() and it can also be used
+as SAX content handler to convert a .gaphor file (xml_to_snapshot()). The
+function parse_generator() fills a parser.GaphorLoader with the contents of a
+snapshot, replay() sends the contents of a snapshot to a XMLWriter
+(snapshot_to_xml()). Both conversions are lossless.
+"""
+
+__all__ = [ 'SnapshotWriter', 'is_snapshot', 'segment_sizes', 'parse',
+            'parse_generator', 'replay', 'xml_to_snapshot', 'snapshot_to_xml' ]
+
+import os
+import sys
+import types
+import struct
+import zlib
+from array import array
+from cStringIO import InputType
+from xml.sax import handler
+
+from gaphor.misc.odict import odict
+from gaphor.storage import parser
+from gaphor.storage.parser import ParserException, XMLNS, \
+        ROOT, GAPHOR, ELEMENT, DIAGRAM, CANVAS, ITEM, ATTR, VAL, REFLIST, REF
+
+MAGIC = 'GAPHORSNAPSHOT\n'
+FORMAT_VERSION = 2
+
+EXTENSION = '.gaphorb'
+
+# Record types:
+[ R_ELEMENT,
+  R_CANVAS,
+  R_ITEM,
+  R_END,
+  R_VAL,
+  R_INT,
+  R_REF,
+  R_REFLIST,
+  R_DELETE
+] = xrange(1, 10)
+
+
+# Integer values should fit in a word after zig-zag encoding:
+INT_MIN, INT_MAX = -2**31, 2**31 - 1
+
+
+def _words(data=None):
+    """Create an array of 32 bit words. If data is provided, it is decoded
+    as little endian words.
+    """
+    words = array('I')
+    if data:
+        words.fromstring(data)
+        if sys.byteorder == 'big':
+            words.byteswap()
+    return words
+
+
+def _words_to_string(words):
+    if sys.byteorder == 'big':
+        words = array('I', words)
+        words.byteswap()
+    return words.tostring()
+
+
+def _int_value(text):
+    """Return the integer value of text, or None if text is not the
+    canonical representation of an integer (so it can be written back as is).
+    """
+    if len(text) > 11:
+        return None
+    try:
+        n = int(text)
+    except ValueError:
+        return None
+    if str(n) == text and INT_MIN <= n <= INT_MAX:
+        return n
+    return None
+
+
+class SnapshotWriter(handler.ContentHandler):
+    """Write a model snapshot.
+
+    The writer understands the calls made by storage.save_generator() on a
+    XMLWriter and the SAX events produced while parsing a .gaphor file.
+    Records are buffered, since the tables can only be written once the
+    whole model has been seen. The snapshot is written on endDocument().
+
+    If journal is True, only a segment is written, which should be appended
+    to an existing snapshot. Deleted elements are recorded with
+    delete_element().
+    """
+
+    def __init__(self, out, journal=False):
+        handler.ContentHandler.__init__(self)
+        self._out = out
+        self._journal = journal
+        self.startDocument()
+
+    def _index(self, table, values, s):
+        try:
+            return table[s]
+        except KeyError:
+            i = table[s] = len(values)
+            values.append(s)
+            return i
+
+    def _name(self, name):
+        return self._index(self._names, self._name_list, name)
+
+    def _id(self, id):
+        return self._index(self._ids, self._id_list, id)
+
+    def _write_value(self, name, text):
+        n = _int_value(text)
+        if n is None:
+            self._write((R_VAL, self._name(name),
+                    self._index(self._strings, self._string_list, text)))
+        else:
+            # zig-zag encoding for negative numbers:
+            n = n * 2 if n >= 0 else -n * 2 - 1
+            self._write((R_INT, self._name(name), n))
+
+    def startDocument(self):
+        self.version = None
+        self.gaphor_version = None
+        self._names = {}
+        self._name_list = []
+        self._strings = {}
+        self._string_list = []
+        self._ids = {}
+        self._id_list = []
+        self._records = _words()
+        self._write = self._records.extend
+        self._stack = []
+        self._text = []
+
+    def endDocument(self):
+        if self._stack:
+            raise ParserException, 'Invalid model: not all tags are closed.'
+        strings = [ self.version or '', self.gaphor_version or '' ]
+        strings.extend(self._name_list)
+        strings.extend(self._string_list)
+        strings.extend(self._id_list)
+        strings = [ isinstance(s, unicode) and s.encode('utf-8') or s
+                    for s in strings ]
+        sizes = array('I', (len(self._name_list), len(self._string_list),
+                            len(self._id_list), len(self._records)))
+        payload = ''.join((_words_to_string(sizes),
+                           _words_to_string(array('I', map(len, strings))),
+                           ''.join(strings),
+                           _words_to_string(self._records)))
+        payload = zlib.compress(payload, 6)
+        if not self._journal:
+            self._out.write(MAGIC)
+            self._out.write(struct.pack('<I', FORMAT_VERSION))
+        self._out.write(struct.pack('<I', len(payload)))
+        self._out.write(payload)
+
+    def delete_element(self, id):
+        """Record that the element with id has been deleted (journal only).
+        """
+        assert self._journal, 'Only journal entries can delete elements'
+        self._write((R_DELETE, self._id(id)))
+
+    def startPrefixMapping(self, prefix, uri):
+        pass
+
+    def endPrefixMapping(self, prefix):
+        pass
+
+    def startElement(self, name, attrs):
+        stack = self._stack
+        state = stack[-1][0] if stack else ROOT
+
+        if state == GAPHOR:
+            self._write((R_ELEMENT, self._name(name), self._id(attrs['id'])))
+            stack.append((name == 'Diagram' and DIAGRAM or ELEMENT, None))
+
+        elif state == DIAGRAM and name == 'canvas':
+            self._write((R_CANVAS,))
+            stack.append((CANVAS, None))
+
+        elif state in (CANVAS, ITEM) and name == 'item':
+            self._write((R_ITEM, self._name(attrs['type']),
+                         self._id(attrs['id'])))
+            stack.append((ITEM, None))
+
+        elif state in (ELEMENT, DIAGRAM, CANVAS, ITEM):
+            stack.append((ATTR, name))
+
+        elif state == ATTR and name == 'reflist':
+            stack.append((REFLIST, []))
+
+        elif state == ATTR and name == 'ref':
+            self._write((R_REF, self._name(stack[-1][1]),
+                         self._id(attrs['refid'])))
+            stack.append((REF, None))
+
+        elif state == REFLIST and name == 'ref':
+            stack[-1][1].append(self._id(attrs['refid']))
+            stack.append((REF, None))
+
+        elif state == ATTR and name == 'val':
+            self._text = []
+            stack.append((VAL, None))
+
+        elif state == ROOT and name == 'gaphor':
+            self.version = attrs['version']
+            self.gaphor_version = attrs.get('gaphor-version') \
+                    or attrs.get('gaphor_version')
+            stack.append((GAPHOR, None))
+
+        else:
+            raise ParserException, 'Invalid XML: tag <%s> not known (state = %s)' % (name, state)
+
+    def endElement(self, name):
+        stack = self._stack
+        state, data = stack.pop()
+        if state == VAL:
+            self._write_value(stack[-1][1], ''.join(self._text))
+        elif state == REFLIST:
+            self._write((R_REFLIST, self._name(stack[-1][1]), len(data)))
+            self._write(data)
+        elif state in (ELEMENT, DIAGRAM, CANVAS, ITEM):
+            self._write((R_END,))
+
+    def startElementNS(self, name, qname, attrs):
+        if not name[0] or name[0] == XMLNS:
+            a = { }
+            for key, val in attrs.items():
+                a[key[1]] = val
+            self.startElement(name[1], a)
+
+    def endElementNS(self, name, qname):
+        if not name[0] or name[0] == XMLNS:
+            self.endElement(name[1])
+
+    def characters(self, content):
+        if self._stack and self._stack[-1][0] == VAL:
+            self._text.append(content)
+
+
+def _decompress(data):
+    try:
+        return zlib.decompress(data)
+    except zlib.error, e:
+        raise ParserException, 'Invalid snapshot: %s' % e
+
+
+def _segments(data):
+    """Iterate the decompressed segments of a snapshot. The first one holds
+    the model, the others are journal entries. A journal entry that was not
+    written completely (e.g. the application crashed while saving) is
+    ignored.
+    """
+    if not data.startswith(MAGIC):
+        raise ParserException, 'Not a Gaphor snapshot'
+    pos = len(MAGIC)
+    if len(data) < pos + 4:
+        raise ParserException, 'Invalid snapshot: unexpected end of file.'
+    format_version, = struct.unpack('<I', data[pos:pos+4])
+    pos += 4
+    if format_version == 1:
+        # Version 1 snapshots have one unframed segment
+        yield _decompress(data[pos:])
+        return
+    if format_version != FORMAT_VERSION:
+        raise ParserException, 'Unsupported snapshot format version %d' % format_version
+
+    segments = []
+    end = len(data)
+    while pos < end:
+        start = pos + 4
+        if start <= end:
+            length, = struct.unpack('<I', data[pos:start])
+            pos = start + length
+            if pos <= end:
+                segments.append(data[start:pos])
+                continue
+        if not segments:
+            break
+        log.warning('Ignoring incomplete journal entry in snapshot')
+        break
+
+    if not segments:
+        raise ParserException, 'Invalid snapshot: unexpected end of file.'
+    yield _decompress(segments[0])
+    for segment in segments[1:]:
+        try:
+            segment = zlib.decompress(segment)
+        except zlib.error, e:
+            log.warning('Ignoring invalid journal entry in snapshot: %s' % e)
+            return
+        yield segment
+
+
+class SnapshotReader(object):
+    """Decode a snapshot segment. The header and tables are read on
+    construction, records() iterates the records.
+    """
+
+    def __init__(self, data):
+
+        n_names, n_strings, n_ids, n_words = _words(data[:16])
+        n = 2 + n_names + n_strings + n_ids
+        pos = 16 + n * 4
+        strings = []
+        for length in _words(data[16:pos]):
+            end = pos + length
+            strings.append(data[pos:end])
+            pos = end
+
+        self.version = strings[0]
+        self.gaphor_version = strings[1]
+        n_strings += n_names + 2
+        self.names = [ intern(s) for s in strings[2:n_names + 2] ]
+        self.strings = [ s.decode('utf-8') for s in strings[n_names + 2:n_strings] ]
+        self.ids = [ s.decode('utf-8') for s in strings[n_strings:] ]
+
+        self.words = _words(data[pos:pos + n_words * 4]).tolist()
+        if len(self.words) != n_words:
+            raise ParserException, 'Invalid snapshot: unexpected end of file.'
+        self.pos = 0
+
+    def records(self):
+        """Iterate the records as tuples (type, arguments...). Names, values
+        and ids are resolved.
+        """
+        words = self.words
+        end = len(words)
+        pos = self.pos
+        names, strings, ids = self.names, self.strings, self.ids
+        while pos < end:
+            op = words[pos]
+            if op == R_VAL:
+                record = (op, names[words[pos+1]], strings[words[pos+2]])
+                pos += 3
+            elif op == R_REF or op == R_ELEMENT or op == R_ITEM:
+                record = (op, names[words[pos+1]], ids[words[pos+2]])
+                pos += 3
+            elif op == R_END or op == R_CANVAS:
+                record = (op,)
+                pos += 1
+            elif op == R_DELETE:
+                record = (op, ids[words[pos+1]])
+                pos += 2
+            elif op == R_REFLIST:
+                count = words[pos+2]
+                start = pos + 3
+                pos = start + count
+                record = (op, names[words[start-2]],
+                          [ ids[i] for i in words[start:pos] ])
+            elif op == R_INT:
+                i = words[pos+2]
+                i = -((i + 1) >> 1) if i & 1 else i >> 1
+                record = (op, names[words[pos+1]], unicode(i))
+                pos += 3
+            else:
+                raise ParserException, 'Invalid record type %d at word %d' % (op, pos)
+            self.pos = pos
+            yield record
+
+
+def _read(filename):
+    """Return the contents of a file (name or file object).
+    """
+    if isinstance(filename, (types.FileType, InputType)):
+        return filename.read()
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def is_snapshot(filename):
+    """Return True if the file (name or file object) contains a snapshot.
+    The position of file objects is not changed.
+    """
+    if isinstance(filename, (types.FileType, InputType)):
+        pos = filename.tell()
+        magic = filename.read(len(MAGIC))
+        filename.seek(pos)
+    else:
+        with open(filename, 'rb') as f:
+            magic = f.read(len(MAGIC))
+    return magic == MAGIC
+
+
+def segment_sizes(filename):
+    """Return the (compressed) sizes of the segments in a snapshot file: the
+    model followed by the journal entries. An empty list is returned if no
+    journal entries can be appended to the file (it is not a snapshot, it
+    has an older format, or the last journal entry is incomplete). This is
+    used to decide when a snapshot should be compacted.
+
+    A journal entry appended after an incomplete one would never be read,
+    so in that case the snapshot has to be saved completely.
+    """
+    sizes = []
+    with open(filename, 'rb') as f:
+        header = f.read(len(MAGIC) + 4)
+        if header != MAGIC + struct.pack('<I', FORMAT_VERSION):
+            return sizes
+        end = os.fstat(f.fileno()).st_size
+        pos = len(header)
+        while pos < end:
+            data = f.read(4)
+            if len(data) < 4:
+                return []
+            length, = struct.unpack('<I', data)
+            pos += 4 + length
+            if pos > end:
+                return []
+            sizes.append(length)
+            f.seek(pos)
+    return sizes
+
+
+def parse(filename):
+    """Parse a snapshot and return a dictionary ID:element/canvasitem,
+    like parser.parse() does.
+    """
+    loader = parser.GaphorLoader()
+
+    for x in parse_generator(filename, loader):
+        pass
+    return loader.elements
+
+
+def _remove_canvasitems(elements, parent):
+    for item in parent.canvasitems:
+        _remove_canvasitems(elements, item)
+        del elements[item.id]
+
+
+def _load_segment(reader, elements, journal=False):
+    """Load the records of a segment into elements (a dictionary, as used
+    by parser.GaphorLoader). For journal entries, elements replace existing
+    elements with the same id. This function is a generator: it yields
+    every now and then, so the reader position can be checked.
+    """
+    stack = []
+    n = 0
+    for record in reader.records():
+        op = record[0]
+        if op == R_VAL or op == R_INT:
+            stack[-1].values[record[1]] = record[2]
+        elif op == R_REF:
+            stack[-1].references[record[1]] = record[2]
+        elif op == R_REFLIST:
+            # Like the XML parser, do not register empty reference lists
+            if record[2]:
+                stack[-1].references[record[1]] = record[2]
+        elif op == R_END:
+            stack.pop()
+        elif op == R_ELEMENT:
+            id = record[2]
+            e = parser.element(id, record[1])
+            if journal and id in elements:
+                old = elements[id]
+                if old.canvas:
+                    _remove_canvasitems(elements, old.canvas)
+            else:
+                assert id not in elements, '%s already defined' % id
+            elements[id] = e
+            stack.append(e)
+        elif op == R_ITEM:
+            id = record[2]
+            c = parser.canvasitem(id, record[1])
+            assert id not in elements, '%s already defined' % id
+            elements[id] = c
+            stack[-1].canvasitems.append(c)
+            stack.append(c)
+        elif op == R_CANVAS:
+            c = parser.canvas()
+            stack[-1].canvas = c
+            stack.append(c)
+        elif op == R_DELETE:
+            assert journal, 'DELETE records only appear in journal entries'
+            old = elements.get(record[1])
+            if old:
+                if old.canvas:
+                    _remove_canvasitems(elements, old.canvas)
+                del elements[old.id]
+        n += 1
+        if n % 1000 == 0:
+            yield n
+    if stack:
+        raise ParserException, 'Invalid snapshot: unexpected end of file.'
+
+
+def _drop_dangling_references(elements):
+    """Remove references to elements that no longer exist. References from
+    diagrams that were not loaded when an element was deleted are not
+    updated in the journal.
+    """
+    for e in elements.values():
+        references = e.references
+        for name, refs in references.items():
+            if type(refs) is list:
+                refs = [ r for r in refs if r in elements ]
+                if refs:
+                    references[name] = refs
+                else:
+                    del references[name]
+            elif refs not in elements:
+                del references[name]
+
+
+def parse_generator(filename, loader):
+    """Read a snapshot in a parser.GaphorLoader. The loader is filled with
+    the same element, canvas and canvasitem objects as if a .gaphor file was
+    parsed. Journal entries are replayed. This function is a generator. It
+    yields the percentage of the file read.
+    """
+    assert isinstance(loader, parser.GaphorLoader), 'loader should be a GaphorLoader'
+    segments = list(_segments(_read(filename)))
+    loader.startDocument()
+    elements = loader.elements
+    total = sum(map(len, segments))
+    done = 0
+    for i, segment in enumerate(segments):
+        reader = SnapshotReader(segment)
+        if i == 0:
+            loader.version = reader.version
+            loader.gaphor_version = reader.gaphor_version
+        size = len(reader.words) or 1
+        for n in _load_segment(reader, elements, journal=i > 0):
+            yield (done + len(segment) * reader.pos / size) * 100 / total
+        done += len(segment)
+    if len(segments) > 1:
+        _drop_dangling_references(elements)
+    yield 100
+
+
+def _element_records(segments):
+    """Return the records of the top level elements in the snapshot
+    segments, as ordered dictionary id: record list, with the journal
+    entries applied. The set of all element and canvas item ids is returned
+    as well.
+    """
+    elements = odict()
+    for segment in segments:
+        records = None
+        depth = 0
+        for record in SnapshotReader(segment).records():
+            op = record[0]
+            if op == R_DELETE:
+                if record[1] in elements:
+                    del elements[record[1]]
+                continue
+            if depth == 0:
+                assert op == R_ELEMENT, 'Top level records should be elements'
+                records = elements[record[2]] = []
+            if op in (R_ELEMENT, R_CANVAS, R_ITEM):
+                depth += 1
+            elif op == R_END:
+                depth -= 1
+            records.append(record)
+    ids = set(r[2] for rs in elements.itervalues() for r in rs
+              if r[0] in (R_ELEMENT, R_ITEM))
+    return elements, ids
+
+
+def replay(filename, writer):
+    """Send the contents of a snapshot to writer (e.g. a XMLWriter), in the
+    same way storage.save_generator() does. Journal entries are applied.
+    """
+    segments = list(_segments(_read(filename)))
+    reader = SnapshotReader(segments[0])
+    writer.startDocument()
+    writer.startPrefixMapping('', XMLNS)
+    writer.startElementNS((XMLNS, 'gaphor'), None,
+            { (XMLNS, 'version'): reader.version,
+              (XMLNS, 'gaphor-version'): reader.gaphor_version })
+    if len(segments) > 1:
+        elements, ids = _element_records(segments)
+        records = (r for rs in elements.itervalues() for r in rs)
+    else:
+        ids = None
+        records = reader.records()
+    stack = []
+    for record in records:
+        op = record[0]
+        if op == R_VAL or op == R_INT:
+            writer.startElement(record[1], {})
+            writer.startElement('val', {})
+            writer.characters(record[2])
+            writer.endElement('val')
+            writer.endElement(record[1])
+        elif op == R_REF:
+            if ids is not None and record[2] not in ids:
+                continue
+            writer.startElement(record[1], {})
+            writer.startElement('ref', { 'refid': record[2] })
+            writer.endElement('ref')
+            writer.endElement(record[1])
+        elif op == R_REFLIST:
+            refids = record[2]
+            if ids is not None:
+                refids = [ r for r in refids if r in ids ]
+                if not refids:
+                    continue
+            writer.startElement(record[1], {})
+            writer.startElement('reflist', {})
+            for refid in refids:
+                writer.startElement('ref', { 'refid': refid })
+                writer.endElement('ref')
+            writer.endElement('reflist')
+            writer.endElement(record[1])
+        elif op == R_END:
+            writer.endElement(stack.pop())
+        elif op == R_ELEMENT:
+            writer.startElement(record[1], { 'id': record[2] })
+            stack.append(record[1])
+        elif op == R_ITEM:
+            writer.startElement('item', { 'id': record[2],
+                                          'type': record[1] })
+            stack.append('item')
+        elif op == R_CANVAS:
+            writer.startElement('canvas', {})
+            stack.append('canvas')
+    writer.endElementNS((XMLNS, 'gaphor'), None)
+    writer.endPrefixMapping('')
+    writer.endDocument()
+
+
+def xml_to_snapshot(filename, out):
+    """Convert a .gaphor file (name or file object) to a snapshot, written
+    to file object out.
+    """
+    writer = SnapshotWriter(out)
+    for x in parser.parse_file(filename, parser.sax_parser(writer), parser.BLOCK_SIZE):
+        pass
+
+
+def snapshot_to_xml(filename, out):
+    """Convert a snapshot (name or file object) to a .gaphor file, written
+    to file object out.
+    """
+    from gaphor.misc.xmlwriter import XMLWriter
+    replay(filename, XMLWriter(out))
+
+
+# vim:sw=4:et:ai
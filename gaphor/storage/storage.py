@@ -6,6 +6,12 @@ load(filename)
     load a model from a file
 save(filename)
     store the current model in a file
+
+Models can also be saved as binary snapshot by passing a
+snapshot.SnapshotWriter to save(). load() recognizes snapshots automatically.
+
+When loading with lazy=True, the canvas items of a diagram are created on
+first access of Diagram.canvas. load_canvases() creates all of them.
 """
 
 from cStringIO import StringIO, InputType
@@ -14,14 +20,17 @@ import types
 import sys
 import os.path
 import gc
+from hashlib import md5
 
 import gaphas
 
 from gaphor import UML
 from gaphor.UML.collection import collection
 from gaphor.UML.elementfactory import ElementChangedEventBlocker
+from gaphor.UML.event import DiagramLoadedEvent
 from gaphor import diagram
-from gaphor.storage import parser
+from gaphor.storage import parser, snapshot
+from gaphor.misc.odict import odict
 from gaphor.application import Application, NotInitializedError
 from gaphor.diagram import items
 from gaphor.i18n import _
@@ -34,7 +43,7 @@ from gaphor.i18n import _
 # depend on connectors service?
 from gaphor.adapters import connectors
 
-__all__ = [ 'load', 'save' ]
+__all__ = [ 'load', 'save', 'load_canvases' ]
 
 FILE_FORMAT_VERSION = '3.0'
 NAMESPACE_MODEL = 'http://gaphor.sourceforge.net/model'
@@ -44,15 +53,26 @@ def save(writer=None, factory=None, status_queue=None):
         if status_queue:
             status_queue(status)
 
-def save_generator(writer, factory):
+def save_generator(writer, factory, elements=None, deleted=()):
     """
     Save the current model using @writer, which is a
     gaphor.misc.xmlwriter.XMLWriter instance.
+
+    For a journal entry only the changed @elements and the ids of the
+    @deleted elements are written. In that case the writer should be a
+    snapshot.SnapshotWriter in journal mode.
     """
 
     # Maintain a set of id's, one for elements, one for references.
     # Write only to file if references is a subset of elements
 
+    # Elements are saved with their persistent id (see
+    # ElementFactory.persistent_id()), not with their compact id.
+    if factory:
+        persistent_id = factory.persistent_id
+    else:
+        persistent_id = lambda id: id
+
     def save_reference(name, value):
         """
         Save a value as a reference to another element in the model.
@@ -61,7 +81,7 @@ def save_generator(writer, factory):
         # Save a reference to the object:
         if value.id:
             writer.startElement(name, {})
-            writer.startElement('ref', { 'refid': value.id })
+            writer.startElement('ref', { 'refid': persistent_id(value.id) })
             writer.endElement('ref')
             writer.endElement(name)
 
@@ -75,7 +95,7 @@ def save_generator(writer, factory):
             for v in value:
                 #save_reference(name, v)
                 if v.id:
-                    writer.startElement('ref', { 'refid': v.id })
+                    writer.startElement('ref', { 'refid': persistent_id(v.id) })
                     writer.endElement('ref')
             writer.endElement('reflist')
             writer.endElement(name)
@@ -143,18 +163,26 @@ def save_generator(writer, factory):
         else:
             save_value(name, value)
 
+    if elements is None:
+        # Presentation references are only complete when all canvas items exist
+        load_canvases(factory)
+        elements = factory.values()
+
     writer.startDocument()
     writer.startPrefixMapping('', NAMESPACE_MODEL)
     writer.startElementNS((NAMESPACE_MODEL, 'gaphor'), None,
             { (NAMESPACE_MODEL, 'version'): FILE_FORMAT_VERSION,
               (NAMESPACE_MODEL, 'gaphor-version'): Application.distribution.version })
 
-    size = factory.size()
+    for id in deleted:
+        writer.delete_element(id)
+
+    size = len(elements)
     n = 0
-    for e in factory.values():
+    for e in elements:
         clazz = e.__class__.__name__
         assert e.id
-        writer.startElement(clazz, { 'id': str(e.id) })
+        writer.startElement(clazz, { 'id': persistent_id(e.id) })
         e.save(save_element)
         writer.endElement(clazz)
 
@@ -168,14 +196,123 @@ def save_generator(writer, factory):
     writer.endDocument()
 
 
-def load_elements(elements, factory, status_queue=None):
-    for status in load_elements_generator(elements, factory):
+def canvas_digest(diagram):
+    """
+    Return a digest of the canvas items of a diagram. Diagrams that are
+    changed since they were last saved have a different digest. The canvas
+    items are created if they are not loaded yet.
+    """
+    out = StringIO()
+    writer = snapshot.SnapshotWriter(out, journal=True)
+    for status in save_generator(writer, diagram.factory, elements=[diagram]):
+        pass
+    return md5(out.getvalue()).digest()
+
+
+# Number of references followed from the subjects of canvas items to the
+# model elements that are included in a diagram fingerprint
+FINGERPRINT_DEPTH = 3
+
+_owner_properties = {}
+
+def _is_owner_property(prop):
+    """
+    Return True if ``prop`` refers to the owner of an element, i.e. the
+    opposite end is a composite association.
+    """
+    try:
+        return _owner_properties[prop]
+    except KeyError:
+        opposite = getattr(prop, 'opposite', None)
+        opposite = opposite and getattr(prop.type, opposite, None)
+        is_owner = _owner_properties[prop] = \
+                bool(getattr(opposite, 'composite', False))
+        return is_owner
+
+
+def diagram_fingerprint(diagram, depth=FINGERPRINT_DEPTH):
+    """
+    Return a fingerprint (hex digest) of what is shown on a diagram. The
+    fingerprint changes if the diagram has to be rendered again.
+
+    The fingerprint consists of the canvas items (see canvas_digest()) and
+    the model elements shown by them: the subjects of the canvas items and
+    the elements they refer to, up to ``depth`` references away (e.g. the
+    attributes of a class and their multiplicities, the applied
+    stereotypes). For the elements at ``depth`` and for owners (e.g. the
+    package of a class) only the attribute values are included, so adding
+    elements elsewhere in a package does not change the fingerprint.
+    The presentation of elements is left out: it refers to canvas items of
+    other diagrams, which are not loaded if the model is loaded lazily.
+    """
+    factory = diagram.factory
+    if factory:
+        persistent_id = factory.persistent_id
+    else:
+        persistent_id = lambda id: id
+
+    entries = []
+    seen = set()
+    owners = set()
+    level = set(item.subject for item in diagram.canvas.get_all_items()
+                if getattr(item, 'subject', None))
+    presentation = UML.Element.presentation
+
+    for d in xrange(depth + 1):
+        seen.update(level)
+        next = set()
+        for element in level:
+            data = []
+            for prop in type(element).umlplan().save:
+                if prop is presentation:
+                    continue
+                values = []
+                prop.save(element, lambda name, value: values.append(value))
+                if not values:
+                    continue
+                value = values[0]
+                if isinstance(value, collection):
+                    refs = list(value)
+                elif isinstance(value, UML.Element):
+                    refs = [ value ]
+                else:
+                    data.append((prop.name, value))
+                    continue
+                if d == depth:
+                    continue
+                if _is_owner_property(prop):
+                    owners.update(refs)
+                else:
+                    next.update(refs)
+                data.append((prop.name, [ persistent_id(r.id) for r in refs ]))
+            entries.append((persistent_id(element.id), type(element).__name__, data))
+        level = next - seen
+
+    def save_value(name, value):
+        if not isinstance(value, (collection, UML.Element)):
+            data.append((name, value))
+
+    for element in owners - seen:
+        data = []
+        element.save(save_value)
+        entries.append((persistent_id(element.id), type(element).__name__, data))
+
+    entries.sort()
+    digest = md5(canvas_digest(diagram))
+    digest.update(repr(entries))
+    return digest.hexdigest()
+
+
+def load_elements(elements, factory, status_queue=None, lazy=False):
+    for status in load_elements_generator(elements, factory, lazy=lazy):
         if status_queue:
             status_queue(status)
 
-def load_elements_generator(elements, factory, gaphor_version=None):
+def load_elements_generator(elements, factory, gaphor_version=None, lazy=False):
     """
     Load a file and create a model if possible.
+    If lazy is True, the canvas items of the diagrams are not created
+    up front, but on first access of Diagram.canvas.
     Exceptions: IOError, ValueError.
     """
     # TODO: restructure loading code, first load model, then add canvas items
@@ -198,22 +335,19 @@ def load_elements_generator(elements, factory, gaphor_version=None):
     version_0_15_0_pre(elements, factory, gaphor_version)
     version_0_17_0(elements, factory, gaphor_version)
 
+    # Models older than 0.15 are updated after the canvas items are created
+    lazy = lazy and not version_lower_than(gaphor_version, (0, 14, 99))
+
+    # Ids of canvas items in diagrams that are loaded on demand:
+    deferred = set()
+    # Diagrams that are loaded on demand and their parsed canvas:
+    deferred_canvases = []
+
     #log.debug("Still have %d elements" % len(elements))
 
     # First create elements and canvas items in the factory
     # The elements are stored as attribute 'element' on the parser objects:
 
-    def create_canvasitems(canvas, canvasitems, parent=None):
-        """
-        Canvas is a read gaphas.Canvas, items is a list of parser.canvasitem's
-        """
-        for item in canvasitems:
-            cls = getattr(items, item.type)
-            item.element = diagram.create_as(cls, item.id)
-            canvas.add(item.element, parent=parent)
-            assert canvas.get_parent(item.element) is parent
-            create_canvasitems(canvas, item.canvasitems, parent=item.element)
-
     for id, elem in elements.items():
         st = update_status_queue()
         if st: yield st
@@ -221,12 +355,34 @@ def load_elements_generator(elements, factory, gaphor_version=None):
             cls = getattr(UML, elem.type)
             #log.debug('Creating UML element for %s (%s)' % (elem, elem.id))
             elem.element = factory.create_as(cls, id)
-            if elem.canvas:
+            if elem.canvas and lazy:
+                deferred.update(canvasitem_ids(elem.canvas.canvasitems))
+                elem.element.defer_canvas(canvas_loader(elem.canvas, factory))
+                deferred_canvases.append((elem.element, elem.canvas))
+            elif elem.canvas:
                 elem.element.canvas.block_updates = True
                 create_canvasitems(elem.element.canvas, elem.canvas.canvasitems)
         elif not isinstance(elem, parser.canvasitem):
             raise ValueError, 'Item with id "%s" and type %s can not be instantiated' % (id, type(elem))
 
+    if deferred:
+        # Deferred canvas items and references to them are left alone,
+        # the references are restored when the canvas items are created.
+        # The presentation of the elements shown on a deferred diagram is
+        # completed by loading the diagram as soon as it is used.
+        for d, canvas in deferred_canvases:
+            load_diagram = diagram_loader(d)
+            for refid in canvasitem_subject_ids(canvas.canvasitems):
+                ref = elements.get(refid)
+                if ref is not None and hasattr(ref, 'element'):
+                    factory.defer(ref.element, load_diagram)
+
+        loaded = odict()
+        for id, elem in elements.items():
+            if id not in deferred:
+                loaded[id] = elem
+        elements = loaded
+
     # load attributes and create references:
     for id, elem in elements.items():
         st = update_status_queue()
@@ -245,6 +401,8 @@ def load_elements_generator(elements, factory, gaphor_version=None):
         for name, refids in elem.references.items():
             if type(refids) == list:
                 for refid in refids:
+                    if refid in deferred:
+                        continue
                     try:
                         ref = elements[refid]
                     except:
@@ -255,6 +413,8 @@ def load_elements_generator(elements, factory, gaphor_version=None):
                         except:
                             log.error('Loading %s.%s with value %s failed' % (type(elem.element).__name__, name, ref.element.id))
                             raise
+            elif refids in deferred:
+                continue
             else:
                 try:
                     ref = elements[refids]
@@ -284,7 +444,7 @@ def load_elements_generator(elements, factory, gaphor_version=None):
     # Data model, loaded from file, is updated automatically, so there is
     # no need for special function.
 
-    for d in factory.select(lambda e: isinstance(e, UML.Diagram)):
+    for d in (d for d in factory.select_type(UML.Diagram) if d.canvas_loaded):
         # update_now() is implicitly called when lock is released
         d.canvas.block_updates = False
 
@@ -297,21 +457,147 @@ def load_elements_generator(elements, factory, gaphor_version=None):
     factory.notify_model()
 
 
-def load(filename, factory, status_queue=None):
+def create_canvasitems(canvas, canvasitems, parent=None):
+    """
+    Canvas is a read gaphas.Canvas, items is a list of parser.canvasitem's
+    """
+    for item in canvasitems:
+        cls = getattr(items, item.type)
+        item.element = diagram.create_as(cls, item.id)
+        canvas.add(item.element, parent=parent)
+        assert canvas.get_parent(item.element) is parent
+        create_canvasitems(canvas, item.canvasitems, parent=item.element)
+
+
+def canvasitem_ids(canvasitems):
+    """
+    Iterate the ids of the parser.canvasitem's and all their children.
+    """
+    for item in canvasitems:
+        yield item.id
+        for id in canvasitem_ids(item.canvasitems):
+            yield id
+
+
+def canvasitem_subject_ids(canvasitems):
+    """
+    Iterate the ids of the subjects of the parser.canvasitem's and all their
+    children. Each id is returned once.
+    """
+    seen = set()
+    stack = list(canvasitems)
+    while stack:
+        item = stack.pop()
+        refid = item.references.get('subject')
+        if refid and refid not in seen:
+            seen.add(refid)
+            yield refid
+        stack.extend(item.canvasitems)
+
+
+def diagram_loader(diagram):
+    """
+    Return a function that creates the canvas items of ``diagram``, if that
+    has not happened yet.
+    """
+    return lambda: diagram.canvas
+
+
+def canvas_loader(canvas_elem, factory):
+    """
+    Return a function that fills a diagram canvas with the canvas items
+    from parser.canvas canvas_elem. It is used as deferred canvas loader
+    for Diagram.defer_canvas(). References to model elements are looked up
+    in factory. References to elements that have been removed from the
+    model in the meantime are skipped. When the items are created, a
+    DiagramLoadedEvent is sent.
+    """
+    def load_canvas(canvas):
+        canvasitems = odict()
+        def collect(parent):
+            for item in parent.canvasitems:
+                canvasitems[item.id] = item
+                collect(item)
+        collect(canvas_elem)
+
+        def lookup(refid):
+            try:
+                return canvasitems[refid].element
+            except KeyError:
+                return factory.lookup(refid)
+
+        component_registry = get_component_registry()
+        if component_registry:
+            component_registry.register_subscription_adapter(ElementChangedEventBlocker)
+        try:
+            canvas.block_updates = True
+            create_canvasitems(canvas, canvas_elem.canvasitems)
+
+            for elem in canvasitems.values():
+                for name, value in elem.values.items():
+                    elem.element.load(name, value)
+                for name, refids in elem.references.items():
+                    if type(refids) != list:
+                        refids = [ refids ]
+                    for refid in refids:
+                        ref = lookup(refid)
+                        if ref is None:
+                            log.warning('Element %s referenced by %s.%s does not exist' % (refid, elem.type, name))
+                        else:
+                            elem.element.load(name, ref)
+
+            canvas.block_updates = False
+
+            for elem in canvasitems.values():
+                elem.element.postload()
+        finally:
+            if component_registry:
+                component_registry.unregister_subscription_adapter(ElementChangedEventBlocker)
+
+        # No change events have been sent for the new canvas items, so
+        # tell the interested parties (e.g. the element dispatcher)
+        if component_registry:
+            component_registry.handle(DiagramLoadedEvent(canvas.diagram))
+
+    return load_canvas
+
+
+def load_canvases(factory):
+    """
+    Create the canvas items of all diagrams that have been loaded lazily.
+    """
+    for d in factory.select_type(UML.Diagram):
+        d.canvas
+
+
+def get_component_registry():
+    """
+    Return the component registry, or None if the application is not
+    initialized.
+    """
+    try:
+        return Application.get_service('component_registry')
+    except NotInitializedError:
+        return None
+
+
+def load(filename, factory, status_queue=None, lazy=False):
     """
     Load a file and create a model if possible.
     Optionally, a status queue function can be given, to which the
     progress is written (as status_queue(progress)).
+    If lazy is True, diagram canvases are filled on first access.
     """
-    for status in load_generator(filename, factory):
+    for status in load_generator(filename, factory, lazy):
         if status_queue:
             status_queue(status)
 
-def load_generator(filename, factory):
+def load_generator(filename, factory, lazy=False):
     """
     Load a file and create a model if possible.
     This function is a generator. It will yield values from 0 to 100 (%)
     to indicate its progression.
+    If lazy is True, diagram canvases are filled on first access.
     """
     if isinstance(filename, (file, InputType)):
         log.info('Loading file from file descriptor')
@@ -320,7 +606,11 @@ def load_generator(filename, factory):
     try:
         # Use the incremental parser and yield the percentage of the file.
         loader = parser.GaphorLoader()
-        for percentage in parser.parse_generator(filename, loader):
+        if snapshot.is_snapshot(filename):
+            parse_generator = snapshot.parse_generator
+        else:
+            parse_generator = parser.parse_generator
+        for percentage in parse_generator(filename, loader):
             pass
             if percentage:
                 yield percentage / 2
@@ -334,10 +624,7 @@ def load_generator(filename, factory):
         log.error('File could no be parsed', exc_info=True)
         raise
 
-    try:
-        component_registry = Application.get_service('component_registry')
-    except NotInitializedError:
-        component_registry = None
+    component_registry = get_component_registry()
 
     try:
         factory.flush()
@@ -346,7 +633,7 @@ def load_generator(filename, factory):
         if component_registry:
             component_registry.register_subscription_adapter(ElementChangedEventBlocker)
         try:
-            for percentage in load_elements_generator(elements, factory, gaphor_version):
+            for percentage in load_elements_generator(elements, factory, gaphor_version, lazy):
                 if percentage:
                     yield percentage / 2 + 50
                 else:
@@ -0,0 +1,93 @@
+"""
+Unittest the GaphorLoader from the parser module.
+"""
+
+import unittest
+from cStringIO import StringIO
+from gaphor.storage import parser
+
+HEADER = '<?xml version="1.0" encoding="utf-8"?>\n' \
+         '<gaphor xmlns="http://gaphor.sourceforge.net/model" version="3.0"' \
+         ' gaphor-version="0.17.1">'
+FOOTER = '</gaphor>'
+
+
+class ParserTestCase(unittest.TestCase):
+
+    def create_parser(self, loader):
+        return parser.sax_parser(loader)
+
+    def parse(self, data, block_size=512):
+        loader = parser.GaphorLoader()
+        p = self.create_parser(loader)
+        data = HEADER + data + FOOTER
+        for i in xrange(0, len(data), block_size):
+            p.feed(data[i:i+block_size])
+        p.close()
+        return loader.elements
+
+    def test_parse_element(self):
+        elements = self.parse('<Class id="c1"><name><val>Foo</val></name>'
+                '<package><ref refid="p1"/></package></Class>'
+                '<Package id="p1"><ownedType><reflist><ref refid="c1"/>'
+                '</reflist></ownedType></Package>')
+        self.assertEquals(['c1', 'p1'], elements.keys())
+        c = elements['c1']
+        self.assertEquals('Class', c.type)
+        self.assertEquals('Foo', c.values['name'])
+        self.assertEquals('p1', c.references['package'])
+        self.assertEquals(['c1'], elements['p1'].references['ownedType'])
+
+    def test_value_split_over_blocks(self):
+        """
+        Text in a <val> tag may be delivered in chunks.
+        """
+        body = 'x' * 1000
+        elements = self.parse('<Comment id="c1"><body><val>%s</val></body>'
+                '</Comment>' % body, block_size=7)
+        self.assertEquals(body, elements['c1'].values['body'])
+
+    def test_empty_value(self):
+        elements = self.parse('<Comment id="c1"><body><val></val></body>'
+                '</Comment>')
+        self.assertEquals('', elements['c1'].values['body'])
+
+    def test_names_are_interned(self):
+        elements = self.parse('<Class id="c1"><name><val>a</val></name></Class>'
+                '<Class id="c2"><name><val>b</val></name></Class>')
+        n1 = elements['c1'].values.keys()[0]
+        n2 = elements['c2'].values.keys()[0]
+        self.assertTrue(n1 is n2)
+        self.assertTrue(elements['c1'].type is elements['c2'].type)
+
+    def test_duplicate_id(self):
+        self.assertRaises(AssertionError, self.parse,
+                '<Class id="c1"/><Class id="c1"/>')
+
+
+    def test_foreign_namespace(self):
+        elements = self.parse('<Class id="c1"><x:note xmlns:x="urn:other">'
+                'ignored</x:note><name><val>Foo</val></name></Class>')
+        self.assertEquals(['c1'], elements.keys())
+        self.assertEquals('Foo', elements['c1'].values['name'])
+
+
+class ExpatReaderTestCase(ParserTestCase):
+
+    def create_parser(self, loader):
+        return parser.ExpatReader(loader)
+
+    def test_parse_generator(self):
+        loader = parser.GaphorLoader()
+        f = StringIO(HEADER + '<Class id="c1"/>' + FOOTER)
+        progress = list(parser.parse_generator(f, loader))
+        self.assertEquals(100, progress[-1])
+        self.assertEquals(['c1'], loader.elements.keys())
+
+    def test_invalid_document(self):
+        loader = parser.GaphorLoader()
+        f = StringIO(HEADER + '<Class id="c1"><name>' + FOOTER)
+        self.assertRaises(Exception, list, parser.parse_generator(f, loader))
+
+
+# vim:sw=4:et:ai
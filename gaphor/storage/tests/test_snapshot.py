@@ -0,0 +1,194 @@
+"""
+Unittest the snapshot (binary model format) module.
+"""
+
+import os
+import os.path
+import tempfile
+import unittest
+from cStringIO import StringIO
+from gaphor.storage import parser, snapshot
+
+TEST_DIAGRAMS = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                             os.pardir, 'test-diagrams')
+
+HEADER = '<?xml version="1.0" encoding="utf-8"?>\n' \
+         '<gaphor xmlns="http://gaphor.sourceforge.net/model" version="3.0"' \
+         ' gaphor-version="0.17.1">'
+FOOTER = '</gaphor>'
+
+
+def dump(elements):
+    """Return the contents of loaded elements as comparable data.
+    """
+    def d(e):
+        if isinstance(e, parser.canvasitem):
+            items = e.canvasitems
+        else:
+            items = e.canvas and e.canvas.canvasitems
+        return (e.type, e.id, dict(e.values), dict(e.references),
+                items and [ d(i) for i in items ])
+    return [ d(e) for e in elements.values() if isinstance(e, parser.element) ]
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def to_snapshot(self, data):
+        out = StringIO()
+        snapshot.xml_to_snapshot(StringIO(data), out)
+        return out.getvalue()
+
+    def to_xml(self, data):
+        out = StringIO()
+        snapshot.snapshot_to_xml(StringIO(data), out)
+        return out.getvalue()
+
+    def test_is_snapshot(self):
+        data = HEADER + FOOTER
+        snap = self.to_snapshot(data)
+        assert snap.startswith(snapshot.MAGIC)
+        f = StringIO(snap)
+        assert snapshot.is_snapshot(f)
+        self.assertEquals(0, f.tell())
+        assert not snapshot.is_snapshot(StringIO(data))
+
+    def test_values(self):
+        data = HEADER + '<Class id="c1">' \
+                '<name><val>Foo &amp; Bar</val></name>' \
+                '<isAbstract><val>1</val></isAbstract>' \
+                '<a><val>-12</val></a><b><val>007</val></b>' \
+                '<c><val>99999999999</val></c><d><val></val></d>' \
+                '<e><val>0</val></e><f><val>\xc3\xa9t\xc3\xa9</val></f>' \
+                '<package><ref refid="p1"/></package></Class>' \
+                '<Package id="p1"><ownedType><reflist><ref refid="c1"/>' \
+                '</reflist></ownedType></Package>' + FOOTER
+        elements = snapshot.parse(StringIO(self.to_snapshot(data)))
+        c = elements['c1']
+        self.assertEquals('Foo & Bar', c.values['name'])
+        self.assertEquals('1', c.values['isAbstract'])
+        self.assertEquals('-12', c.values['a'])
+        self.assertEquals('007', c.values['b'])
+        self.assertEquals('99999999999', c.values['c'])
+        self.assertEquals('', c.values['d'])
+        self.assertEquals('0', c.values['e'])
+        self.assertEquals(u'\xe9t\xe9', c.values['f'])
+        self.assertEquals('p1', c.references['package'])
+        self.assertEquals(['c1'], elements['p1'].references['ownedType'])
+
+    def test_empty_reflist(self):
+        data = HEADER + '<Package id="p1"><ownedType><reflist>' \
+                '</reflist></ownedType></Package>' + FOOTER
+        elements = snapshot.parse(StringIO(self.to_snapshot(data)))
+        assert 'ownedType' not in elements['p1'].references
+
+    def test_parse_equals_xml(self):
+        for name in ('simple-items.gaphor', 'lifelines.gaphor', 'stereotype.gaphor'):
+            filename = os.path.join(TEST_DIAGRAMS, name)
+            with open(filename) as f:
+                data = f.read()
+            orig = parser.parse(StringIO(data))
+            copy = snapshot.parse(StringIO(self.to_snapshot(data)))
+            self.assertEquals(dump(orig), dump(copy), name)
+
+    def test_round_trip(self):
+        filename = os.path.join(TEST_DIAGRAMS, 'simple-items.gaphor')
+        with open(filename) as f:
+            data = f.read()
+        copy = self.to_xml(self.to_snapshot(data))
+        # Skip the <?xml ... ?> line, the encoding is written differently
+        self.assertEquals(data.split('\n', 1)[1], copy.split('\n', 1)[1])
+
+    def journal(self, data, deleted=()):
+        """Create a journal entry, data is sent to the writer as XML.
+        """
+        out = StringIO()
+        writer = snapshot.SnapshotWriter(out, journal=True)
+        p = parser.sax_parser(writer)
+        p.feed(HEADER)
+        for id in deleted:
+            writer.delete_element(id)
+        p.feed(data + FOOTER)
+        p.close()
+        return out.getvalue()
+
+    def test_journal(self):
+        base = self.to_snapshot(HEADER + '<Class id="c1">' \
+                '<name><val>Foo</val></name></Class>' \
+                '<Class id="c2"/>' \
+                '<Package id="p1"><ownedType><reflist><ref refid="c1"/>' \
+                '<ref refid="c2"/></reflist></ownedType></Package>' + FOOTER)
+        journal = self.journal('<Class id="c1"><name><val>Bar</val></name>' \
+                '</Class><Class id="c3"/>', deleted=['c2'])
+        elements = snapshot.parse(StringIO(base + journal))
+
+        self.assertEquals(['c1', 'p1', 'c3'], elements.keys())
+        self.assertEquals('Bar', elements['c1'].values['name'])
+        self.assertEquals(['c1'], elements['p1'].references['ownedType'])
+
+    def test_journal_diagram(self):
+        base = self.to_snapshot(HEADER + '<Diagram id="d1"><canvas>' \
+                '<item id="i1" type="ClassItem"><item id="i2" type="CommentItem"/>' \
+                '</item></canvas></Diagram>' + FOOTER)
+        journal = self.journal('<Diagram id="d1"><canvas>' \
+                '<item id="i3" type="ClassItem"/></canvas></Diagram>')
+        elements = snapshot.parse(StringIO(base + journal))
+
+        self.assertEquals(['d1', 'i3'], elements.keys())
+        self.assertEquals(['i3'], [ i.id for i in elements['d1'].canvas.canvasitems ])
+
+    def test_journal_replay(self):
+        orig = self.to_xml(self.to_snapshot(HEADER + '<Class id="c1"/>' \
+                '<Package id="p1"><ownedType><reflist><ref refid="c1"/>' \
+                '</reflist></ownedType></Package>' + FOOTER))
+        base = self.to_snapshot(HEADER + '<Class id="c1"/><Class id="c2"/>' \
+                '<Package id="p1"><ownedType><reflist><ref refid="c1"/>' \
+                '<ref refid="c2"/></reflist></ownedType></Package>' + FOOTER)
+        journal = self.journal('', deleted=['c2'])
+        self.assertEquals(orig, self.to_xml(base + journal))
+
+    def test_incomplete_journal(self):
+        base = self.to_snapshot(HEADER + '<Class id="c1"/>' + FOOTER)
+        journal = self.journal('<Class id="c2"/>')
+        elements = snapshot.parse(StringIO(base + journal[:-3]))
+        self.assertEquals(['c1'], elements.keys())
+
+    def segment_sizes(self, data):
+        fd, filename = tempfile.mkstemp(snapshot.EXTENSION)
+        try:
+            os.write(fd, data)
+            os.close(fd)
+            return snapshot.segment_sizes(filename)
+        finally:
+            os.remove(filename)
+
+    def test_segment_sizes(self):
+        base = self.to_snapshot(HEADER + '<Class id="c1"/>' + FOOTER)
+        journal = self.journal('<Class id="c2"/>')
+        sizes = self.segment_sizes(base + journal)
+        self.assertEquals(2, len(sizes))
+        self.assertEquals(len(base) + len(journal), len(snapshot.MAGIC) + 4 \
+                + sum(sizes) + 4 * len(sizes))
+
+    def test_segment_sizes_incomplete_journal(self):
+        """
+        Nothing can be appended after an incomplete journal entry: the
+        length of the incomplete entry would hide the new one.
+        """
+        base = self.to_snapshot(HEADER + '<Class id="c1"/>' + FOOTER)
+        journal = self.journal('<Class id="c2"/>')
+        elements = snapshot.parse(StringIO(base + journal[:-3]
+                                           + self.journal('<Class id="c3"/>')))
+        self.assertEquals(['c1'], elements.keys())
+
+        self.assertEquals([], self.segment_sizes(base + journal[:-3]))
+        self.assertEquals([], self.segment_sizes(base + journal[:2]))
+
+    def test_not_a_snapshot(self):
+        self.assertRaises(parser.ParserException, snapshot.parse,
+                          StringIO('GAPHOR, but not a snapshot'))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:sw=4:et:ai
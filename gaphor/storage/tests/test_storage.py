@@ -141,6 +141,191 @@ class StorageTestCase(TestCase):
         assert d1
         #print d1, d1.subject
 
+    def test_load_lazy(self):
+        """
+        Test loading diagrams on demand.
+        """
+        self.create(items.CommentItem, UML.Comment)
+        self.create(items.ClassItem, UML.Class)
+
+        data = self.save()
+        storage.load(StringIO(data), factory=self.element_factory, lazy=True)
+
+        d = self.element_factory.lselect(lambda e: e.isKindOf(UML.Diagram))[0]
+        c = self.element_factory.lselect(lambda e: e.isKindOf(UML.Class))[0]
+        assert not d.canvas_loaded
+        assert not c.presentation
+
+        assert len(d.canvas.get_all_items()) == 2
+        assert d.canvas_loaded
+        assert len(c.presentation) == 1
+        assert c.presentation[0].subject is c
+        assert c.presentation[0].canvas is d.canvas
+
+    def test_save_lazy(self):
+        """
+        Test saving a model of which the diagrams are not loaded yet.
+        """
+        self.create(items.CommentItem, UML.Comment)
+        self.create(items.ClassItem, UML.Class)
+
+        data = self.save()
+        storage.load(StringIO(data), factory=self.element_factory, lazy=True)
+        d = self.element_factory.lselect(lambda e: e.isKindOf(UML.Diagram))[0]
+        assert not d.canvas_loaded
+
+        self.assertEquals(data, self.save())
+
+    def test_flush_lazy(self):
+        """
+        Test flushing a model does not load the diagrams.
+        """
+        self.create(items.ClassItem, UML.Class)
+
+        data = self.save()
+        storage.load(StringIO(data), factory=self.element_factory, lazy=True)
+        d = self.element_factory.lselect(lambda e: e.isKindOf(UML.Diagram))[0]
+
+        self.element_factory.flush()
+        assert not d.canvas.get_all_items()
+
+    def test_delete_lazy(self):
+        """
+        Test deleting an item does not delete its subject if it's still
+        shown on a diagram that is not loaded yet.
+        """
+        c = self.element_factory.create(UML.Class)
+        self.create(items.ClassItem, subject=c)
+        other = self.element_factory.create(UML.Diagram)
+        other.create(items.ClassItem, subject=c)
+        ids = self.diagram.id, other.id, c.id
+
+        data = self.save()
+        storage.load(StringIO(data), factory=self.element_factory, lazy=True)
+        d1, d2, c = map(self.element_factory.lookup, ids)
+
+        item = d1.canvas.select(lambda e: isinstance(e, items.ClassItem))[0]
+        assert not d2.canvas_loaded
+        item.unlink()
+
+        assert self.element_factory.lookup(ids[2]) is c
+        assert d2.canvas_loaded
+        self.assertEquals(1, len(c.presentation))
+        assert c.presentation[0].canvas is d2.canvas
+
+    def test_watch_lazy(self):
+        """
+        Test items of a diagram that is loaded on demand follow changes of
+        their subject.
+        """
+        c = self.element_factory.create(UML.Class)
+        c.name = 'Foo'
+        self.create(items.ClassItem, subject=c)
+        ids = self.diagram.id, c.id
+
+        data = self.save()
+        storage.load(StringIO(data), factory=self.element_factory, lazy=True)
+        d, c = map(self.element_factory.lookup, ids)
+
+        item = d.canvas.select(lambda e: isinstance(e, items.ClassItem))[0]
+        self.assertEquals('Foo', item._name.text)
+        c.name = 'Bar'
+        self.assertEquals('Bar', item._name.text)
+
+    def test_save_journal(self):
+        """
+        Test appending changes to a snapshot.
+        """
+        from gaphor.storage.snapshot import SnapshotWriter
+
+        c1 = self.element_factory.create(UML.Class)
+        c2 = self.element_factory.create(UML.Class)
+        c1.name = 'Foo'
+
+        out = StringIO()
+        storage.save(SnapshotWriter(out), factory=self.element_factory)
+        self.element_factory.clear_changes()
+
+        c1.name = 'Bar'
+        c2.unlink()
+        c3 = self.element_factory.create(UML.Class)
+        changed = self.element_factory.changed_elements()
+        deleted = self.element_factory.deleted_elements()
+        self.assertEquals([c1, c3], changed)
+        self.assertEquals(set([c2.id]), deleted)
+
+        writer = SnapshotWriter(out, journal=True)
+        for status in storage.save_generator(writer, self.element_factory, changed, deleted):
+            pass
+
+        ids = (c1.id, c2.id, c3.id)
+        storage.load(StringIO(out.getvalue()), factory=self.element_factory)
+        c1, c2, c3 = map(self.element_factory.lookup, ids)
+        assert c1.name == 'Bar'
+        assert c2 is None
+        assert c3
+
+    def test_diagram_fingerprint(self):
+        diagram = self.element_factory.create(UML.Diagram)
+        package = self.element_factory.create(UML.Package)
+        package.name = 'pkg'
+        klass = self.element_factory.create(UML.Class)
+        klass.name = 'Foo'
+        klass.package = package
+        diagram.create(items.ClassItem, subject=klass)
+        fingerprint = storage.diagram_fingerprint(diagram)
+        assert fingerprint == storage.diagram_fingerprint(diagram)
+
+        # Elements not shown on the diagram do not matter
+        other = self.element_factory.create(UML.Class)
+        other.package = package
+        assert fingerprint == storage.diagram_fingerprint(diagram)
+
+        attr = self.element_factory.create(UML.Property)
+        attr.name = 'bar'
+        klass.ownedAttribute = attr
+        changed = storage.diagram_fingerprint(diagram)
+        assert fingerprint != changed
+
+        attr.name = 'baz'
+        assert changed != storage.diagram_fingerprint(diagram)
+
+        package.name = 'other'
+        assert changed != storage.diagram_fingerprint(diagram)
+
+        # Showing the class on another diagram does not matter
+        changed = storage.diagram_fingerprint(diagram)
+        other_diagram = self.element_factory.create(UML.Diagram)
+        other_diagram.create(items.ClassItem, subject=klass)
+        assert changed == storage.diagram_fingerprint(diagram)
+
+    def test_save_load_compact_ids(self):
+        """
+        Test saving and loading a model of a factory with compact ids.
+        """
+        from gaphor.UML.elementfactory import ElementFactoryService
+        factory = ElementFactoryService(compact_ids=True)
+        p = factory.create(UML.Package)
+        c = factory.create(UML.Class)
+        c.package = p
+        c.name = 'Foo'
+        assert isinstance(c.id, int)
+
+        out = PseudoFile()
+        storage.save(XMLWriter(out), factory=factory)
+        out.close()
+        pid = factory.persistent_id(c.id)
+        assert 'id="%s"' % pid in out.data
+        assert 'refid="%s"' % factory.persistent_id(p.id) in out.data
+
+        factory2 = ElementFactoryService(compact_ids=True)
+        storage.load(StringIO(out.data), factory=factory2)
+        c2 = factory2.lookup(pid)
+        assert isinstance(c2.id, int)
+        self.assertEquals('Foo', c2.name)
+        assert c2.package is factory2.lookup(factory.persistent_id(p.id))
+        self.assertEquals(pid, factory2.persistent_id(c2.id))
+
     def test_load_with_whitespace_name(self):
         difficult_name = '    with space before and after  '
         diagram = self.element_factory.lselect()[0]
@@ -285,6 +470,32 @@ class StorageTestCase(TestCase):
 
         self.assertEquals(copy, orig, 'Saved model does not match copy')
 
+    def test_load_save_snapshot(self):
+        
+        """Test saving and loading models in snapshot format"""
+        
+        from gaphor.storage.snapshot import SnapshotWriter
+        
+        dist = pkg_resources.get_distribution('gaphor')
+        path = os.path.join(dist.location, 'test-diagrams/simple-items.gaphor')
+        
+        with open(path, 'r') as ifile:
+            storage.load(ifile, factory=self.element_factory)
+
+        orig = PseudoFile()
+        storage.save(XMLWriter(orig), factory=self.element_factory)
+        
+        snap = StringIO()
+        storage.save(SnapshotWriter(snap), factory=self.element_factory)
+        self.element_factory.flush()
+
+        storage.load(StringIO(snap.getvalue()), factory=self.element_factory)
+        
+        copy = PseudoFile()
+        storage.save(XMLWriter(copy), factory=self.element_factory)
+
+        self.assertEquals(copy.data, orig.data, 'Snapshot does not match model')
+
 
 class FileUpgradeTestCase(TestCase):
     def test_association_upgrade(self):
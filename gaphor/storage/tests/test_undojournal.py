@@ -0,0 +1,127 @@
+"""
+Unittest the undo journal.
+"""
+
+import os
+import os.path
+import marshal
+import shutil
+import tempfile
+import unittest
+import zlib
+from gaphor.storage.undojournal import UndoJournal, fingerprint, LENGTH
+
+
+class UndoJournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.model = os.path.join(self.dir, 'model.gaphor')
+        self.filename = self.model + '.undo'
+        with open(self.model, 'w') as f:
+            f.write('<gaphor/>')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_push_pop(self):
+        journal = UndoJournal(self.filename)
+        assert not journal
+        journal.push([(1, 'id1', None, None)])
+        journal.push([(2, 'id2', 'name', u'value')])
+        assert 2 == len(journal)
+        assert [(2, 'id2', 'name', u'value')] == journal.pop()
+        journal.push(['three'])
+        assert ['three'] == journal.pop()
+        assert [(1, 'id1', None, None)] == journal.pop()
+        assert not journal
+        journal.close()
+
+    def test_close_removes_file(self):
+        journal = UndoJournal(self.filename)
+        journal.push(['one'])
+        journal.close()
+        assert not os.path.exists(self.filename)
+
+    def test_keep(self):
+        journal = UndoJournal(self.filename)
+        journal.push(['one'])
+        journal.push(['two'])
+        journal.fingerprint = fingerprint(self.model)
+        journal.close()
+        assert os.path.exists(self.filename)
+
+        journal = UndoJournal(self.filename, fingerprint(self.model))
+        assert 2 == len(journal)
+        assert fingerprint(self.model) == journal.fingerprint
+        assert ['two'] == journal.pop()
+        # The journal no longer matches the saved model
+        assert journal.fingerprint is None
+        journal.close()
+
+    def test_keep_other_model(self):
+        journal = UndoJournal(self.filename)
+        journal.push(['one'])
+        journal.fingerprint = fingerprint(self.model)
+        journal.close()
+
+        with open(self.model, 'w') as f:
+            f.write('<gaphor>changed</gaphor>')
+        journal = UndoJournal(self.filename, fingerprint(self.model))
+        assert not journal
+        journal.close()
+
+    def test_truncated_entry(self):
+        journal = UndoJournal(self.filename)
+        journal.push(['one'])
+        journal.push(['two'])
+        journal.fingerprint = fingerprint(self.model)
+        journal.close()
+        with open(self.filename, 'r+b') as f:
+            f.truncate(os.path.getsize(self.filename) - 2)
+
+        journal = UndoJournal(self.filename, fingerprint(self.model))
+        assert 1 == len(journal)
+        assert ['one'] == journal.pop()
+        journal.close()
+
+    def test_move(self):
+        journal = UndoJournal(self.filename)
+        journal.push(['one'])
+        other = os.path.join(self.dir, 'other.gaphor.undo')
+        journal.move(other)
+        assert not os.path.exists(self.filename)
+        assert other == journal.filename
+        assert ['one'] == journal.pop()
+        journal.close()
+
+    def test_plain_data(self):
+        journal = UndoJournal(self.filename)
+        entry = [(1, 'id1', None, (u'Class', {'name': u'x', 'isAbstract': True}))]
+        journal.push(entry)
+        assert entry == journal.pop()
+        self.assertRaises(ValueError, journal.push, [object()])
+        assert not journal
+        journal.close()
+
+    def test_code_is_not_loaded(self):
+        """
+        Only plain data is read, e.g. no code objects.
+        """
+        journal = UndoJournal(self.filename)
+        journal.push(['one'])
+        journal.fingerprint = fingerprint(self.model)
+        journal.close()
+        data = zlib.compress(marshal.dumps([compile('1', '<test>', 'eval')]))
+        with open(self.filename, 'ab') as f:
+            f.write(LENGTH.pack(len(data)))
+            f.write(data)
+
+        journal = UndoJournal(self.filename, fingerprint(self.model))
+        assert 2 == len(journal)
+        self.assertRaises(ValueError, journal.pop)
+        assert ['one'] == journal.pop()
+        journal.close()
+
+
+# vim:sw=4:et:ai
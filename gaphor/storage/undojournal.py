@@ -0,0 +1,231 @@
+"""Append-only journal for undo transactions.
+
+The undo manager keeps the most recent transactions in memory. Older
+transactions are moved to a journal file next to the model file and are read
+back when the user undoes that far. The journal is used as a stack: entries
+are appended to the end of the file and read (and removed) from the end.
+
+A journal starts with MAGIC and the fingerprint of the model file the
+entries apply to: the size and modification time (in milliseconds) of the
+model file, as two 64 bit little endian integers. A fingerprint of zeros
+means the journal does not belong to a saved model. The rest of the file
+consists of entries: a 32 bit little endian length followed by that many
+bytes of zlib compressed marshal data.
+
+An entry is plain data: None, numbers, strings and tuples, lists and
+dictionaries of those. The undo manager stores a list of undo records, with
+elements referred to by id. Entries are not pickled: a journal may come
+with a model from someone else, and reading it should not run any code.
+"""
+
+__all__ = [ 'UndoJournal', 'fingerprint', 'EXTENSION' ]
+
+import os
+import os.path
+import shutil
+import struct
+import zlib
+import marshal
+
+EXTENSION = '.undo'
+
+MAGIC = 'GAPUNDO2'
+
+# Types that can be stored in a journal entry
+PLAIN_TYPES = (type(None), bool, int, long, float, str, unicode)
+CONTAINER_TYPES = (tuple, list)
+
+HEADER = struct.Struct('<8sqq')
+LENGTH = struct.Struct('<I')
+
+NO_FINGERPRINT = (0, 0)
+
+
+def check_plain(value):
+    """
+    Raise ValueError if ``value`` is not plain data (see the module
+    documentation).
+    """
+    if isinstance(value, PLAIN_TYPES):
+        return
+    if isinstance(value, CONTAINER_TYPES):
+        for v in value:
+            check_plain(v)
+    elif isinstance(value, dict):
+        for k, v in value.iteritems():
+            check_plain(k)
+            check_plain(v)
+    else:
+        raise ValueError, 'Can not store %s in undo journal' % type(value).__name__
+
+
+def fingerprint(filename):
+    """
+    Return the fingerprint of model file ``filename``.
+    """
+    st = os.stat(filename)
+    return (st.st_size, int(st.st_mtime * 1000))
+
+
+class UndoJournal(object):
+    """
+    An undo journal, stored in file ``filename``.
+
+    If ``fingerprint`` is given and the file is a journal for the model file
+    with that fingerprint, the entries in the file are used. Otherwise the
+    journal starts empty.
+    """
+
+    def __init__(self, filename, fingerprint=None):
+        self.filename = filename
+        self._offsets = []
+        self._fingerprint = NO_FINGERPRINT
+        if fingerprint and os.path.exists(filename):
+            self._file = open(filename, 'r+b')
+            if self._read_header() == tuple(fingerprint):
+                self._fingerprint = tuple(fingerprint)
+                self._scan()
+                return
+        else:
+            self._file = open(filename, 'w+b')
+        self.clear()
+
+
+    def _read_header(self):
+        f = self._file
+        f.seek(0)
+        data = f.read(HEADER.size)
+        if len(data) < HEADER.size:
+            return None
+        magic, size, mtime = HEADER.unpack(data)
+        if magic != MAGIC:
+            return None
+        return (size, mtime)
+
+
+    def _write_header(self):
+        f = self._file
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, *self._fingerprint))
+        f.flush()
+
+
+    def _scan(self):
+        """
+        Find the offsets of the entries. An incomplete entry at the end of
+        the file (e.g. after a crash) is removed.
+        """
+        f = self._file
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        offset = HEADER.size
+        while offset + LENGTH.size <= end:
+            f.seek(offset)
+            length, = LENGTH.unpack(f.read(LENGTH.size))
+            if offset + LENGTH.size + length > end:
+                break
+            self._offsets.append(offset)
+            offset += LENGTH.size + length
+        if offset != end:
+            f.truncate(offset)
+        self._end = offset
+
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+    def get_fingerprint(self):
+        """
+        The fingerprint of the model file the journal belongs to, or None.
+        """
+        if self._fingerprint == NO_FINGERPRINT:
+            return None
+        return self._fingerprint
+
+    def set_fingerprint(self, fingerprint):
+        self._fingerprint = fingerprint and tuple(fingerprint) or NO_FINGERPRINT
+        self._write_header()
+
+    fingerprint = property(get_fingerprint, set_fingerprint)
+
+
+    def push(self, entry):
+        """
+        Append ``entry`` to the journal. The journal no longer belongs to a
+        saved model.
+        """
+        check_plain(entry)
+        if self._fingerprint != NO_FINGERPRINT:
+            self.fingerprint = None
+        data = zlib.compress(marshal.dumps(entry))
+        f = self._file
+        f.seek(self._end)
+        f.write(LENGTH.pack(len(data)))
+        f.write(data)
+        f.flush()
+        self._offsets.append(self._end)
+        self._end += LENGTH.size + len(data)
+
+
+    def pop(self):
+        """
+        Remove the last entry from the journal and return it. The journal no
+        longer belongs to a saved model. ValueError is raised if the entry
+        is not valid.
+        """
+        if self._fingerprint != NO_FINGERPRINT:
+            self.fingerprint = None
+        offset = self._offsets.pop()
+        f = self._file
+        f.seek(offset)
+        length, = LENGTH.unpack(f.read(LENGTH.size))
+        data = f.read(length)
+        f.truncate(offset)
+        self._end = offset
+        try:
+            entry = marshal.loads(zlib.decompress(data))
+        except (zlib.error, EOFError, TypeError), e:
+            raise ValueError, 'Invalid undo journal entry: %s' % e
+        check_plain(entry)
+        return entry
+
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        del self._offsets[:]
+        self._fingerprint = NO_FINGERPRINT
+        self._file.truncate(0)
+        self._write_header()
+        self._end = HEADER.size
+
+
+    def move(self, filename):
+        """
+        Move the journal to file ``filename``, e.g. when the model is saved
+        under another name.
+        """
+        self._file.flush()
+        shutil.copyfile(self.filename, filename)
+        self.close()
+        self.filename = filename
+        self._file = open(filename, 'r+b')
+        self.fingerprint = None
+
+
+    def close(self):
+        """
+        Close the journal. The file is removed, unless the journal belongs to
+        a saved model.
+        """
+        self._file.close()
+        if self._fingerprint == NO_FINGERPRINT:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+
+# vim:sw=4:et:ai
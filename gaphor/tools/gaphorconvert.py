@@ -1,18 +1,16 @@
 #!/usr/bin/python
 
 import gaphor
-from gaphor.storage import storage
+from gaphor.storage import storage, snapshot
 import gaphor.UML as UML
-
-from gaphas.painter import ItemPainter
-from gaphas.view import View
-
-import cairo
+from gaphor.application import Application
+from gaphor.diagram.export import BatchExporter, RenderManifest
 
 import optparse
 import os
 import re
 import sys
+import time
 
 def pkg2dir(package):
     """
@@ -45,33 +43,55 @@ parser.add_option('-u', '--use-underscores', dest='underscores', action='store_t
 parser.add_option('-d', '--dir', dest='dir', metavar='directory',
     help='output to directory')
 parser.add_option('-f', '--format', dest='format', metavar='format',
-    help='output file format, default pdf', default='pdf',
-    choices=['pdf', 'svg', 'png'])
+    help='output file format, default pdf; gaphor and gaphorb convert' \
+    ' the model file itself to XML or binary snapshot format',
+    default='pdf', choices=['pdf', 'svg', 'png', 'gaphor', 'gaphorb'])
 parser.add_option('-r', '--regex', dest='regex', metavar='regex',
     help='process diagrams which name matches given regular expresion;' \
     ' name includes package name; regular expressions are case insensitive')
+parser.add_option('-j', '--jobs', dest='jobs', metavar='jobs', type='int',
+    help='number of diagrams rendered in parallel, default is the number' \
+    ' of processors')
+parser.add_option('-t', '--timeout', dest='timeout', metavar='seconds',
+    type='float', help='maximum time to render a diagram')
+parser.add_option('--force', dest='force', action='store_true',
+    help='render all diagrams, also the ones that did not change since' \
+    ' the last run')
 
-(options, args) = parser.parse_args()
-
-if not args:
-    parser.print_help()
-    sys.exit(1)
+options = None
 
-
-factory = UML.ElementFactory()
+name_re = None
 
 
-name_re = None
-if options.regex:
-    name_re = re.compile(options.regex, re.I)
+def convert_model(model):
+    """
+    Convert model file between XML and binary snapshot format. The
+    conversion is lossless, no UML model is built.
+    """
+    if snapshot.is_snapshot(model) == (options.format == 'gaphorb'):
+        message('skipping %s, already in %s format' % (model, options.format))
+        return
+
+    base = os.path.splitext(model)[0]
+    if options.dir:
+        base = os.path.join(options.dir, os.path.basename(base))
+    outfilename = '%s.%s' % (base, options.format)
+
+    message('converting: %s -> %s...' % (model, outfilename))
+    with open(outfilename, 'wb') as out:
+        if options.format == 'gaphorb':
+            snapshot.xml_to_snapshot(model, out)
+        else:
+            snapshot.snapshot_to_xml(model, out)
 
-# we should have some gaphor files to be processed at this point
-for model in args:
-    message('loading model %s' % model)
-    storage.load(model, factory)
-    message('\nready for rendering\n')
 
-    for diagram in factory.select(lambda e: e.isKindOf(UML.Diagram)):
+def export_jobs(factory):
+    """
+    Return the (diagram, output file name, format) tuples for the diagrams
+    to render.
+    """
+    jobs = []
+    for diagram in factory.select_type(UML.Diagram):
         odir = pkg2dir(diagram.package)
 
         # just diagram name
@@ -91,43 +111,85 @@ for model in args:
             odir = '%s/%s' % (options.dir, odir)
 
         outfilename = '%s/%s.%s' % (odir, dname, options.format)
+        jobs.append((diagram, outfilename, options.format))
+    return jobs
 
-        if not os.path.exists(odir):
-            message('creating dir %s' % odir)
-            os.makedirs(odir)
 
-        message('rendering: %s -> %s...' % (pname, outfilename))
-
-        view = View(diagram.canvas)
-        view.painter = ItemPainter()
+def render_model(model):
+    """
+    Render the diagrams of a model. The model is loaded once, diagrams are
+    rendered in parallel. Diagrams that did not change since they were
+    last rendered (according to the render manifest in the output
+    directory) are skipped. Returns the number of diagrams that could not
+    be rendered.
+    """
+    factory = UML.ElementFactory()
 
-        tmpsurface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 0, 0)
-        tmpcr = cairo.Context(tmpsurface)
-        view.update_bounding_box(tmpcr)
-        tmpcr.show_page()
-        tmpsurface.flush()
+    message('loading model %s' % model)
+    storage.load(model, factory, lazy=True)
+    message('\nready for rendering\n')
 
-        w, h = view.bounding_box.width, view.bounding_box.height
-        if options.format == 'pdf':
-            surface = cairo.PDFSurface(outfilename, w, h)
-        elif options.format == 'svg':
-            surface = cairo.SVGSurface(outfilename, w, h)
-        elif options.format == 'png':
-            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, int(w+1), int(h+1))
+    manifest = RenderManifest(os.path.join(options.dir or '.',
+                                           RenderManifest.FILENAME),
+                              Application.distribution.version)
+    # Fingerprints are computed before the workers are forked
+    fingerprints = {}
+    jobs = []
+    for job in export_jobs(factory):
+        diagram, outfilename, format = job
+        fingerprint = storage.diagram_fingerprint(diagram)
+        if not options.force and manifest.is_current(outfilename, fingerprint):
+            message('unchanged: %s' % outfilename)
+            continue
+        fingerprints[outfilename] = fingerprint
+        jobs.append(job)
+
+    exporter = BatchExporter(factory, processes=options.jobs,
+                             timeout=options.timeout)
+    failed = 0
+    start = time.time()
+    for result in exporter.export(jobs):
+        if result.ok:
+            message('rendered: %s (%.3fs)' % (result.filename, result.time))
+            manifest.update(result.filename, fingerprints[result.filename])
+        else:
+            manifest.discard(result.filename)
+            failed += 1
+            print >> sys.stderr, 'failed: %s (%.3fs): %s' % (result.filename,
+                    result.time, result.error)
+    message('rendered %d diagrams in %.3fs' % (len(jobs) - failed,
+            time.time() - start))
+    if jobs:
+        manifest.save()
+    return failed
+
+
+def main(args=None):
+    global options, name_re
+
+    (options, args) = parser.parse_args(args)
+
+    if not args:
+        parser.print_help()
+        sys.exit(1)
+
+    name_re = None
+    if options.regex:
+        name_re = re.compile(options.regex, re.I)
+
+    failed = 0
+    # we should have some gaphor files to be processed at this point
+    for model in args:
+        if options.format in ('gaphor', 'gaphorb'):
+            convert_model(model)
         else:
-            assert False, 'unknown format %s' % options.format
-        cr = cairo.Context(surface)
-        view.matrix.translate(-view.bounding_box.x, -view.bounding_box.y)
-        view.paint(cr)
-        cr.show_page()
+            failed += render_model(model)
 
-        if options.format == 'png':
-            surface.write_to_png(outfilename)
+    if failed:
+        sys.exit(2)
 
-        surface.flush()
-        surface.finish()
 
-def main():
-    pass
+if __name__ == '__main__':
+    main()
 
 # vim:sw=4:et:ai
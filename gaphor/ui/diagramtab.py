@@ -2,7 +2,6 @@
 
 import gtk
 from cairo import Matrix
-from zope import component
 from etk.docking import DockItem
 
 from gaphas.view import GtkView
@@ -24,6 +23,7 @@ from gaphor.services.properties import IPropertyChangeEvent
 class DiagramTab(object):
     
     component_registry = inject('component_registry')
+    event_bus = inject('event_bus')
     element_factory = inject('element_factory')
     action_manager = inject('action_manager')
 
@@ -74,8 +74,11 @@ class DiagramTab(object):
         #self.owning_window = owning_window
         self.action_group = build_action_group(self)
         self.toolbox = None
-        self.component_registry.register_handler(self._on_element_change)
-        self.component_registry.register_handler(self._on_element_delete)
+        self.event_bus.subscribe(self._on_element_change,
+                IAttributeChangeEvent, property=UML.Diagram.name,
+                element=diagram, coalesce=True)
+        self.event_bus.subscribe(self._on_element_delete,
+                IElementDeleteEvent, element=diagram)
 
     title = property(lambda s: s.diagram and s.diagram.name or _('<None>'))
 
@@ -124,14 +127,10 @@ class DiagramTab(object):
         return item
 
 
-    @component.adapter(IAttributeChangeEvent)
-    def _on_element_change(self, event):
-        if event.element is self.diagram and \
-                event.property is UML.Diagram.name:
-           self.widget.title = self.title
+    def _on_element_change(self, summary):
+        self.widget.title = self.title
 
 
-    @component.adapter(IElementDeleteEvent)
     def _on_element_delete(self, event):
         if event.element is self.diagram:
             self.close()
@@ -144,8 +143,11 @@ class DiagramTab(object):
         be done if File->Close was pressed.
         """
         self.widget.destroy()
-        self.component_registry.unregister_handler(self._on_element_delete)
-        self.component_registry.unregister_handler(self._on_element_change)
+        self.event_bus.unsubscribe(self._on_element_delete,
+                IElementDeleteEvent, element=self.diagram)
+        self.event_bus.unsubscribe(self._on_element_change,
+                IAttributeChangeEvent, property=UML.Diagram.name,
+                element=self.diagram, coalesce=True)
         self.view = None
 
 
@@ -16,6 +16,7 @@ from etk.docking.docklayout import add_new_group_floating
 
 from gaphor import UML
 from gaphor.core import _, inject, action, toggle_action, open_action, build_action_group, transactional
+from gaphor.transaction import Transaction
 from namespace import NamespaceModel, NamespaceView
 from diagramtab import DiagramTab
 from toolbox import Toolbox as _Toolbox
@@ -27,6 +28,8 @@ from layout import deserialize
 from interfaces import IDiagramTabChange
 from gaphor.interfaces import IServiceEvent, IActionExecutedEvent
 from gaphor.UML.event import ModelFactoryEvent
+from gaphor.diagram import textelement
+from gaphor.diagram.textelement import LAYOUT_CACHE_SIZE
 from event import DiagramTabChange, DiagramSelectionChange
 from gaphor.services.filemanager import FileManagerStateChanged
 from gaphor.services.undomanager import UndoManagerStateChanged
@@ -141,6 +144,8 @@ class MainWindow(object):
 
     def init(self, app=None):
         #self.init_pygtk()
+        textelement.layout_cache.size = \
+                self.properties.get('diagram.layout-cache-size', LAYOUT_CACHE_SIZE)
         self.init_stock_icons()
         self.init_action_group()
         self.init_ui_components()
@@ -420,7 +425,7 @@ class MainWindow(object):
         Open the toplevel element and load toplevel diagrams.
         """
         # TODO: Make handlers for ModelFactoryEvent from within the GUI obj
-        for diagram in self.element_factory.select(lambda e: e.isKindOf(UML.Diagram) and not (e.namespace and e.namespace.namespace)):
+        for diagram in (d for d in self.element_factory.select_type(UML.Diagram) if not (d.namespace and d.namespace.namespace)):
             self.show_diagram(diagram)
     
 
@@ -747,17 +752,18 @@ class Namespace(object):
 
 
     @action(name='tree-view-create-diagram', label=_('_New diagram'), stock_id='gaphor-diagram')
-    @transactional
     def tree_view_create_diagram(self):
         element = self._namespace.get_selected_element()
-        diagram = self.element_factory.create(UML.Diagram)
-        diagram.package = element
+        with Transaction():
+            diagram = self.element_factory.create(UML.Diagram)
+            diagram.package = element
 
-        if element:
-            diagram.name = '%s diagram' % element.name
-        else:
-            diagram.name = 'New diagram'
+            if element:
+                diagram.name = '%s diagram' % element.name
+            else:
+                diagram.name = 'New diagram'
 
+        # The namespace view shows the diagram once the transaction is done
         self.select_element(diagram)
         self.main_window.show_diagram(diagram)
         self.tree_view_rename_selected()
@@ -784,16 +790,16 @@ class Namespace(object):
 
 
     @action(name='tree-view-create-package', label=_('New _package'), stock_id='gaphor-package')
-    @transactional
     def tree_view_create_package(self):
         element = self._namespace.get_selected_element()
-        package = self.element_factory.create(UML.Package)
-        package.package = element
+        with Transaction():
+            package = self.element_factory.create(UML.Package)
+            package.package = element
 
-        if element:
-            package.name = '%s package' % element.name
-        else:
-            package.name = 'New model'
+            if element:
+                package.name = '%s package' % element.name
+            else:
+                package.name = 'New model'
 
         self.select_element(package)
         self.tree_view_rename_selected()
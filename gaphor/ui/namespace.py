@@ -4,6 +4,7 @@ in Rational Rose). This is a tree based on namespace relationships. As
 a result only classifiers are shown here.
 """
 
+import bisect
 import gobject
 import gtk
 import operator
@@ -13,7 +14,7 @@ from zope import component
 
 from gaphor.core import inject
 from gaphor import UML
-from gaphor.UML.event import ElementCreateEvent, ModelFactoryEvent, FlushFactoryEvent, DerivedSetEvent
+from gaphor.UML.event import ElementCreateEvent, ModelFactoryEvent, FlushFactoryEvent, DerivedSetEvent, DerivedExtendEvent
 from gaphor.UML.interfaces import IAttributeChangeEvent, IElementDeleteEvent
 from gaphor.transaction import Transaction
 from iconoption import get_icon_option
@@ -66,10 +67,13 @@ class NamespaceModel(gtk.GenericTreeModel):
     NamedElement.namespace[1] -- Namespace.ownedMember[*]
 
     NOTE: when a model is loaded no IAssociation*Event's are emitted.
-    
+
+    The tree is updated when a transaction is committed. Until then it
+    shows the model as it was at the start of the transaction.
     """
 
     component_registry = inject('component_registry')
+    event_bus = inject('event_bus')
 
     def __init__(self, factory):
         # Init parent:
@@ -82,15 +86,16 @@ class NamespaceModel(gtk.GenericTreeModel):
 
         self._nodes = { None: [] }
 
+        # The parent of each element in the tree
+        self._parents = {}
+
         self.filter = _default_filter_list
 
         cr = self.component_registry
         cr.register_handler(self.flush)
         cr.register_handler(self.refresh)
-        cr.register_handler(self._on_element_change)
-        cr.register_handler(self._on_element_create)
-        cr.register_handler(self._on_element_delete)
-        cr.register_handler(self._on_association_set)
+        for subscription in self._subscriptions():
+            self.event_bus.subscribe(*subscription)
 
         self._build_model()
 
@@ -102,22 +107,40 @@ class NamespaceModel(gtk.GenericTreeModel):
         cr = self.component_registry
         cr.unregister_handler(self.flush)
         cr.unregister_handler(self.refresh)
-        cr.unregister_handler(self._on_element_change)
-        cr.unregister_handler(self._on_element_create)
-        cr.unregister_handler(self._on_element_delete)
-        cr.unregister_handler(self._on_association_set)
+        for subscription in self._subscriptions():
+            self.event_bus.unsubscribe(*subscription)
+
+
+    def _subscriptions(self):
+        """
+        The (handler, event kind, property, element, coalesce) subscriptions
+        on the event bus.
+        """
+        return (
+            (self._on_element_change, IAttributeChangeEvent, UML.NamedElement.name, None, True),
+            (self._on_element_change, IAttributeChangeEvent, UML.Classifier.isAbstract, None, True),
+            (self._on_element_change, IAttributeChangeEvent, UML.BehavioralFeature.isAbstract, None, True),
+            (self._on_structure_change, ElementCreateEvent, None, None, True),
+            (self._on_structure_change, IElementDeleteEvent, None, None, True),
+            (self._on_structure_change, DerivedSetEvent, UML.NamedElement.namespace, None, True),
+            (self._on_structure_change, DerivedExtendEvent, UML.Namespace.ownedMember, None, True))
 
 
     def path_from_element(self, e):
-        if e:
-            ns = e.namespace
-            n = self._nodes.get(ns)
-            if n:
-                return self.path_from_element(ns) + (n.index(e),)
-            else:
-                return ()
-        else:
+        """
+        Get the path of an element in the tree. The path is based on the
+        tree itself, which is only updated when a transaction is
+        committed. An empty tuple is returned if the element is not shown.
+        """
+        path = ()
+        parents = self._parents
+        while e in parents:
+            ns = parents[e]
+            path = (self._nodes[ns].index(e),) + path
+            e = ns
+        if e is not None:
             return ()
+        return path
 
 
     def element_from_path(self, path):
@@ -134,34 +157,30 @@ class NamespaceModel(gtk.GenericTreeModel):
             return None
 
 
-    @component.adapter(IAttributeChangeEvent)
     @catchall
-    def _on_element_change(self, event):
+    def _on_element_change(self, summary):
         """
-        Element changed, update appropriate row.
+        Element changed, update appropriate row. The changes made during a
+        transaction are received at once (an ElementChangeSummary).
         """
-        element = event.element
+        element = summary.element
         if element not in self._nodes:
             return
 
-        if event.property is UML.Classifier.isAbstract or \
-                event.property is UML.BehavioralFeature.isAbstract:
+        properties = summary.properties
+        if UML.Classifier.isAbstract in properties or \
+                UML.BehavioralFeature.isAbstract in properties:
             path = self.path_from_element(element)
             if path:
                 self.row_changed(path, self.get_iter(path))
 
-        if event.property is UML.NamedElement.name:
-            try:
-                path = self.path_from_element(element)
-            except KeyError:
-                # Element not visible in the tree view
-                return
-
+        if UML.NamedElement.name in properties:
+            path = self.path_from_element(element)
             if not path:
                 return
             self.row_changed(path, self.get_iter(path))
-            parent_nodes = self._nodes[element.namespace]
-            parent_path = self.path_from_element(element.namespace)
+            parent_nodes = self._nodes[self._parents[element]]
+            parent_path = self.path_from_element(self._parents[element])
             if not parent_path:
                 return
 
@@ -184,10 +203,16 @@ class NamespaceModel(gtk.GenericTreeModel):
         if element.namespace not in self._nodes:
             return
 
+        if element in self._parents:
+            # Moved here from another namespace
+            self._remove_row(element)
+
         self._nodes.setdefault(element, [])
+        self._parents[element] = element.namespace
         parent = self._nodes[element.namespace]
-        parent.append(element)
-        parent.sort(key=_tree_sorter)
+        # Insert in order, without moving the other rows
+        keys = map(_tree_sorter, parent)
+        parent.insert(bisect.bisect(keys, _tree_sorter(element)), element)
         path = self.path_from_element(element)
         self.row_inserted(path, self.get_iter(path))
 
@@ -209,91 +234,69 @@ class NamespaceModel(gtk.GenericTreeModel):
                 remove(c)
             try:
                 del self._nodes[n]
+                del self._parents[n]
             except KeyError:
                 pass
 
         remove(element)
 
 
-    @component.adapter(ElementCreateEvent)
-    @catchall
-    def _on_element_create(self, event):
-        element = event.element
-        if event.service is self.factory:
-            self._add_elements(element)
-
-
-    @component.adapter(IElementDeleteEvent)
-    @catchall
-    def _on_element_delete(self, event):
-        element = event.element
-
-        #log.debug('Namespace received deleting element %s' % element)
-
-        if event.service is self.factory and \
-                type(element) in self.filter:
-            path = self.path_from_element(element)
-
-            #log.debug('Deleting element %s from path %s' % (element, path))
-
-            # Remove all sub-elements:
-            if path:
-                self.row_deleted(path)
-                if path[:-1]:
-                    self.row_has_child_toggled(path[:-1], self.get_iter(path[:-1]))
-            self._remove_element(element)
+    def _remove_row(self, element):
+        """
+        Remove the row of an element, and with it the rows of its members.
+        """
+        path = self.path_from_element(element)
+        self._nodes[self._parents[element]].remove(element)
+        self._remove_element(element)
+        self.row_deleted(path)
+        if path[:-1]:
+            self.row_has_child_toggled(path[:-1], self.get_iter(path[:-1]))
 
-            parent_node = self._nodes.get(element.namespace)
-            if parent_node:
-                parent_node.remove(element)
 
-#            if path and parent_node and len(self._nodes[parent_node]) == 0:
-#                self.row_has_child_toggled(path[:-1], self.get_iter(path[:-1]))
+    def _is_outdated(self, element):
+        """
+        Is the element's row no longer in line with the model: the element
+        is deleted or it moved to another namespace.
+        """
+        return element not in self.factory \
+                or element.namespace is not self._parents[element]
 
 
-    @component.adapter(DerivedSetEvent)
     @catchall
-    def _on_association_set(self, event):
-
-        element = event.element
-        if type(element) not in self.filter:
-            return
-
-        if event.property is UML.NamedElement.namespace:
-            # Check if the element is actually in the element factory:
-            if element not in self.factory:
+    def _on_structure_change(self, summary):
+        """
+        Elements have been created, deleted or moved to another namespace.
+        The changes made during a transaction are received at once (an
+        ElementChangeSummary), one per element. The tree is brought in line
+        with the model as it is when the transaction is committed.
+
+        If an owner of the element is deleted or moved too, the owner's row
+        is updated and the rows of all its members go with it. Deleting a
+        class with many members this way results in one row update.
+        """
+        element = summary.element
+        if element in self._parents:
+            top = element
+            parent = self._parents[element]
+            while parent is not None and self._is_outdated(parent):
+                top = parent
+                parent = self._parents[parent]
+
+            if top is element and not self._is_outdated(element):
+                # Members may have been added to the namespace (extend)
+                if isinstance(element, UML.Namespace):
+                    for e in element.ownedMember:
+                        if e.namespace is element and e not in self._nodes \
+                                and e in self.factory:
+                            self._add_elements(e)
                 return
 
-            old_value, new_value = event.old_value, event.new_value
+            self._remove_row(top)
+            if top in self.factory:
+                self._add_elements(top)
 
-            # Remove entry from old place
-            if self._nodes.has_key(old_value):
-                try:
-                    path = self.path_from_element(old_value) + (self._nodes[old_value].index(element),)
-                except ValueError:
-                    log.error('Unable to create path for element %s and old_value %s' % (element, self._nodes[old_value]))
-                else:
-                    self._nodes[old_value].remove(element)
-                    self.row_deleted(path)
-                    path = path[:-1] #self.path_from_element(old_value)
-                    if path:
-                        self.row_has_child_toggled(path, self.get_iter(path))
-
-            # Add to new place. This may fail if the type of the new place is
-            # not in the tree model (because it's filtered)
-            log.debug('Trying to add %s to %s' % (element, new_value))
-            if self._nodes.has_key(new_value):
-                if self._nodes.has_key(element):
-                    parent = self._nodes[new_value]
-                    parent.append(element)
-                    parent.sort(key=_tree_sorter)
-                    path = self.path_from_element(element)
-                    self.row_inserted(path, self.get_iter(path))
-                else:
-                    self._add_elements(element)
-            elif self._nodes.has_key(element):
-                # Non-existent: remove entirely
-                self._remove_element(element)
+        if element not in self._nodes and element in self.factory:
+            self._add_elements(element)
 
 
     @component.adapter(ModelFactoryEvent)
@@ -307,10 +310,11 @@ class NamespaceModel(gtk.GenericTreeModel):
         for n in self._nodes[None]:
             self.row_deleted((0,))
         self._nodes = {None: []}
+        self._parents = {}
 
 
     def _build_model(self):
-        toplevel = self.factory.select(lambda e: isinstance(e, UML.Namespace) and not e.namespace)
+        toplevel = (n for n in self.factory.select_type(UML.Namespace) if not n.namespace)
 
         for element in toplevel:
             self._add_elements(element)
@@ -370,10 +374,10 @@ class NamespaceModel(gtk.GenericTreeModel):
         next element.
         """
         try:
-            parent = self._nodes[node.namespace]
+            parent = self._nodes[self._parents[node]]
             index = parent.index(node)
             return parent[index + 1]
-        except (IndexError, ValueError), e:
+        except (IndexError, ValueError, KeyError), e:
             return None
 
         
@@ -417,7 +421,7 @@ class NamespaceModel(gtk.GenericTreeModel):
         """
         Returns the parent of this node or None if no parent
         """
-        return node.namespace
+        return self._parents.get(node)
 
 
     # TreeDragDest
@@ -573,7 +577,7 @@ class NamespaceView(gtk.TreeView):
             p = p if p else ''
             # 'id#stereotype' is being send
             if info == NamespaceView.TARGET_ELEMENT_ID:
-                selection_data.set(selection_data.target, 8, '%s#%s' % (element.id, p))
+                selection_data.set(selection_data.target, 8, '%s#%s' % (self.factory.persistent_id(element.id), p))
             else:
                 selection_data.set(selection_data.target, 8, '%s#%s' % (element.name, p))
         return True
@@ -4,6 +4,7 @@ from gaphor.tests.testcase import TestCase
 import gaphor.UML as UML
 from gaphor.ui.namespace import NamespaceModel
 from gaphor.application import Application
+from gaphor.transaction import Transaction
 
 class NamespaceTestCase(object): ##TestCase):
 
@@ -179,6 +180,43 @@ class NewNamespaceTestCase(TestCase):
         assert c not in ns._nodes[a]
 
 
+    def test_transaction(self):
+        """
+        The tree is updated when the transaction is committed.
+        """
+        factory = Application.get_service('element_factory')
+
+        ns = NamespaceModel(factory)
+
+        m = factory.create(UML.Package)
+        m.name = 'm'
+        a = factory.create(UML.Package)
+        a.name = 'a'
+        a.package = m
+
+        with Transaction():
+            c = factory.create(UML.Class)
+            c.name = 'c'
+            c.package = m
+            for i in range(20):
+                p = factory.create(UML.Property)
+                p.name = 'p%d' % i
+                c.ownedAttribute = p
+            assert c not in ns._nodes
+        assert ns.path_from_element(c) == (0, 1)
+        assert len(ns._nodes[c]) == 20
+
+        deleted = []
+        ns.connect('row-deleted', lambda model, path: deleted.append(path))
+        with Transaction():
+            c.package = a
+            c.unlink()
+        assert deleted == [(0, 1)], deleted
+        assert c not in ns._nodes
+        assert p not in ns._nodes
+        assert ns._nodes[m] == [a]
+
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
@@ -100,6 +100,7 @@ It uses the GTK+ environment for user interaction.
         ],
         'gaphor.services': [
             'component_registry = gaphor.services.componentregistry:ZopeComponentRegistry',
+            'event_bus = gaphor.services.eventbus:EventBus',
             #'event_dispatcher = gaphor.services.eventdispatcher:EventDispatcher',
             'adapter_loader = gaphor.services.adapterloader:AdapterLoader',
             'properties = gaphor.services.properties:Properties',
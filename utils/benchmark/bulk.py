@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark adding many values to an association at once
+(gaphor.UML.properties).
+
+A class is given a number of attributes, once by assigning them one by one
+and once with collection.extend(), that sends one event for all values
+(the opposite ends still send an event per value). The time needed is
+printed.
+
+This can be called as:
+    python utils/benchmark/bulk.py [values]
+
+This file is part of Gaphor.
+"""
+
+import sys
+import time
+
+try:
+    import env
+except ImportError:
+    pass
+
+from gaphor import UML
+
+VALUES = 10000
+
+
+def one_by_one(n):
+    factory = UML.ElementFactory()
+    c = factory.create(UML.Class)
+    attributes = [ factory.create(UML.Property) for i in xrange(n) ]
+    start = time.time()
+    for a in attributes:
+        c.ownedAttribute = a
+    t = time.time() - start
+    assert len(c.ownedAttribute) == n and len(c.ownedMember) == n
+    return t
+
+
+def extend(n):
+    factory = UML.ElementFactory()
+    c = factory.create(UML.Class)
+    attributes = [ factory.create(UML.Property) for i in xrange(n) ]
+    start = time.time()
+    c.ownedAttribute.extend(attributes)
+    t = time.time() - start
+    assert len(c.ownedAttribute) == n and len(c.ownedMember) == n
+    assert attributes[-1].namespace is c
+    return t
+
+
+def main(args):
+    n = int(args[0]) if args else VALUES
+    print '%-20s %10s %10s' % ('method', 'values', 'time (s)')
+    old = one_by_one(n)
+    print '%-20s %10d %10.3f' % ('one by one', n, old)
+    new = extend(n)
+    print '%-20s %10d %10.3f' % ('extend()', n, new)
+    print 'speedup: %.1fx' % (old / new)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
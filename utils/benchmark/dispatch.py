@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark event dispatching (gaphor.services.componentregistry).
+
+Attribute change events are sent through the component registry and the
+number of events per second is printed, both for events handed to
+handle() directly and for events caused by changing the name of model
+elements. This is done twice: once the way the registry used to dispatch
+events (looking up event filters and handlers for every event) and once
+with the lookups cached per event class.
+
+This can be called as:
+    python utils/benchmark/dispatch.py [events]
+
+This file is part of Gaphor.
+"""
+
+import sys
+import time
+
+try:
+    import env
+except ImportError:
+    pass
+
+from gaphor import UML
+from gaphor.interfaces import IEventFilter
+from gaphor.services.componentregistry import ZopeComponentRegistry
+
+EVENTS = 100000
+
+
+class UncachedComponentRegistry(ZopeComponentRegistry):
+    """
+    Dispatch events like the component registry used to.
+    """
+
+    def _filter(self, objects):
+        filtered = list(objects)
+        for o in objects:
+            for adapter in self._components.subscribers(objects, IEventFilter):
+                if adapter.filter():
+                    filtered.remove(o)
+                    break
+        return filtered
+
+    def handle(self, *events):
+        objects = self._filter(events)
+        if objects:
+            map(self._components.handle, objects)
+
+
+def handle_events(registry, n):
+    factory = UML.ElementFactory()
+    c = factory.create(UML.Class)
+    event = UML.event.AttributeChangeEvent(c, UML.Class.name, 'a', 'b')
+    handle = registry.handle
+    start = time.time()
+    for i in xrange(n):
+        handle(event)
+    return time.time() - start
+
+
+def change_attributes(registry, n):
+    factory = UML.ElementFactory()
+    classes = [ factory.create(UML.Class) for i in xrange(100) ]
+    start = time.time()
+    for i in xrange(n):
+        classes[i % 100].name = 'name%d' % i
+    return time.time() - start
+
+
+def measure(registry_class, n):
+    registry = registry_class()
+    registry.init(None)
+    try:
+        return handle_events(registry, n), change_attributes(registry, n)
+    finally:
+        registry.shutdown()
+
+
+def report(name, n, t):
+    print '%-36s %10.3f %14d' % (name, t, n / t)
+
+
+def main(args):
+    n = int(args[0]) if args else EVENTS
+    old_handle, old_change = measure(UncachedComponentRegistry, n)
+    new_handle, new_change = measure(ZopeComponentRegistry, n)
+    print '%-36s %10s %14s' % ('events', 'time (s)', 'events/s')
+    report('handle(), uncached lookups', n, old_handle)
+    report('handle(), cached lookups', n, new_handle)
+    report('attribute changes, uncached lookups', n, old_change)
+    report('attribute changes, cached lookups', n, new_change)
+    print 'speedup: %.1fx (handle), %.1fx (attribute changes)' % (
+            old_handle / new_handle, old_change / new_change)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
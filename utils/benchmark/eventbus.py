@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark the event bus (gaphor.services.eventbus).
+
+A number of listeners, like the diagram tabs of open diagrams, are
+interested in the name of one diagram each. The names of other elements
+are changed and the number of changes per second is printed. This is done
+twice: once with every listener registered as a zope.component handler
+that checks every attribute change event (as the diagram tabs used to do)
+and once with the listeners subscribed to the event bus for the name of
+their diagram only.
+
+This can be called as:
+    python utils/benchmark/eventbus.py [changes] [listeners]
+
+This file is part of Gaphor.
+"""
+
+import sys
+import time
+
+try:
+    import env
+except ImportError:
+    pass
+
+from zope import component
+from gaphor import UML
+from gaphor.UML.interfaces import IAttributeChangeEvent
+from gaphor.services.eventbus import EventBus
+
+CHANGES = 20000
+LISTENERS = 50
+
+
+class Listener(object):
+
+    def __init__(self, diagram):
+        self.diagram = diagram
+        self.changes = 0
+
+    @component.adapter(IAttributeChangeEvent)
+    def on_element_change(self, event):
+        if event.element is self.diagram and \
+                event.property is UML.Diagram.name:
+            self.changes += 1
+
+    def on_name_change(self, event):
+        self.changes += 1
+
+
+def change_names(factory, n):
+    classes = [ factory.create(UML.Class) for i in xrange(100) ]
+    start = time.time()
+    for i in xrange(n):
+        classes[i % 100].name = 'name%d' % i
+    return time.time() - start
+
+
+def zope_handlers(factory, listeners, n):
+    gsm = component.getGlobalSiteManager()
+    for l in listeners:
+        gsm.registerHandler(l.on_element_change)
+    try:
+        return change_names(factory, n)
+    finally:
+        for l in listeners:
+            gsm.unregisterHandler(l.on_element_change)
+
+
+def event_bus(factory, listeners, n):
+    bus = EventBus()
+    for l in listeners:
+        bus.subscribe(l.on_name_change, IAttributeChangeEvent,
+                      property=UML.Diagram.name, element=l.diagram)
+    gsm = component.getGlobalSiteManager()
+    gsm.registerHandler(bus.handle)
+    try:
+        return change_names(factory, n)
+    finally:
+        gsm.unregisterHandler(bus.handle)
+
+
+def report(name, n, t):
+    print '%-24s %10.3f %14d' % (name, t, n / t)
+
+
+def main(args):
+    n = int(args[0]) if args else CHANGES
+    m = int(args[1]) if len(args) > 1 else LISTENERS
+    factory = UML.ElementFactory()
+    listeners = [ Listener(factory.create(UML.Diagram)) for i in xrange(m) ]
+    print '%d listeners' % m
+    print '%-24s %10s %14s' % ('dispatch', 'time (s)', 'changes/s')
+    old = zope_handlers(factory, listeners, n)
+    report('zope.component handlers', n, old)
+    new = event_bus(factory, listeners, n)
+    report('event bus', n, new)
+    print 'speedup: %.1fx' % (old / new)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark the delivery of change events to derived properties
+(gaphor.UML.properties).
+
+Attribute values and associations of model elements are changed and the
+number of changes per second is printed. This is done twice: once with
+every derived property and redefine registered as an event handler of its
+own (as it used to be) and once with the subset dispatcher, that only
+delivers an event to the derived properties that depend on the changed
+property.
+
+This can be called as:
+    python utils/benchmark/events.py [changes]
+
+This file is part of Gaphor.
+"""
+
+import sys
+import time
+
+try:
+    import env
+except ImportError:
+    pass
+
+from zope import component
+from gaphor import UML
+from gaphor.UML.properties import dispatcher
+
+CHANGES = 100000
+
+
+def dependents():
+    """Return all derived properties and redefines known by the dispatcher.
+    """
+    deps = set()
+    for d in dispatcher._dependents.values():
+        deps.update(d)
+    return deps
+
+
+def per_property_handlers(deps):
+    """Register a handler for every derived property, instead of the
+    dispatcher.
+    """
+    gsm = component.getGlobalSiteManager()
+    gsm.unregisterHandler(dispatcher.handle)
+    for d in deps:
+        component.provideHandler(d._association_changed,
+                                 adapts=(UML.interfaces.IElementChangeEvent,))
+
+
+def dispatcher_handler(deps):
+    gsm = component.getGlobalSiteManager()
+    for d in deps:
+        gsm.unregisterHandler(d._association_changed,
+                              required=(UML.interfaces.IElementChangeEvent,))
+    component.provideHandler(dispatcher.handle)
+
+
+def change_attributes(n):
+    factory = UML.ElementFactory()
+    classes = [ factory.create(UML.Class) for i in xrange(100) ]
+    start = time.time()
+    for i in xrange(n):
+        classes[i % 100].name = 'name%d' % i
+    return time.time() - start
+
+
+def change_associations(n):
+    factory = UML.ElementFactory()
+    package = factory.create(UML.Package)
+    classes = [ factory.create(UML.Class) for i in xrange(100) ]
+    start = time.time()
+    for i in xrange(n / 2):
+        c = classes[i % 100]
+        c.package = package
+        del c.package
+    return time.time() - start
+
+
+def report(name, n, t):
+    print '%-36s %10.3f %14d' % (name, t, n / t)
+
+
+def main(args):
+    n = int(args[0]) if args else CHANGES
+    deps = dependents()
+    print '%d derived properties and redefines' % len(deps)
+    print '%-36s %10s %14s' % ('changes', 'time (s)', 'changes/s')
+
+    per_property_handlers(deps)
+    try:
+        old_attrs = change_attributes(n)
+        old_assocs = change_associations(n / 10)
+    finally:
+        dispatcher_handler(deps)
+    new_attrs = change_attributes(n)
+    new_assocs = change_associations(n / 10)
+
+    report('attributes, handler per property', n, old_attrs)
+    report('attributes, subset dispatcher', n, new_attrs)
+    report('associations, handler per property', n / 10, old_assocs)
+    report('associations, subset dispatcher', n / 10, new_assocs)
+    print 'speedup: %.1fx (attributes), %.1fx (associations)' % (
+            old_attrs / new_attrs, old_assocs / new_assocs)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
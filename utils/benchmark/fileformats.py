@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Compare the .gaphor (XML) file format with binary snapshots
+(gaphor.storage.snapshot).
+
+For each model the file size and the time needed to read the file into
+parser objects is printed, for both formats. Building the model from the
+parser objects is the same for both formats and is not measured.
+
+Models can be given as file names or as a number of elements, in which case
+a synthetic model is generated (see parsing.py).
+
+This can be called as:
+    python utils/benchmark/fileformats.py [size|file ...]
+
+This file is part of Gaphor.
+"""
+
+import os.path
+import sys
+import time
+from cStringIO import StringIO
+
+try:
+    import env
+except ImportError:
+    pass
+
+from gaphor.storage import parser, snapshot
+from parsing import generate_model
+
+SIZES = (1000, 10000, 100000)
+
+
+def timed(func, data):
+    loader = parser.GaphorLoader()
+    start = time.time()
+    for progress in func(StringIO(data), loader):
+        pass
+    return time.time() - start
+
+
+def main(args):
+    print '%-24s %10s %10s %10s %10s %10s' % ('model', 'xml (kB)',
+            'snap (kB)', 'xml (s)', 'snap (s)', 'speedup')
+    for arg in args or SIZES:
+        if os.path.exists(str(arg)):
+            name = os.path.basename(arg)
+            xml = open(arg, 'rb').read()
+        else:
+            name = 'synthetic %s' % arg
+            xml = generate_model(int(arg))
+        out = StringIO()
+        snapshot.xml_to_snapshot(StringIO(xml), out)
+        snap = out.getvalue()
+
+        xml_time = timed(parser.parse_generator, xml)
+        snap_time = timed(snapshot.parse_generator, snap)
+        print '%-24s %10d %10d %10.3f %10.3f %9.1fx' % (name,
+                len(xml) / 1024, len(snap) / 1024, xml_time, snap_time,
+                xml_time / snap_time)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
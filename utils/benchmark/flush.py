@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark flushing the element factory (gaphor.UML.elementfactory).
+
+A model of packages with classes and attributes is created and the time
+needed to flush it (which unlinks every element) is printed.
+
+The element factory keeps its elements in an ordered dictionary
+(gaphor.misc.odict). For comparison the flush is also timed with the old
+list backed ordered dictionary, where every delete is O(n). Since that is
+quadratic, the comparison is done on a smaller model.
+
+This can be called as:
+    python utils/benchmark/flush.py [elements [compare-elements]]
+
+This file is part of Gaphor.
+"""
+
+import sys
+import time
+
+try:
+    import env
+except ImportError:
+    pass
+
+from gaphor import UML
+
+ELEMENTS = 100000
+COMPARE_ELEMENTS = 10000
+
+
+class listodict(dict):
+    """The old odict: keys are kept in a list, deletion is O(n).
+    """
+    def __init__(self):
+        self._keys = []
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._keys.remove(key)
+
+    def __setitem__(self, key, item):
+        if not dict.__contains__(self, key): self._keys.append(key)
+        dict.__setitem__(self, key, item)
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return map(self.get, self._keys)
+
+
+def create_model(factory, n):
+    """Create a model of about n elements: packages of 10 classes with 4
+    attributes each.
+    """
+    package = None
+    for i in xrange(n / 5):
+        if i % 10 == 0:
+            package = factory.create(UML.Package)
+            package.name = 'package%d' % i
+        c = factory.create(UML.Class)
+        c.name = 'Class%d' % i
+        c.package = package
+        for j in xrange(4):
+            a = factory.create(UML.Property)
+            a.name = 'attr%d' % j
+            c.ownedAttribute = a
+
+
+def timed_flush(n, store=None):
+    factory = UML.ElementFactory()
+    if store:
+        factory._elements = store()
+    create_model(factory, n)
+    size = factory.size()
+    start = time.time()
+    factory.flush()
+    assert factory.size() == 0
+    return size, time.time() - start
+
+
+def main(args):
+    n = int(args[0]) if args else ELEMENTS
+    m = int(args[1]) if len(args) > 1 else COMPARE_ELEMENTS
+
+    print '%-20s %10s %10s %14s' % ('store', 'elements', 'flush (s)',
+            'usec/element')
+    size, t = timed_flush(n)
+    print '%-20s %10d %10.3f %14.2f' % ('odict', size, t, t * 1e6 / size)
+
+    size, new = timed_flush(m)
+    print '%-20s %10d %10.3f %14.2f' % ('odict', size, new, new * 1e6 / size)
+    size, old = timed_flush(m, listodict)
+    print '%-20s %10d %10.3f %14.2f' % ('list odict (old)', size, old,
+            old * 1e6 / size)
+    print 'speedup at %d elements: %.1fx' % (size, old / new)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
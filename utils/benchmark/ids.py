@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark element ids (gaphor.UML.elementfactory).
+
+Elements are created and looked up by id, with three kinds of ids:
+uuid1 strings (as every element used to get), the batch allocated string
+ids the element factory uses now and the compact integer ids of an
+element factory created with compact_ids=True. For compact ids the time
+needed to give every element a persistent id (as is done when the model
+is saved) is printed as well.
+
+This can be called as:
+    python utils/benchmark/ids.py [elements]
+
+This file is part of Gaphor.
+"""
+
+import sys
+import time
+import uuid
+
+try:
+    import env
+except ImportError:
+    pass
+
+from gaphor import UML
+
+ELEMENTS = 100000
+
+
+def create(factory, n, uuid1=False):
+    start = time.time()
+    if uuid1:
+        for i in xrange(n):
+            factory.create_as(UML.Comment, str(uuid.uuid1()))
+    else:
+        for i in xrange(n):
+            factory.create(UML.Comment)
+    return time.time() - start
+
+
+def lookup(factory):
+    ids = factory.keys()
+    lookup = factory.lookup
+    start = time.time()
+    for id in ids:
+        lookup(id)
+    return time.time() - start
+
+
+def persist(factory):
+    persistent_id = factory.persistent_id
+    ids = factory.keys()
+    start = time.time()
+    for id in ids:
+        persistent_id(id)
+    return time.time() - start
+
+
+def id_size(factory):
+    return sum(sys.getsizeof(id) for id in factory.iterkeys()) / factory.size()
+
+
+def main(args):
+    n = int(args[0]) if args else ELEMENTS
+    print '%-16s %12s %12s %12s %14s' % ('ids', 'create (s)', 'lookup (s)',
+            'persist (s)', 'bytes/id')
+    for name, compact, uuid1 in (('uuid1', False, True),
+                                 ('batch uuid', False, False),
+                                 ('compact', True, False)):
+        factory = UML.ElementFactory(compact_ids=compact)
+        t_create = create(factory, n, uuid1)
+        t_lookup = lookup(factory)
+        size = id_size(factory)
+        t_persist = persist(factory)
+        print '%-16s %12.3f %12.3f %12.3f %14d' % (name, t_create, t_lookup,
+                t_persist, size)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
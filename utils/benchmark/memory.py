@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark the memory used by model elements (gaphor.UML).
+
+For a number of element types, elements are created and given some typical
+values (a name, an owner and, for some types, a related element). The
+growth of the process size divided by the number of elements is printed,
+as well as the size of the element object itself and of its __dict__ (if
+it has one). The classes generated in gaphor.UML.uml2 store property
+values in __slots__, so most elements do not have a __dict__ at all.
+
+The process size is read from /proc and every measurement is done in a
+child process, so this only works on Linux.
+
+This can be called as:
+    python utils/benchmark/memory.py [elements]
+
+This file is part of Gaphor.
+"""
+
+import gc
+import os
+import sys
+
+try:
+    import env
+except ImportError:
+    pass
+
+from gaphor import UML
+
+ELEMENTS = 50000
+
+
+def process_size():
+    """Return the resident size of the process in bytes.
+    """
+    f = open('/proc/self/statm')
+    try:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    finally:
+        f.close()
+
+
+def populate(factory, type, n):
+    """Create n elements of type, with the values an element of that type
+    typically has in a model.
+    """
+    elements = []
+    for i in xrange(n):
+        if i % 100 == 0:
+            package = factory.create(UML.Package)
+            owner = factory.create(UML.Class)
+        e = factory.create(type)
+        if isinstance(e, UML.NamedElement):
+            e.name = 'element%d' % i
+        if isinstance(e, UML.Type):
+            e.package = package
+        elif isinstance(e, UML.Property):
+            e.class_ = owner
+        elif isinstance(e, UML.Comment):
+            e.body = 'comment %d' % i
+        elif isinstance(e, UML.Dependency):
+            e.supplier = package
+        # Fill the caches of the derived unions
+        e.owner
+        elements.append(e)
+    return elements
+
+
+def element_size(e):
+    size = sys.getsizeof(e)
+    if e.__dict__:
+        size += sys.getsizeof(e.__dict__)
+    return size
+
+
+def measure(type, n):
+    """Measure the memory used by n elements of type. This is done in a
+    child process, so memory freed by earlier measurements is not reused.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        factory = UML.ElementFactory()
+        gc.collect()
+        before = process_size()
+        elements = populate(factory, type, n)
+        gc.collect()
+        grown = process_size() - before
+        e = elements[-1]
+        os.write(w, '%d %d %d' % (grown / n, element_size(e), bool(e.__dict__)))
+        os._exit(0)
+    os.close(w)
+    result = os.read(r, 100)
+    os.close(r)
+    os.waitpid(pid, 0)
+    return map(int, result.split())
+
+
+def main(args):
+    n = int(args[0]) if args else ELEMENTS
+    types = (UML.Class, UML.Property, UML.Operation, UML.Package,
+             UML.Association, UML.Dependency, UML.Comment, UML.Actor,
+             UML.ForkNode)
+    print '%-16s %16s %16s %8s' % ('type', 'bytes/element', 'object size',
+            '__dict__')
+    for type in types:
+        grown, size, has_dict = measure(type, n)
+        print '%-16s %16d %16d %8s' % (type.__name__, grown, size,
+                has_dict and 'yes' or 'no')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark the Gaphor file parser (gaphor.storage.parser).
+
+A synthetic model is generated in memory for a number of sizes. Each model
+consists of one root package owning N classes; every class has a name,
+a documentation comment and a reference back to its package. The time needed
+to parse the model is printed, together with the time per element. When the
+parser scales linearly, the time per element stays (roughly) constant.
+
+Both the xml.sax based reader and the pyexpat reader are measured.
+Instead of sizes, model files can be given (e.g. gaphor/UML/uml2.gaphor).
+
+This can be called as:
+    python utils/benchmark/parsing.py [size|file ...]
+
+This file is part of Gaphor.
+"""
+
+import os.path
+import sys
+import time
+from cStringIO import StringIO
+
+try:
+    import env
+except ImportError:
+    pass
+
+from gaphor.storage import parser
+
+SIZES = (1000, 10000, 100000, 500000)
+
+
+def generate_model(size):
+    """Return the XML data of a model with ``size`` elements.
+    """
+    out = StringIO()
+    w = out.write
+    w('<?xml version="1.0" encoding="utf-8"?>\n')
+    w('<gaphor xmlns="http://gaphor.sourceforge.net/model" version="3.0"'
+      ' gaphor-version="0.17.1">\n')
+    w('<Package id="root"><name><val>root</val></name>'
+      '<ownedType><reflist>')
+    for n in xrange(size):
+        w('<ref refid="c%d"/>' % n)
+    w('</reflist></ownedType></Package>\n')
+    for n in xrange(size):
+        w('<Class id="c%d"><name><val>Class%d</val></name>'
+          '<isAbstract><val>0</val></isAbstract>'
+          '<package><ref refid="root"/></package></Class>\n' % (n, n))
+    w('</gaphor>\n')
+    return out.getvalue()
+
+
+def sax_engine(loader):
+    return parser.sax_parser(loader), 512
+
+
+def expat_engine(loader):
+    return parser.ExpatReader(loader), parser.BLOCK_SIZE
+
+
+def benchmark(data, engine):
+    """Parse a model. Returns the time in seconds and the number of
+    elements read.
+    """
+    loader = parser.GaphorLoader()
+    reader, block_size = engine(loader)
+    start = time.time()
+    for progress in parser.parse_file(StringIO(data), reader, block_size):
+        pass
+    return time.time() - start, len(loader.elements)
+
+
+def main(args):
+    print '%-24s %10s %10s %10s %8s %14s' % ('model', 'elements',
+            'sax (s)', 'expat (s)', 'speedup', 'usec/element')
+    for arg in args or SIZES:
+        if os.path.exists(str(arg)):
+            name = os.path.basename(arg)
+            data = open(arg, 'rb').read()
+        else:
+            name = 'synthetic'
+            data = generate_model(int(arg))
+        sax, size = benchmark(data, sax_engine)
+        fast, size = benchmark(data, expat_engine)
+        print '%-24s %10d %10.3f %10.3f %7.1fx %14.2f' % (name, size,
+                sax, fast, sax / fast, fast * 1e6 / size)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
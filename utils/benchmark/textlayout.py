@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark text layouts (gaphor.diagram.textelement).
+
+The texts of a class diagram (names, stereotypes, attributes and
+operations) are measured and drawn a number of times, as is done when the
+diagram is updated and redrawn while scrolling. This is done with the
+layout cache and with a cache that is cleared before every call, which is
+how text used to be laid out. The time needed and the number of cache hits
+and misses are printed. A cache that is smaller than the number of distinct
+texts never hits, since the texts are drawn in the same order on every
+redraw.
+
+This can be called as:
+    python utils/benchmark/textlayout.py [items] [redraws] [cache size]
+
+This file is part of Gaphor.
+"""
+
+import sys
+import time
+
+try:
+    import env
+except ImportError:
+    pass
+
+import cairo
+from gaphor.diagram import textelement
+from gaphor.diagram.textelement import TextLayoutCache, text_extents, \
+        text_align, LAYOUT_CACHE_SIZE
+
+ITEMS = 2000
+REDRAWS = 5
+
+
+def diagram_texts(n):
+    """
+    Return the texts (and fonts) of ``n`` class items.
+    """
+    texts = []
+    for i in xrange(n):
+        texts.append(('Class%d' % i, 'sans bold 10'))
+        texts.append((u'\xabentity\xbb', 'sans 10'))
+        for j in xrange(4):
+            texts.append(('+ attribute%d: String' % j, 'sans 10'))
+            texts.append(('+ operation%d(param: Integer)' % j, 'sans 10'))
+    return texts
+
+
+def redraw(cr, texts, redraws, clear):
+    cache = textelement.layout_cache
+    start = time.time()
+    for i in xrange(redraws):
+        for text, font in texts:
+            if clear:
+                cache.clear()
+            text_extents(cr, text, font=font)
+            text_align(cr, 0, 0, text, font, align_x=1, align_y=1)
+    return time.time() - start
+
+
+def main(args):
+    n = int(args[0]) if args else ITEMS
+    redraws = int(args[1]) if len(args) > 1 else REDRAWS
+    size = int(args[2]) if len(args) > 2 else LAYOUT_CACHE_SIZE
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 200, 200)
+    cr = cairo.Context(surface)
+    texts = diagram_texts(n)
+
+    print '%d texts, %d redraws, cache size %d' % (len(texts), redraws, size)
+    print '%-16s %12s %12s %12s' % ('layouts', 'time (s)', 'hits', 'misses')
+    for name, clear in (('uncached', True), ('cached', False)):
+        textelement.layout_cache = TextLayoutCache(size)
+        t = redraw(cr, texts, redraws, clear)
+        cache = textelement.layout_cache
+        print '%-16s %12.3f %12d %12d' % (name, t, cache.hits, cache.misses)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# vim:sw=4:et:
+"""Benchmark the lookup of UML properties on model elements
+(gaphor.UML.element).
+
+One element is created for every class of the UML metamodel
+(gaphor.UML.uml2). For each element, save() and postload() are timed twice:
+once by looking up the properties through dir() on every call (as
+Element.umlproperties() used to do) and once with the cached per class
+property plans. The time per element is printed.
+
+This can be called as:
+    python utils/benchmark/umlproperties.py [rounds]
+
+This file is part of Gaphor.
+"""
+
+import sys
+import time
+
+try:
+    import env
+except ImportError:
+    pass
+
+from gaphor import UML
+from gaphor.UML.element import Element
+from gaphor.UML.properties import umlproperty
+
+ROUNDS = 100
+
+
+def dir_umlproperties(element):
+    """Look up UML properties the old way, with dir() on every call.
+    """
+    class_ = type(element)
+    for propname in dir(class_):
+        if not propname.startswith('_'):
+            prop = getattr(class_, propname)
+            if isinstance(prop, umlproperty):
+                yield prop
+
+
+def dir_save(element, save_func):
+    for prop in dir_umlproperties(element):
+        prop.save(element, save_func)
+
+
+def dir_postload(element):
+    for prop in dir_umlproperties(element):
+        prop.postload(element)
+
+
+def plan_save(element, save_func):
+    element.save(save_func)
+
+
+def plan_postload(element):
+    element.postload()
+
+
+def create_elements():
+    """Return an element for every class in the UML metamodel.
+    """
+    factory = UML.ElementFactory()
+    elements = []
+    for name in dir(UML.uml2):
+        cls = getattr(UML.uml2, name)
+        if isinstance(cls, type) and issubclass(cls, Element) \
+                and cls.__module__ == UML.uml2.__name__:
+            elements.append(factory.create(cls))
+    return elements
+
+
+def benchmark(elements, rounds, save, postload):
+    def save_func(name, value):
+        pass
+    start = time.time()
+    for i in xrange(rounds):
+        for e in elements:
+            save(e, save_func)
+            postload(e)
+    return time.time() - start
+
+
+def main(args):
+    rounds = int(args[0]) if args else ROUNDS
+    elements = create_elements()
+    n = len(elements) * rounds
+    props = sum(len(type(e).umlplan().all) for e in elements)
+    print '%d classes, %.1f properties per class, %d rounds' % (
+            len(elements), float(props) / len(elements), rounds)
+
+    old = benchmark(elements, rounds, dir_save, dir_postload)
+    new = benchmark(elements, rounds, plan_save, plan_postload)
+    print '%-20s %10s %14s' % ('lookup', 'time (s)', 'usec/element')
+    print '%-20s %10.3f %14.2f' % ('dir()', old, old * 1e6 / n)
+    print '%-20s %10.3f %14.2f' % ('property plans', new, new * 1e6 / n)
+    print 'speedup: %.1fx' % (old / new)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -57,6 +57,12 @@ def camelCase_to_underscore(str):
 _ = camelCase_to_underscore
 
 
+# Instances of these classes and their subclasses can change class at
+# runtime (ElementFactory.swap_element()). That is only possible between
+# classes with the same instance layout, so these classes get no slots.
+swappable = ('ControlNode', 'Dependency')
+
+
 def msg(s):
     sys.stderr.write('  ')
     sys.stderr.write(s)
@@ -72,13 +78,94 @@ class Writer:
             self.out = hasattr(filename, 'write') and filename or open(filename, 'w')
         else:
             self.out = sys.stdout
+        # Output is held back until close(), since the __slots__ of the
+        # classes are only known when all properties have been written.
+        # Class definitions are kept as (name, generalizations) tuples.
+        self.data = []
+        self.classdefs = []
+        self.storage = {}
 
     def write(self, data):
-        self.out.write(data)
+        self.data.append(data)
 
     def close(self):
+        slots = self.class_slots()
+        for data in self.data:
+            if type(data) is tuple:
+                name, bases = data
+                if slots.get(name):
+                    data = 'class %s(%s):\n    __slots__ = %r\n' % (name, ', '.join(bases), slots[name])
+                else:
+                    data = 'class %s(%s): pass\n' % (name, ', '.join(bases))
+            self.out.write(data)
         self.out.close()
 
+    def add_storage(self, full_name):
+        """
+        Register the instance attribute used by property full_name
+        (Class.attribute) to store its value.
+        """
+        class_name, name = full_name.split('.')
+        self.storage.setdefault(class_name, set()).add('_' + str(name))
+
+    def class_slots(self):
+        """
+        Return the __slots__ of the generated classes as a dict: class name
+        -> tuple of attribute names. Element instances store the values of
+        their properties in slots, so no per instance dictionary is needed
+        (Element has a __dict__ slot for all other attributes).
+
+        Python allows only one chain of classes with slots among the
+        bases of a class. Classes are processed parents first. If the
+        bases of a class have conflicting slots, the chain with the most
+        slots is kept, the others lose their slots and the layout is
+        calculated again. The attributes of classes without slots are
+        added to the slots of their subclasses.
+        """
+        ancestors = {}
+        for name, bases, overridden in self.classdefs:
+            a = set([name])
+            for b in bases:
+                a.update(ancestors.get(b, ()))
+            ancestors[name] = a
+
+        slotted = set(name for name, bases, overridden in self.classdefs
+                      if not overridden)
+        for name, bases, overridden in self.classdefs:
+            if ancestors[name].intersection(swappable):
+                slotted.discard(name)
+
+        while True:
+            # solid: the class that provides the deepest slots, None for
+            # Element. provided: the attributes stored in slots.
+            solid = {}
+            provided = { None: set() }
+            slots = {}
+            for name, bases, overridden in self.classdefs:
+                solids = [ solid.get(b) for b in bases if solid.get(b) ]
+                deepest = None
+                for s in solids:
+                    if deepest is None or len(provided[s]) > len(provided[deepest]):
+                        deepest = s
+                conflicts = [ s for s in solids if s not in ancestors[deepest] ]
+                if conflicts:
+                    msg('slots of %s conflict, removing slots from %s' % (name, ', '.join(conflicts)))
+                    slotted.difference_update(conflicts)
+                    break
+
+                names = set()
+                for a in ancestors[name]:
+                    names.update(self.storage.get(a, ()))
+                names.difference_update(provided[deepest])
+                if name in slotted and names:
+                    solid[name] = name
+                    slots[name] = tuple(sorted(names))
+                    provided[name] = provided[deepest].union(names)
+                else:
+                    solid[name] = deepest
+            else:
+                return slots
+
     def write_classdef(self, clazz):
         """
         Write a class definition (class xx(x): pass).
@@ -87,22 +174,25 @@ class Writer:
         once.
         """
         if not clazz.written:
-            s = ''
+            bases = []
             for g in clazz.generalization:
                 self.write_classdef(g)
-                if s: s += ', '
-                s = s + g['name']
-            if not s: s = 'object'
-            if not self.overrides.write_override(self, clazz['name']):
-                self.write('class %s(%s): pass\n' % (clazz['name'], s))
+                bases.append(g['name'])
+            overridden = self.overrides.write_override(self, clazz['name'])
+            if not overridden:
+                self.write((clazz['name'], bases or ['object']))
+            self.classdefs.append((clazz['name'], bases, overridden))
         clazz.written = True
 
-    def write_property(self, full_name, value):
+    def write_property(self, full_name, value, storage=True):
         """
         Write a property to the file. If the property is overridden, use the
         overridden value. full_name should be like Class.attribute. value is
-        free format text.
+        free format text. If storage is True the property stores its value
+        in an attribute of the element.
         """
+        if storage:
+            self.add_storage(full_name)
         if not self.overrides.write_override(self, full_name):
             self.write('%s = %s\n' % (full_name, value))
 
@@ -148,6 +238,7 @@ class Writer:
 
         full_name = "%s.%s" % (a.class_name, a.name)
         if self.overrides.has_override(full_name):
+            self.add_storage(full_name)
             self.overrides.write_override(self, full_name)
         elif eval(a.isDerived or '0'):
             msg('ignoring derived attribute %s.%s: no definition' % (a.class_name, a.name))
@@ -236,7 +327,8 @@ class Writer:
         False by write_association().
         """
         self.write_property("%s.%s" % (r.class_name, r.name),
-                            "redefine(%s, '%s', %s, %s)" % (r.class_name, r.name, r.opposite_class_name, r.redefines))
+                            "redefine(%s, '%s', %s, %s)" % (r.class_name, r.name, r.opposite_class_name, r.redefines),
+                            storage=False)
 
 
 def parse_association_name(name):